@@ -0,0 +1,286 @@
+"""Benchmark the pipeline stages on synthetic media and compare the run against a stored baseline.
+
+Usage: python -m benchmarks.run [--cases sd_stereo,uhd_hdr] [--repeat 3] [--output run.json]
+                                [--baseline benchmarks/baseline.json] [--save-baseline]
+"""
+
+import argparse
+from dataclasses import asdict, dataclass
+from datetime import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.synthetic import CASES, Case, generate
+from utils.log import log
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ("mp4", "audio", "video")
+DEFAULT_WORK_DIR = os.path.join(tempfile.gettempdir(), "av1_benchmarks")
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+# Relative slowdown (or memory growth) reported as a regression
+DEFAULT_TOLERANCE = 0.10
+# Wall time differences below this many seconds are noise, whatever the ratio
+MIN_WALL_DELTA = 0.25
+# Metrics compared with the baseline, lower is better for both
+COMPARED = ("wall_time", "peak_rss")
+# 2: stage wall time, encode fps and chars read/written measured inside the stage, see benchmarks.stage
+FORMAT_VERSION = 2
+
+@dataclass
+class StageMeasure:
+    """Class representing the measures of one stage on one case.
+
+    wall_time is the stage itself, without the interpreter startup; fps is the frame count
+    the AV1 encoder reported through `-progress` over its own wall time (0 for the other
+    stages). bytes_read / bytes_written are the rchar / wchar counters of the stage and
+    its ffmpeg children, so reads served by the page cache count too; input_bytes /
+    output_bytes are the logical sizes of the files the stage consumed and produced.
+    """
+    success: bool
+    wall_time: float = 0.0
+    encode_time: float = 0.0
+    fps: float = 0.0
+    input_bytes: int = 0
+    output_bytes: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    peak_rss: int = 0
+
+def measure(command: list[str], log_path: str) -> tuple[bool, float, object]:
+    """ Run a command and collect the resource usage of its whole process tree.
+
+    Args:
+        command (list[str]): command to run from the repository root
+        log_path (str): file receiving its output
+
+    Returns:
+        tuple[bool, float, object]: success, wall time in seconds, rusage of the process and
+            of the children it waited for (ru_maxrss is the largest of them)
+    """
+    start = time.perf_counter()
+    with open(log_path, "w", encoding="utf-8") as output:
+        process = subprocess.Popen(command, cwd=ROOT, stdout=output, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode == 0, wall_time, usage
+
+def stage_command(stage: str, input_path: str, output: str, index_dir: str, report_path: str,
+                  encoders: list[str] | None = None) -> list[str]:
+    """Command running one stage in a fresh interpreter, see benchmarks.stage."""
+    command = [sys.executable, "-m", "benchmarks.stage", stage, input_path, output, "--index-dir", index_dir,
+               "--report", report_path]
+    if encoders:
+        command += ["--encoders", ",".join(encoders)]
+    return command
+
+def read_report(path: str) -> dict:
+    """Measures written by benchmarks.stage, empty if the stage died before writing them."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def run_case_once(case: Case, source: str, run_dir: str, encoders: list[str] | None = None) -> dict[str, StageMeasure]:
+    """ Run the three stages one after the other on a source, each on the output of the previous one.
+
+    Args:
+        case (Case): synthetic case
+        source (str): generated source file
+        run_dir (str): empty folder for the outputs
+        encoders (list[str] | None, optional): AV1 encoders of the video stage
+
+    Returns:
+        dict[str, StageMeasure]: measures per stage; the stages after a failure are missing
+    """
+    mp4 = os.path.join(run_dir, os.path.basename(source).rsplit(".", 1)[0] + ".mp4")
+    plan = [
+        ("mp4", source, run_dir, mp4),
+        ("audio", mp4, os.path.join(run_dir, "audio.mp4"), os.path.join(run_dir, "audio.mp4")),
+        ("video", os.path.join(run_dir, "audio.mp4"), os.path.join(run_dir, "av1.mp4"), os.path.join(run_dir, "av1.mp4")),
+    ]
+    measures = {}
+    for stage, input_path, output, produced in plan:
+        report_path = os.path.join(run_dir, f"{stage}.json")
+        command = stage_command(stage, input_path, output, os.path.join(run_dir, "packet_index"), report_path,
+                                encoders)
+        success, wall_time, usage = measure(command, os.path.join(run_dir, f"{stage}.log"))
+        success = success and os.path.isfile(produced)
+        stage_measures = read_report(report_path)
+        encode_time = stage_measures.get("encode_time", 0.0)
+        measures[stage] = StageMeasure(
+            success=success,
+            wall_time=stage_measures.get("wall_time", wall_time),
+            encode_time=encode_time,
+            fps=stage_measures.get("encode_frames", 0) / encode_time if encode_time else 0.0,
+            input_bytes=os.path.getsize(input_path),
+            output_bytes=os.path.getsize(produced) if success else 0,
+            bytes_read=stage_measures.get("read_chars", 0),
+            bytes_written=stage_measures.get("write_chars", 0),
+            peak_rss=usage.ru_maxrss * 1024,
+        )
+        if not success:
+            log(f"Étape {stage} de {case.name} en échec, voir {os.path.join(run_dir, f'{stage}.log')}", "ERROR")
+            break
+    return measures
+
+def run_case(case: Case, work_dir: str, repeat: int = 1, encoders: list[str] | None = None) -> dict[str, dict]:
+    """ Benchmark a case, repeated to smooth out the noise.
+
+    Args:
+        case (Case): synthetic case
+        work_dir (str): folder of the generated media and of the outputs
+        repeat (int, optional): number of runs. Defaults to 1.
+        encoders (list[str] | None, optional): AV1 encoders of the video stage
+
+    Returns:
+        dict[str, dict]: per stage, median wall time, encode time and fps, largest peak RSS,
+            sizes and I/O of the last run
+    """
+    source = generate(case, os.path.join(work_dir, "media"))
+    runs: list[dict[str, StageMeasure]] = []
+    for i in range(max(1, repeat)):
+        run_dir = os.path.join(work_dir, "runs", case.name)
+        shutil.rmtree(run_dir, ignore_errors=True)
+        os.makedirs(run_dir)
+        log(f"{case.name} : passe {i + 1}/{max(1, repeat)}")
+        runs.append(run_case_once(case, source, run_dir, encoders))
+
+    results = {}
+    for stage in STAGES:
+        measures = [run[stage] for run in runs if stage in run]
+        if not measures:
+            continue
+        summary = asdict(measures[-1])
+        summary["success"] = all(m.success for m in measures)
+        summary["wall_time"] = statistics.median(m.wall_time for m in measures)
+        summary["encode_time"] = statistics.median(m.encode_time for m in measures)
+        summary["fps"] = statistics.median(m.fps for m in measures)
+        summary["peak_rss"] = max(m.peak_rss for m in measures)
+        summary["runs"] = len(measures)
+        results[stage] = summary
+    return results
+
+def environment() -> dict:
+    """Description of the machine and of the ffmpeg build, stored with the results."""
+    try:
+        res = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True, check=False)
+        ffmpeg = res.stdout.splitlines()[0] if res.stdout else ""
+    except FileNotFoundError:
+        ffmpeg = ""
+    return {
+        "ffmpeg": ffmpeg,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "node": platform.node(),
+        "cpus": os.cpu_count(),
+    }
+
+def compare(current: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list[dict]:
+    """ Compare a run with a baseline, stage by stage.
+
+    Args:
+        current (dict): results of this run
+        baseline (dict): stored results
+        tolerance (float, optional): relative growth allowed. Defaults to DEFAULT_TOLERANCE.
+
+    Returns:
+        list[dict]: one row per case, stage and metric present in both, with the relative
+            change and a regression flag
+    """
+    rows = []
+    for case_name, stages in current["cases"].items():
+        for stage, measures in stages.items():
+            reference = baseline.get("cases", {}).get(case_name, {}).get(stage)
+            if not reference or not reference.get("success"):
+                continue
+            for metric in COMPARED:
+                before, after = reference.get(metric, 0), measures.get(metric, 0)
+                if not before:
+                    continue
+                change = (after - before) / before
+                regression = change > tolerance or not measures["success"]
+                if metric == "wall_time" and after - before < MIN_WALL_DELTA:
+                    regression = not measures["success"]
+                rows.append({"case": case_name, "stage": stage, "metric": metric, "baseline": before,
+                             "current": after, "change": change, "regression": regression})
+    return rows
+
+def report(results: dict):
+    """Print the measures of a run."""
+    for case_name, stages in results["cases"].items():
+        for stage, m in stages.items():
+            log(f"{case_name:<14} {stage:<6} {m['wall_time']:8.2f} s {m['fps']:8.1f} img/s "
+                f"{m['peak_rss'] / 1024 ** 2:7.0f} Mio RSS "
+                f"{m['input_bytes'] / 1024 ** 2:8.1f} -> {m['output_bytes'] / 1024 ** 2:8.1f} Mio, "
+                f"{m['bytes_read'] / 1024 ** 2:.1f} Mio lus / {m['bytes_written'] / 1024 ** 2:.1f} Mio écrits",
+                "OK" if m["success"] else "ERROR")
+
+def report_comparison(rows: list[dict], current: dict, baseline: dict):
+    """Print the comparison with the baseline, regressions in red."""
+    for key in ("ffmpeg", "cpus", "machine"):
+        if baseline.get("environment", {}).get(key) != current["environment"].get(key):
+            log(f"Environnement différent de la référence ({key}) : comparaison indicative", "WARN")
+    for row in rows:
+        log(f"{row['case']:<14} {row['stage']:<6} {row['metric']:<10} {row['baseline']:>14.2f} -> "
+            f"{row['current']:>14.2f} ({row['change']:+.1%})",
+            "ERROR" if row["regression"] else "OK" if row["change"] < 0 else "INFO")
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Benchmark du pipeline sur des médias synthétiques")
+    parser.add_argument("--cases", type=lambda v: [n.strip() for n in v.split(",") if n.strip()],
+                        default=list(CASES), help=f"cas à exécuter, parmi {', '.join(CASES)}")
+    parser.add_argument("--repeat", type=int, default=1, help="nombre de passes par cas, la médiane est gardée")
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR, help="dossier des médias générés et des sorties")
+    parser.add_argument("--encoders", type=lambda v: [n.strip() for n in v.split(",") if n.strip()],
+                        default=None, help="encodeurs AV1 CPU de l'étape vidéo, ex. libsvtav1")
+    parser.add_argument("--output", default=None, help="fichier JSON recevant les résultats")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="résultats de référence")
+    parser.add_argument("--save-baseline", action="store_true", help="remplacer la référence par ce passage")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="dégradation relative tolérée avant de signaler une régression")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.cases if name not in CASES]
+    if unknown:
+        parser.error(f"cas inconnu(s) : {', '.join(unknown)}")
+    results = {
+        "version": FORMAT_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "repeat": args.repeat,
+        "cases": {},
+    }
+    for name in args.cases:
+        results["cases"][name] = run_case(CASES[name], args.work_dir, args.repeat, args.encoders)
+    report(results)
+
+    for path in filter(None, (args.output, args.baseline if args.save_baseline else None)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        log(f"Résultats écrits dans {path}", "OK")
+
+    failed = any(not m["success"] for stages in results["cases"].values() for m in stages.values())
+    regressed = False
+    if not args.save_baseline and os.path.isfile(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("version") != FORMAT_VERSION:
+            log(f"Référence au format {baseline.get('version')}, comparaison ignorée : "
+                f"relancer avec --save-baseline", "WARN")
+        else:
+            rows = compare(results, baseline, args.tolerance)
+            report_comparison(rows, results, baseline)
+            regressed = any(row["regression"] for row in rows)
+    sys.exit(1 if failed or regressed else 0)
+
+if __name__ == "__main__":
+    main()
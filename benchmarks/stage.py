@@ -0,0 +1,85 @@
+"""Run a single pipeline stage in its own process, so that the benchmark can measure it alone.
+
+Usage: python -m benchmarks.stage {mp4,audio,video} INPUT OUTPUT [--encoders libsvtav1,libaom-av1]
+                                   [--report stage.json]
+"""
+
+import argparse
+from dataclasses import asdict
+import json
+import sys
+from models.convert_to_mp4 import convert_to_mp4
+from models.encoders import DEFAULT_ORDER
+from models.metrics import Span, span
+from models.packet_index import set_index_dir
+from models.transcode_audio import transcode_audio
+from models.transcode_av1 import transcode_video
+from utils.log import log
+
+# CPU AV1 backends, so that runs on different machines stay comparable
+CPU_ENCODERS = ["libsvtav1", "libaom-av1"]
+
+def run_stage(stage: str, input_path: str, output: str, encoders: list[str] | None = None) -> bool:
+    """ Run one stage of the pipeline.
+
+    Args:
+        stage (str): "mp4", "audio" or "video"
+        input_path (str): input file of the stage
+        output (str): output folder for "mp4", output file otherwise
+        encoders (list[str] | None, optional): AV1 encoders of the video stage. Defaults to CPU_ENCODERS.
+
+    Returns:
+        bool: True if the stage succeeded
+    """
+    if stage == "mp4":
+        return convert_to_mp4(input_path, output, log)["success"]
+    if stage == "audio":
+        return transcode_audio(input_path, output, log)
+    if stage == "video":
+        return transcode_video(input_path, output, log, encoders=encoders or CPU_ENCODERS)
+    raise ValueError(f"Étape inconnue : {stage}")
+
+def stage_report(stage: Span) -> dict:
+    """ Measures of a stage taken from its span, without the interpreter startup.
+
+    Args:
+        stage (Span): span of the stage
+
+    Returns:
+        dict: wall time and I/O of the stage, and frames and wall time of its last AV1
+            encode (0 for the stages that do not encode video)
+    """
+    encodes = [child for child in stage.children
+               if any(child["label"].endswith(f"[{name}]") for name in DEFAULT_ORDER)]
+    encode = encodes[-1] if encodes else {}
+    return {
+        "wall_time": stage.usage.wall_time,
+        "read_chars": stage.usage.read_chars,
+        "write_chars": stage.usage.write_chars,
+        "encode_frames": encode.get("frames", 0),
+        "encode_time": encode.get("wall_time", 0.0),
+        "usage": asdict(stage.usage),
+        "children": stage.children,
+    }
+
+def main():
+    """Command line entry point, used by benchmarks.run."""
+    parser = argparse.ArgumentParser(description="Exécuter une seule étape du pipeline")
+    parser.add_argument("stage", choices=("mp4", "audio", "video"))
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--encoders", type=lambda v: [n.strip() for n in v.split(",") if n.strip()], default=None)
+    parser.add_argument("--index-dir", default=None, help="dossier des index de paquets")
+    parser.add_argument("--report", default=None, help="fichier JSON recevant les mesures de l'étape")
+    args = parser.parse_args()
+    if args.index_dir:
+        set_index_dir(args.index_dir)
+    with span("benchmark", args.stage) as current:
+        success = run_stage(args.stage, args.input, args.output, args.encoders)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(stage_report(current), f, indent=2)
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()
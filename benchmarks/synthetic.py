@@ -0,0 +1,165 @@
+"""Deterministic test media generated with the ffmpeg lavfi sources, for the benchmarks."""
+
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+import os
+import subprocess
+
+@dataclass(frozen=True)
+class AudioSpec:
+    """Class representing one audio track of a synthetic file."""
+    layout: str
+    language: str
+    title: str = ""
+
+    @property
+    def codec(self) -> str:
+        """AC-3 like most sources; AC-3 stops at 5.1, so larger layouts are stored as FLAC."""
+        return "flac" if self.layout in ("6.1", "7.1") else "ac3"
+
+@dataclass(frozen=True)
+class Case:
+    """Class representing a synthetic source file: picture, color tagging and track layout."""
+    name: str
+    width: int
+    height: int
+    duration: float
+    rate: int = 24
+    hdr: bool = False
+    # Active picture inside black bars, (width, height); None for a full frame picture
+    picture: tuple[int, int] | None = None
+    audio: tuple[AudioSpec, ...] = ()
+    subtitles: tuple[str, ...] = ()
+
+    @property
+    def frames(self) -> int:
+        """Number of video frames."""
+        return int(round(self.duration * self.rate))
+
+    @property
+    def fingerprint(self) -> str:
+        """Short hash of the case parameters, so that a changed case is generated again."""
+        return hashlib.blake2b(json.dumps(asdict(self), sort_keys=True).encode(), digest_size=6).hexdigest()
+
+CASES: dict[str, Case] = {case.name: case for case in (
+    Case("sd_stereo", 854, 480, 20.0, rate=25,
+         audio=(AudioSpec("stereo", "fre"),), subtitles=("fre",)),
+    Case("hd_multitrack", 1920, 1080, 20.0,
+         audio=(AudioSpec("5.1", "fre", "VFF"), AudioSpec("stereo", "eng"),
+                AudioSpec("stereo", "fre", "Audio description")),
+         subtitles=("fre", "eng", "fre")),
+    Case("hd_letterbox", 1920, 1080, 20.0, picture=(1920, 800),
+         audio=(AudioSpec("5.1", "eng"),), subtitles=("fre",)),
+    Case("uhd_hdr", 3840, 2160, 10.0, hdr=True,
+         audio=(AudioSpec("7.1", "eng"), AudioSpec("5.1", "fre")), subtitles=("fre",)),
+)}
+
+def write_srt(path: str, duration: float, language: str, every: float = 2.0):
+    """ Write a subtitle file with one cue every few seconds.
+
+    Args:
+        path (str): output .srt path
+        duration (float): length covered by the cues, in seconds
+        language (str): language code, written in the cue text
+        every (float, optional): seconds between two cues. Defaults to 2.0.
+    """
+    def timestamp(seconds: float) -> str:
+        millis = int(round(seconds * 1000))
+        return f"{millis // 3600000:02d}:{millis // 60000 % 60:02d}:{millis // 1000 % 60:02d},{millis % 1000:03d}"
+
+    cues = []
+    for i in range(int(duration // every)):
+        start = i * every
+        cues.append(f"{i + 1}\n{timestamp(start)} --> {timestamp(start + every * 0.75)}\n[{language}] Réplique {i + 1}\n")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(cues))
+
+def generate_command(case: Case, output: str, subtitle_paths: list[str]) -> list[str]:
+    """ Build the ffmpeg command writing a synthetic Matroska source.
+
+    Args:
+        case (Case): file to generate
+        output (str): output .mkv path
+        subtitle_paths (list[str]): .srt file of each subtitle track, in order
+
+    Returns:
+        list[str]: ffmpeg command
+    """
+    width, height = case.picture or (case.width, case.height)
+    command = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={case.rate}:duration={case.duration}",
+    ]
+    for i, audio in enumerate(case.audio):
+        command += ["-f", "lavfi", "-i",
+                    f"sine=frequency={220 * (i + 2)}:sample_rate=48000:duration={case.duration},"
+                    f"aformat=channel_layouts={audio.layout}"]
+    for path in subtitle_paths:
+        command += ["-i", path]
+
+    command += ["-map", "0:v"]
+    if case.picture:
+        command += ["-vf", f"pad={case.width}:{case.height}:(ow-iw)/2:(oh-ih)/2:black"]
+    command += ["-c:v", "libx264", "-preset", "veryfast", "-crf", "20", "-g", str(case.rate * 2), "-pix_fmt", "yuv420p"]
+    if case.hdr:
+        # Tags only: enough for detect_hdr, and every libx264 build can write them
+        command += ["-color_primaries", "bt2020", "-color_trc", "smpte2084", "-colorspace", "bt2020nc"]
+
+    for i, audio in enumerate(case.audio):
+        command += [
+            "-map", f"{i + 1}:a",
+            f"-c:a:{i}", audio.codec,
+            f"-metadata:s:a:{i}", f"language={audio.language}",
+        ]
+        if audio.title:
+            command += [f"-metadata:s:a:{i}", f"title={audio.title}"]
+    first_subtitle = 1 + len(case.audio)
+    for i, language in enumerate(case.subtitles):
+        command += [
+            "-map", f"{first_subtitle + i}:s",
+            f"-c:s:{i}", "srt",
+            f"-metadata:s:s:{i}", f"language={language}",
+        ]
+
+    command += [
+        "-map_metadata", "-1",
+        "-fflags", "+bitexact", "-flags:v", "+bitexact", "-flags:a", "+bitexact",
+        output,
+    ]
+    return command
+
+def generate(case: Case, directory: str) -> str:
+    """ Generate the source file of a case, reused while the case is unchanged.
+
+    Args:
+        case (Case): file to generate
+        directory (str): folder of the generated media
+
+    Raises:
+        RuntimeError: if ffmpeg fails
+
+    Returns:
+        str: path of the .mkv file
+    """
+    os.makedirs(directory, exist_ok=True)
+    output = os.path.join(directory, f"{case.name}.{case.fingerprint}.mkv")
+    if os.path.isfile(output):
+        return output
+
+    subtitle_paths = []
+    for i, language in enumerate(case.subtitles):
+        path = os.path.join(directory, f"{case.name}.{i}.{language}.srt")
+        write_srt(path, case.duration, language)
+        subtitle_paths.append(path)
+    partial = output + ".partial.mkv"
+    res = subprocess.run(generate_command(case, partial, subtitle_paths), capture_output=True, text=True,
+                         check=False, encoding="utf-8", errors="replace")
+    for path in subtitle_paths:
+        os.remove(path)
+    if res.returncode != 0:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise RuntimeError(f"Génération de {case.name} impossible : {res.stderr.strip()}")
+    os.replace(partial, output)
+    return output
@@ -1,73 +1,375 @@
 """Main script to transcode audio, convert to MP4, and transcode video to AV1."""
+import argparse
+import signal
+import socket
 import sys
 import os
-from datetime import datetime
+import threading
 from dotenv import load_dotenv
-from models.transcode_audio import transcode_audio as audio
-from models.convert_to_mp4 import convert_to_mp4 as mp4
-from models.transcode_av1 import transcode_video as video
+from models.catalog import Catalog, VIDEO_EXTENSIONS, scan
+from models.complexity import set_enabled as set_complexity
+from models.crop import set_enabled as set_crop
+from models.disk_space import SpacePlanner
+from models.chunked import SEGMENT_SECONDS
+from models.executor import BatchExecutor
+from models.fileops import MoveResult, move_file as durable_move
+from models.job_queue import JobQueue, run_worker
+from models.journal import Journal, JournalLocked, abandon_pending
+from models.metrics import MetricsRecorder, set_recorder
+from models.output_cache import OutputCache
+from models.packet_index import set_index_dir
+from models.progress import get_board
+from models.quality import SAMPLE_COUNT, QualityTarget
+from models.throughput import ThroughputStore, set_store
+from models.track_policy import TrackPolicy, set_policy
+from models.watcher import POLL_INTERVAL, STABLE_SECONDS, watch_folders
+from utils.log import log, setup_logging
 
 load_dotenv()
 
 OUTPUT_PATH =os.getenv("OUTPUT_PATH")
 temp_path =os.getenv("TEMP_PATH")
 video_path =os.getenv("VIDEO_PATH")
+CATALOG_PATH = os.getenv("CATALOG_PATH", "media_catalog.db")
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "transcode_journal.jsonl")
+QUEUE_PATH = os.getenv("QUEUE_PATH", "job_queue.db")
+OUTPUT_CACHE_DIR = os.getenv("OUTPUT_CACHE_DIR")
+OUTPUT_CACHE_MAX_GB = float(os.getenv("OUTPUT_CACHE_MAX_GB", "100"))
+# Candidate temp volumes, separated like PATH; TEMP_PATH alone by default
+TEMP_PATHS = [p for p in os.getenv("TEMP_PATHS", os.getenv("TEMP_PATH") or "").split(os.pathsep) if p]
+MIN_FREE_GB = float(os.getenv("MIN_FREE_GB", "5"))
 
-def log(msg: str, level="INFO"):
-    """function to log messages with different severity levels.
-
-    Args:
-        msg (str): message to log
-        level (str, optional): Defaults to "INFO". Possible values: "ERROR", "OK", "WARN", "INFO".
-    """
-    color = {
-        "ERROR": "\033[91m",    # rouge
-        "OK": "\033[92m",      # vert
-        "WARN": "\033[93m",    # jaune
-        "INFO": "\033[94m",    # bleu
-    }.get(level, "")
-    reset = "\033[0m"
-    print(f"{color}[{level}] {datetime.now().strftime('%H:%M:%S')} | {msg}{reset}")
-    sys.stdout.flush()
-
-def move_file(src: str, dest: str) -> bool:
-    """Move a file from src to dest.
+def move_file(src: str, dest: str) -> MoveResult:
+    """Move a file from src to dest, across filesystems if needed.
 
     Args:
         src (str): source file path
         dest (str): destination file path
     Returns:
-        bool: True if the file was moved successfully, False otherwise
+        MoveResult: truthy if the file was moved successfully, with the checksum of a copied file
     """
     log(f"Déplacement du fichier {src}", "INFO")
+    result = durable_move(src, dest)
+    if result:
+        log(f"Fichier déplacé de {src} à {dest} ({result.method}).", "OK")
+    else:
+        log(f"Erreur lors du déplacement du fichier de {src} à {dest} : {result.error}", "ERROR")
+    return result
+
+def build_executor(args, catalog: Catalog, cache: OutputCache | None, journal: Journal | None) -> BatchExecutor:
+    """ Build the batch executor from the pipeline options of the command line.
+
+    Args:
+        args (argparse.Namespace): parsed options of the run or watch command
+        catalog (Catalog): media catalog used instead of re-probing the sources
+        cache (OutputCache | None): output manifest used to skip finished files
+        journal (Journal | None): write-ahead journal of the stage transitions
+
+    Returns:
+        BatchExecutor: executor ready to accept files
+    """
+    set_complexity(not args.no_complexity)
+    set_crop(not args.no_crop)
+    quality = None
+    if args.target_quality is not None:
+        quality = QualityTarget(args.target_quality, args.quality_metric,
+                                samples=args.quality_samples, catalog=catalog)
+    return BatchExecutor(
+        log, move_file, OUTPUT_PATH, args.temp_dir[0] if args.temp_dir else None, catalog=catalog,
+        remux_workers=args.remux_workers, audio_workers=args.audio_workers,
+        audio_track_workers=args.audio_track_workers,
+        video_slots=args.video_slots, three_pass=args.three_pass, streamed=args.stream, chunked=args.chunked,
+        chunk_workers=args.chunk_workers, segment_seconds=args.segment_seconds, encoders=args.encoders,
+        quality=quality, cache=cache, journal=journal, resume=args.resume,
+        planner=SpacePlanner(args.temp_dir, OUTPUT_PATH, int(args.min_free_gb * 1024 ** 3)) if args.temp_dir else None,
+        deadline=args.deadline_hours * 3600 if args.deadline_hours else None,
+    )
+
+def install_signal_handlers(executor: BatchExecutor, stop: threading.Event | None = None):
+    """ Stop the executor (and the watch loop) on SIGINT / SIGTERM.
+
+    Args:
+        executor (BatchExecutor): executor to stop
+        stop (threading.Event | None, optional): event ending the watch loop
+    """
+    def handle_signal(signum, _frame):
+        # Runs on the main thread, possibly inside a lock of the executor: only set flags here
+        if stop is not None:
+            stop.set()
+        executor.request_shutdown(f"Signal {signal.Signals(signum).name} reçu")
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+def report(summary: dict):
+    """ Log the counters returned by BatchExecutor.join, exiting with 130 if jobs were interrupted.
+
+    Args:
+        summary (dict): counters {"done", "failed", "interrupted"}
+    """
+    log(f"{summary['done']} fichier(s) traité(s), {summary['failed']} en échec",
+        "OK" if not summary["failed"] else "WARN")
+    if summary["interrupted"]:
+        log(f"{summary['interrupted']} fichier(s) interrompu(s), relancer avec --resume pour les reprendre", "WARN")
+        sys.exit(130)
+
+def run(directory: str | None, executor: BatchExecutor):
+    """Process every video file of a directory into an AV1/AAC MP4.
+
+    Args:
+        directory (str | None): directory containing the video files, asked interactively if None
+        executor (BatchExecutor): executor running the pipeline
+    """
+    if directory is None:
+        directory = input("Entrez le répertoire contenant les fichiers vidéo à traiter : ")
+    video_files = [f for f in os.listdir(directory) if f.lower().endswith(VIDEO_EXTENSIONS)]
+    log(f"Fichiers vidéo trouvés : {video_files}")
+
+    install_signal_handlers(executor)
+    for video_file in video_files:
+        executor.submit(os.path.join(directory, video_file))
+    report(executor.join())
+
+def watch(directories: list[str], executor: BatchExecutor | None, stable_seconds: float = STABLE_SECONDS,
+          poll_interval: float = POLL_INTERVAL, queue: JobQueue | None = None, priority: int = 0):
+    """Watch ingest folders and process every video file once it is completely written, until stopped.
+
+    Args:
+        directories (list[str]): ingest folders
+        executor (BatchExecutor | None): executor running the pipeline, None when feeding a queue
+        stable_seconds (float, optional): seconds without size or mtime change before a file is taken
+        poll_interval (float, optional): seconds between two rescans when inotify is unavailable
+        queue (JobQueue | None, optional): job queue receiving the files instead of the executor
+        priority (int, optional): priority of the files added to the queue. Defaults to 0.
+    """
+    stop = threading.Event()
+    if queue is not None:
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        watch_folders(directories, lambda path: queue.enqueue(path, priority), log, stop,
+                      stable_seconds, poll_interval, exclude=[OUTPUT_PATH, *TEMP_PATHS])
+        return
+    install_signal_handlers(executor, stop)
+    watch_folders(directories, executor.submit, log, stop, stable_seconds, poll_interval,
+                  exclude=[OUTPUT_PATH, *TEMP_PATHS])
+    report(executor.join())
+
+def worker(queue: JobQueue, executor: BatchExecutor, name: str, capacity: int, drain: bool = False):
+    """Process the jobs of the shared queue, by priority, until stopped (or until it is empty with drain).
+
+    Args:
+        queue (JobQueue): job queue shared with the other workers
+        executor (BatchExecutor): executor running the pipeline
+        name (str): identifier of this worker
+        capacity (int): jobs held at the same time
+        drain (bool, optional): stop once nothing is left to do. Defaults to False.
+    """
+    stop = threading.Event()
+    install_signal_handlers(executor, stop)
+    log(f"Worker {name} démarré ({capacity} travail(aux) simultané(s))", "INFO")
+    run_worker(queue, executor, name, log, stop, capacity=capacity, drain=drain)
+    report(executor.join())
+
+def enqueue(queue: JobQueue, paths: list[str], priority: int):
+    """ Add video files, or the video files of directories, to the job queue.
+
+    Args:
+        queue (JobQueue): job queue
+        paths (list[str]): files or directories
+        priority (int): priority of the new jobs, higher runs first
+    """
+    count = 0
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(VIDEO_EXTENSIONS)]
+        else:
+            files = [path]
+        for file in files:
+            queue.enqueue(file, priority)
+            count += 1
+    log(f"{count} fichier(s) ajouté(s) à la file avec la priorité {priority}", "OK")
+
+def show_queue(queue: JobQueue):
+    """ Print the unfinished and failed jobs of the queue.
+
+    Args:
+        queue (JobQueue): job queue
+    """
+    for job in queue.jobs():
+        error = f" ({job.last_error})" if job.last_error else ""
+        print(f"{job.id:>6} {job.state:<8} p{job.priority:<4} essai {job.attempts}/{job.max_attempts} "
+              f"{job.worker or '':<20} {job.source}{error}")
+    counts = queue.counts()
+    print(", ".join(f"{state} : {count}" for state, count in sorted(counts.items())) or "File vide")
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Transcodage MP4 / AAC / AV1 d'une vidéothèque")
+    parser.add_argument("--catalog", default=CATALOG_PATH, help="base SQLite du catalogue média")
+    parser.add_argument("--status-file", default=os.getenv("STATUS_FILE"),
+                        help="fichier JSON décrivant l'avancement de tous les travaux en cours")
+    parser.add_argument("--metrics-dir", default=os.getenv("METRICS_DIR"),
+                        help="dossier recevant un rapport JSON de ressources par fichier traité")
+    parser.add_argument("--metrics-textfile", default=os.getenv("METRICS_TEXTFILE"),
+                        help="fichier .prom des compteurs cumulés, pour le collecteur textfile de node_exporter")
+    parser.add_argument("--log-file", default=os.getenv("LOG_FILE"),
+                        help="journal JSON-lines (job, fichier, étape) avec rotation")
+    parser.add_argument("--log-max-mb", type=float, default=float(os.getenv("LOG_MAX_MB", "50")),
+                        help="taille du journal JSON-lines avant rotation, en Mo")
+    parser.add_argument("--progress-interval", type=float, default=5.0,
+                        help="secondes minimum entre deux affichages de l'avancement")
+    parser.add_argument("--journal", default=JOURNAL_PATH, help="journal des étapes de chaque fichier")
+    parser.add_argument("--resume", action="store_true",
+                        help="reprendre les fichiers interrompus depuis leur dernière étape terminée")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="ignorer le cache des sorties et tout retraiter")
+    parser.add_argument("--cache-dir", default=OUTPUT_CACHE_DIR,
+                        help="dossier conservant une copie des sorties pour les restaurer")
+    parser.add_argument("--cache-max-gb", type=float, default=OUTPUT_CACHE_MAX_GB,
+                        help="taille maximum du dossier de cache en Go")
+    parser.add_argument("--queue", default=QUEUE_PATH, help="base SQLite de la file de travaux")
+    parser.add_argument("--temp-dir", action="append", default=None,
+                        help="volume temporaire candidat, répétable (défaut : TEMP_PATHS ou TEMP_PATH)")
+    parser.add_argument("--min-free-gb", type=float, default=MIN_FREE_GB,
+                        help="espace laissé libre sur chaque volume en Go")
+    parser.add_argument("--track-policy", default=os.getenv("TRACK_POLICY"),
+                        help="fichier JSON des règles de conservation des pistes audio / sous-titres")
+    subparsers = parser.add_subparsers(dest="command")
+
+    pipeline = argparse.ArgumentParser(add_help=False)
+    pipeline.add_argument("--three-pass", action="store_true",
+                          help="remux, audio puis vidéo en trois réécritures successives")
+    pipeline.add_argument("--stream", action="store_true",
+                          help="trois étapes en processus séparés reliés par des tubes, sans fichier intermédiaire")
+    pipeline.add_argument("--video-slots", type=int, default=int(os.getenv("VIDEO_SLOTS", "1")),
+                          help="nombre d'encodages vidéo simultanés")
+    pipeline.add_argument("--remux-workers", type=int, default=2,
+                          help="nombre d'analyses et de remux simultanés")
+    pipeline.add_argument("--audio-workers", type=int, default=None,
+                          help="nombre d'encodages audio simultanés")
+    pipeline.add_argument("--audio-track-workers", type=int, default=int(os.getenv("AUDIO_TRACK_WORKERS", "1")),
+                          help="pistes audio d'un même fichier encodées en parallèle (mode --three-pass)")
+    pipeline.add_argument("--no-crop", action="store_true",
+                          help="garder les bandes noires au lieu de les rogner")
+    pipeline.add_argument("--no-complexity", action="store_true",
+                          help="choisir le CQ d'après la résolution seule, sans analyser le contenu")
+    pipeline.add_argument("--chunked", action="store_true",
+                          help="encodage AV1 CPU par segments parallèles découpés sur les images clés")
+    pipeline.add_argument("--chunk-workers", type=int, default=None,
+                          help="nombre de segments encodés simultanément")
+    pipeline.add_argument("--segment-seconds", type=float, default=SEGMENT_SECONDS,
+                          help="durée minimum d'un segment en secondes")
+    pipeline.add_argument("--encoders", type=lambda v: [n.strip() for n in v.split(",") if n.strip()],
+                          default=None, help="encodeurs AV1 par ordre de préférence, ex. av1_nvenc,libsvtav1")
+    pipeline.add_argument("--target-quality", type=float, default=None,
+                          help="qualité visée (ex. VMAF 93) : le CQ est cherché sur des échantillons")
+    pipeline.add_argument("--quality-metric", choices=("vmaf", "ssim"), default="vmaf",
+                          help="métrique de la recherche de qualité")
+    pipeline.add_argument("--quality-samples", type=int, default=SAMPLE_COUNT,
+                          help="nombre d'échantillons de la recherche de qualité")
+    pipeline.add_argument("--deadline-hours", type=float, default=None,
+                          help="temps alloué aux encodages en heures : preset le plus lent qui tient le délai")
+
+    run_parser = subparsers.add_parser("run", parents=[pipeline], help="traiter les fichiers vidéo d'un répertoire")
+    run_parser.add_argument("directory", nargs="?")
+
+    watch_parser = subparsers.add_parser("watch", parents=[pipeline],
+                                         help="surveiller des dossiers de dépôt et traiter les fichiers au fil de l'eau")
+    watch_parser.add_argument("directories", nargs="+")
+    watch_parser.add_argument("--stable-seconds", type=float, default=STABLE_SECONDS,
+                              help="secondes sans changement de taille ni de date avant de prendre un fichier")
+    watch_parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                              help="secondes entre deux parcours des dossiers sans inotify")
+    watch_parser.add_argument("--to-queue", action="store_true",
+                              help="ajouter les fichiers prêts à la file de travaux au lieu de les traiter")
+    watch_parser.add_argument("--priority", type=int, default=0, help="priorité des fichiers ajoutés à la file")
+
+    worker_parser = subparsers.add_parser("worker", parents=[pipeline], help="traiter les travaux de la file")
+    worker_parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}",
+                               help="nom du worker, stable pour reprendre ses travaux avec --resume")
+    worker_parser.add_argument("--capacity", type=int, default=None,
+                               help="travaux pris simultanément. Par défaut : video-slots + 1")
+    worker_parser.add_argument("--drain", action="store_true", help="s'arrêter quand la file est vide")
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="ajouter des fichiers ou des répertoires à la file")
+    enqueue_parser.add_argument("paths", nargs="+")
+    enqueue_parser.add_argument("--priority", type=int, default=0, help="priorité, la plus haute passe en premier")
+
+    prioritize_parser = subparsers.add_parser("prioritize", help="changer la priorité d'un fichier en file")
+    prioritize_parser.add_argument("path")
+    prioritize_parser.add_argument("priority", type=int)
+
+    subparsers.add_parser("queue", help="afficher la file de travaux")
+
+    catalog_parser = subparsers.add_parser("catalog", help="analyser une vidéothèque dans le catalogue")
+    catalog_parser.add_argument("directory")
+    catalog_parser.add_argument("--workers", type=int, default=8, help="nombre de ffprobe en parallèle")
+
+    args = parser.parse_args()
+    if args.command is None:
+        # Without a command, behave like `run` and ask for the directory
+        args = parser.parse_args([*sys.argv[1:], "run"])
+    args.temp_dir = args.temp_dir or TEMP_PATHS
+    setup_logging(args.log_file, progress_interval=args.progress_interval,
+                  max_bytes=int(args.log_max_mb * 1024 ** 2))
+    get_board().configure(interval=args.progress_interval, status_file=args.status_file)
+    if args.metrics_dir or args.metrics_textfile:
+        set_recorder(MetricsRecorder(args.metrics_dir, args.metrics_textfile))
+    if args.track_policy:
+        set_policy(TrackPolicy.load(args.track_policy))
+    catalog = Catalog(args.catalog)
+    set_index_dir(os.path.join(os.path.dirname(os.path.abspath(args.catalog)), "packet_index"))
+    queue = JobQueue(args.queue) if args.command in ("worker", "enqueue", "prioritize", "queue") or \
+        (args.command == "watch" and args.to_queue) else None
+    # Only the commands running the pipeline need the output cache and the journal
+    encodes = args.command in ("run", "worker") or (args.command == "watch" and not args.to_queue)
+    cache = None
+    if not args.no_cache and encodes:
+        cache = OutputCache(args.catalog, args.cache_dir, int(args.cache_max_gb * 1024 ** 3))
+    journal = None
+    if encodes:
+        set_store(ThroughputStore(args.catalog))
+        journal_path = args.journal
+        if args.command == "worker":
+            # One journal per worker: a worker must not abandon the jobs of another one
+            root, ext = os.path.splitext(args.journal)
+            journal_path = f"{root}.{args.name}{ext}"
+        try:
+            journal = Journal(journal_path)
+        except JournalLocked as e:
+            log(str(e), "ERROR")
+            if cache is not None:
+                cache.close()
+            catalog.close()
+            sys.exit(1)
+        if not args.resume:
+            abandon_pending(journal, log)
     try:
-        os.replace(src, dest)
-        log(f"Fichier déplacé de {src} à {dest}.", "OK")
-        return True
-    except Exception as e:
-        log(f"Erreur lors du déplacement du fichier de {src} à {dest} : {e}", "ERROR")
-        return False
-
-directory = input("Entrez le répertoire contenant les fichiers vidéo à traiter : ")
-video_files = [f for f in os.listdir(directory) if f.lower().endswith(('.mp4', '.mkv', '.avi', '.mov'))]
-print(f"Fichiers vidéo trouvés : {video_files}")
-
-for video_file in video_files:
-    video_path = os.path.join(directory, video_file)
-    temp_path =os.getenv("TEMP_PATH")
-    log(f"Traitement du fichier vidéo : {video_path}", "INFO")
-    result = mp4(video_path, temp_path, log)
-    if result["success"]:
-        if move_file(result["output"], os.path.join(OUTPUT_PATH, result["file_name"])):
-            log("Conversion en MP4 terminée avec succès.", "OK")
-            video_path = os.path.join(OUTPUT_PATH, result["file_name"])
-            temp_path = os.path.join(temp_path, result["file_name"])
-            if audio(video_path, temp_path, log):
-                if move_file(temp_path, os.path.join(OUTPUT_PATH, result["file_name"])):
-                    log("Transcodage audio terminée avec succès.", "OK")
-                    if video(video_path, temp_path, log):
-                        log("Transcodage vidéo AV1 terminé avec succès.", "OK")
-                        if move_file(temp_path, os.path.join(OUTPUT_PATH, result["file_name"])):
-                            log("Transcodage vidéo AV1 terminé avec succès.", "OK")
-
-# print(f"RESULT : {result}")
+        if args.command == "catalog":
+            scan(catalog, args.directory, log, workers=args.workers)
+        elif args.command == "watch":
+            executor = None if args.to_queue else build_executor(args, catalog, cache, journal)
+            watch(args.directories, executor, args.stable_seconds, args.poll_interval, queue, args.priority)
+        elif args.command == "worker":
+            worker(queue, build_executor(args, catalog, cache, journal), args.name,
+                   args.capacity or args.video_slots + 1, args.drain)
+        elif args.command == "enqueue":
+            enqueue(queue, args.paths, args.priority)
+        elif args.command == "prioritize":
+            if not queue.prioritize(args.path, args.priority):
+                log(f"{args.path} n'est pas dans la file", "WARN")
+        elif args.command == "queue":
+            show_queue(queue)
+        else:
+            run(args.directory, build_executor(args, catalog, cache, journal))
+    finally:
+        if queue is not None:
+            queue.close()
+        if journal is not None:
+            journal.close()
+        if cache is not None:
+            cache.close()
+        catalog.close()
+
+if __name__ == "__main__":
+    main()
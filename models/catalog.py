@@ -0,0 +1,258 @@
+"""Persistent SQLite catalog of probed media files, refreshed incrementally."""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import os
+import sqlite3
+import threading
+import time
+from models.probe import ProbeError, probe
+from models.transcode_av1 import detect_hdr
+from utils import MediaInfo
+
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    codec TEXT,
+    width INTEGER,
+    height INTEGER,
+    is_hdr INTEGER,
+    bitrate INTEGER,
+    duration REAL,
+    audio_tracks TEXT,
+    subtitle_tracks TEXT,
+    probe_json TEXT NOT NULL,
+    scanned_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS quality_samples (
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    encoder TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    sampling TEXT NOT NULL,
+    cq INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (path, size, mtime, encoder, metric, sampling, cq)
+);
+"""
+
+class Catalog:
+    """Class wrapping the SQLite media catalog, keyed by path, size and mtime."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def lookup(self, path: str, size: int, mtime: float) -> MediaInfo | None:
+        """ Return the cataloged probe of a file if it is still up to date.
+
+        Args:
+            path (str): absolute path of the file
+            size (int): current size of the file
+            mtime (float): current modification time of the file
+
+        Returns:
+            MediaInfo | None: cached probe, None if missing or stale
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT probe_json FROM media WHERE path = ? AND size = ? AND mtime = ?",
+                (path, size, mtime),
+            ).fetchone()
+        if row is None:
+            return None
+        return MediaInfo.from_probe(path, size, mtime, json.loads(row[0]))
+
+    def store(self, info: MediaInfo):
+        """ Insert or refresh the catalog entry of a probed file.
+
+        Args:
+            info (MediaInfo): probe to store
+        """
+        video = info.video_track
+        audio_tracks = [
+            {"index": a.index, "codec": a.codec_name, "language": a.tags.language,
+             "title": a.tags.title, "channels": a.channels, "bit_rate": int(a.bit_rate or 0)}
+            for a in info.audio
+        ]
+        subtitle_tracks = [
+            {"index": s.index, "codec": s.codec_name, "language": s.tags.get("language", "und"),
+             "title": s.tags.get("title", "")}
+            for s in info.subtitles
+        ]
+        row = (
+            info.path, info.size, info.mtime,
+            video.codec_name if video else None,
+            video.width if video else None,
+            video.height if video else None,
+            int(detect_hdr(video)) if video else None,
+            int((video.bit_rate if video else None) or info.bit_rate or 0),
+            info.duration,
+            json.dumps(audio_tracks, ensure_ascii=False),
+            json.dumps(subtitle_tracks, ensure_ascii=False),
+            json.dumps(info.raw, ensure_ascii=False),
+            time.time(),
+        )
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media (path, size, mtime, codec, width, height, is_hdr, bitrate,"
+                " duration, audio_tracks, subtitle_tracks, probe_json, scanned_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+            self._conn.commit()
+
+    def quality_scores(self, path: str, size: int, mtime: float, encoder: str, metric: str,
+                       sampling: str) -> dict[int, float]:
+        """ Return the sample scores already measured for a file and an encoder.
+
+        Args:
+            path (str): absolute path of the file
+            size (int): current size of the file
+            mtime (float): current modification time of the file
+            encoder (str): encoder name and settings, e.g. "libsvtav1:3f2a9c01d4e7"
+            metric (str): "vmaf" or "ssim"
+            sampling (str): description of the samples, e.g. "4x4.0"
+
+        Returns:
+            dict[int, float]: cq -> mean score over the samples
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT cq, score FROM quality_samples WHERE path = ? AND size = ? AND mtime = ?"
+                " AND encoder = ? AND metric = ? AND sampling = ?",
+                (path, size, mtime, encoder, metric, sampling),
+            ).fetchall()
+        return dict(rows)
+
+    def store_quality_scores(self, path: str, size: int, mtime: float, encoder: str, metric: str,
+                             sampling: str, scores: dict[int, float]):
+        """ Record sample scores measured for a file and an encoder.
+
+        Args:
+            path (str): absolute path of the file
+            size (int): size of the file
+            mtime (float): modification time of the file
+            encoder (str): encoder name and settings
+            metric (str): "vmaf" or "ssim"
+            sampling (str): description of the samples
+            scores (dict[int, float]): cq -> mean score over the samples
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO quality_samples (path, size, mtime, encoder, metric, sampling, cq, score)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(path, size, mtime, encoder, metric, sampling, cq, score) for cq, score in scores.items()],
+            )
+            self._conn.commit()
+
+    def known_files(self, directory: str) -> dict[str, tuple[int, float]]:
+        """ Get the (size, mtime) recorded for every cataloged file under a directory.
+
+        Args:
+            directory (str): root directory
+
+        Returns:
+            dict[str, tuple[int, float]]: path -> (size, mtime)
+        """
+        prefix = os.path.join(os.path.abspath(directory), "")
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, size, mtime FROM media WHERE substr(path, 1, ?) = ?",
+                (len(prefix), prefix),
+            ).fetchall()
+        return {path: (size, mtime) for path, size, mtime in rows}
+
+    def forget(self, paths: list[str]):
+        """ Remove entries of files that no longer exist.
+
+        Args:
+            paths (list[str]): paths to remove
+        """
+        with self._lock:
+            self._conn.executemany("DELETE FROM media WHERE path = ?", [(p,) for p in paths])
+            self._conn.executemany("DELETE FROM quality_samples WHERE path = ?", [(p,) for p in paths])
+            self._conn.commit()
+
+
+def walk_videos(directory: str):
+    """ Recursively yield (path, stat) for every video file under a directory.
+
+    Args:
+        directory (str): root directory
+
+    Yields:
+        tuple[str, os.stat_result]: absolute path and stat of the file
+    """
+    stack = [os.path.abspath(directory)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                        yield entry.path, entry.stat()
+        except PermissionError:
+            continue
+
+def scan(catalog: Catalog, directory: str, log, workers: int = 8) -> dict:
+    """ Walk a library and probe, in parallel, only the files that changed since the last scan.
+
+    Args:
+        catalog (Catalog): catalog to refresh
+        directory (str): root directory of the library
+        log (function): logging function
+        workers (int, optional): number of concurrent ffprobe processes. Defaults to 8.
+
+    Returns:
+        dict: counters {"probed", "unchanged", "removed", "failed"}
+    """
+    known = catalog.known_files(directory)
+    seen = set()
+    to_probe = []
+    for path, stat in walk_videos(directory):
+        seen.add(path)
+        if known.get(path) != (stat.st_size, stat.st_mtime):
+            to_probe.append(path)
+
+    removed = [path for path in known if path not in seen]
+    if removed:
+        catalog.forget(removed)
+
+    log(f"{len(seen)} fichier(s) trouvé(s), {len(to_probe)} à analyser", "INFO")
+    probed = failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(probe, path): path for path in to_probe}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                catalog.store(future.result())
+                probed += 1
+            except (ProbeError, FileNotFoundError) as e:
+                failed += 1
+                log(f"Analyse impossible pour {path} : {e}", "ERROR")
+
+    log(f"Catalogue à jour : {probed} analysé(s), {len(seen) - len(to_probe)} inchangé(s), "
+        f"{len(removed)} supprimé(s), {failed} en échec", "OK")
+    return {
+        "probed": probed,
+        "unchanged": len(seen) - len(to_probe),
+        "removed": len(removed),
+        "failed": failed,
+    }
@@ -0,0 +1,226 @@
+"""Keyframe-chunked AV1 encoding: encode segments in parallel on the CPU, then concatenate losslessly."""
+
+import os
+import shutil
+import time
+from models.convert_to_mp4 import subtitle_args
+from models.encoders import available_backends
+from models.packet_index import open_index
+from models.probe import ProbeError, probe
+from models.quality import QualityTarget, tune_info
+from models.runner import report_failure, run_ffmpeg, run_many
+from models.throughput import Pacing
+from models.transcode_audio import audio_args, get_audio_info
+from models.transcode_av1 import get_info
+from utils import MediaInfo, TranscodeData
+
+SEGMENT_SECONDS = 60.0
+SEGMENT_RETRIES = 2
+
+def find_keyframes(video_path: str, stream_index: int) -> list[float]:
+    """ List the keyframe timestamps of a video stream from its packet index (demux only, no decode).
+
+    Args:
+        video_path (str): path to the video file
+        stream_index (int): absolute index of the video stream
+
+    Raises:
+        ProbeError: if the index has to be built and ffprobe fails
+
+    Returns:
+        list[float]: sorted keyframe timestamps in seconds
+    """
+    index = open_index(video_path)
+    if stream_index not in index.streams:
+        return []
+    return index.keyframes(stream_index).tolist()
+
+def plan_segments(keyframes: list[float], duration: float, segment_seconds: float = SEGMENT_SECONDS,
+                  start_time: float = 0.0) -> list[tuple[float, float]]:
+    """ Group keyframes into segments of at least segment_seconds, cut only on keyframes.
+
+    The first segment starts with the stream, so that leading frames before the first
+    keyframe are kept. Times are relative to the start of the file, as `-ss` expects.
+
+    Args:
+        keyframes (list[float]): keyframe timestamps in seconds, as stored in the packet index
+        duration (float): duration of the media in seconds
+        segment_seconds (float, optional): minimum segment length. Defaults to SEGMENT_SECONDS.
+        start_time (float, optional): start time of the container, subtracted from the keyframes
+
+    Returns:
+        list[tuple[float, float]]: (start, end) of each segment, from 0 to duration
+    """
+    starts = [0.0]
+    for keyframe in keyframes:
+        keyframe -= start_time
+        if keyframe - starts[-1] >= segment_seconds and duration - keyframe >= segment_seconds / 4:
+            starts.append(keyframe)
+    ends = starts[1:] + [duration]
+    return list(zip(starts, ends))
+
+def segment_command(video_path: str, stream_index: int, start: float, end: float,
+                    encoder_args: list[str], output: str) -> list[str]:
+    """ Build the command encoding the video of one segment, seeking on its starting keyframe.
+
+    Args:
+        video_path (str): path to the source video file
+        stream_index (int): absolute index of the video stream
+        start (float): segment start, 0 or a keyframe, relative to the start of the file
+        end (float): segment end (start of the next segment)
+        encoder_args (list[str]): video encoder arguments
+        output (str): path of the encoded segment
+
+    Returns:
+        list[str]: ffmpeg command
+    """
+    return [
+        "ffmpeg", "-y",
+        "-ss", f"{start:.6f}",
+        "-i", video_path,
+        "-t", f"{end - start:.6f}",
+        "-map", f"0:{stream_index}",
+        "-an", "-sn", "-dn",
+        *encoder_args,
+        "-loglevel", "error",
+        "-f", "matroska", output
+    ]
+
+def encode_segments(commands: list[list[str]], workers: int, retries: int, durations: list[float],
+                    labels: list[str], log) -> bool:
+    """ Encode segments in parallel, retrying the failed ones.
+
+    Args:
+        commands (list[list[str]]): one ffmpeg command per segment
+        workers (int): maximum number of concurrent encoders
+        retries (int): retries allowed per segment
+        durations (list[float]): duration of each segment
+        labels (list[str]): progress board label of each segment
+        log (function): logging function
+
+    Returns:
+        bool: True if every segment was encoded
+    """
+    pending = list(range(len(commands)))
+    for attempt in range(retries + 1):
+        results = run_many([commands[i] for i in pending], workers,
+                           labels=[labels[i] for i in pending],
+                           durations=[durations[i] for i in pending])
+        failed = [i for i, result in zip(pending, results) if not result.success]
+        for i, result in zip(pending, results):
+            if not result.success:
+                report_failure(result, f"le segment {i + 1} (essai {attempt + 1})", log)
+        if not failed:
+            return True
+        pending = failed
+    log(f"❌ {len(pending)} segment(s) en échec après {retries + 1} essai(s)", "ERROR")
+    return False
+
+def transcode_chunked(video_path, temp_path, log, media: MediaInfo | None = None,
+                      workers: int | None = None, segment_seconds: float = SEGMENT_SECONDS,
+                      retries: int = SEGMENT_RETRIES, encoders: list[str] | None = None,
+                      quality: QualityTarget | None = None, pacing: Pacing | None = None):
+    """ Produce the final AV1/AAC MP4 with the video encoded in parallel keyframe-aligned segments.
+
+    Audio and subtitles are handled as in the single pass pipeline, during the final
+    stream-copy concatenation.
+
+    Args:
+        video_path (str): path to the source video file
+        temp_path (str): temporary directory receiving the segments and the output
+        log (function): logging function
+        media (MediaInfo, optional): probe of video_path, probed here if not given
+        workers (int | None, optional): concurrent segment encoders. Defaults to a quarter of the CPUs.
+        segment_seconds (float, optional): minimum segment length. Defaults to SEGMENT_SECONDS.
+        retries (int, optional): retries allowed per segment. Defaults to SEGMENT_RETRIES.
+        encoders (list[str] | None, optional): AV1 encoders in order of preference, only CPU ones are used
+        quality (QualityTarget | None, optional): target-quality CQ search, None to keep the default CQ
+        pacing (Pacing | None, optional): preset choice and throughput recording of the job
+
+    Raises:
+        FileNotFoundError: _if the video file does not exist
+        NotADirectoryError: _if the temporary path does not exist
+
+    Returns:
+        dict: {"success": bool, "output": str, "file_name": str}, same shape as convert_to_mp4
+    """
+    if not os.path.isfile(video_path):
+        raise FileNotFoundError(f"Fichier vidéo non trouvé : {video_path}")
+    if not os.path.isdir(temp_path):
+        raise NotADirectoryError(f"Dossier temporaire non trouvé : {temp_path}")
+
+    failure = {"success": False, "output": "", "file_name": ""}
+    backends = available_backends(encoders, cpu_only=True)
+    if not backends:
+        log("❌ Aucun encodeur AV1 CPU disponible pour l'encodage par segments", "ERROR")
+        return failure
+    backend = backends[0]
+    media = media or probe(video_path)
+    video_track = media.video_track
+    if video_track is None:
+        raise RuntimeError("Aucune piste vidéo trouvée")
+    info: TranscodeData = TranscodeData(**get_info(video_path, media))
+    info = tune_info(video_path, temp_path, log, media, info, backend, quality, pacing)
+    cpus = os.cpu_count() or 4
+    workers = max(1, workers or cpus // 4)
+    threads = max(1, cpus // workers)
+
+    segments = plan_segments(find_keyframes(video_path, video_track.index), media.duration, segment_seconds,
+                             media.start_time)
+    log(f"{len(segments)} segment(s) encodé(s) par {workers} encodeur(s) {backend.name} en parallèle")
+
+    file_name = os.path.basename(video_path).rsplit('.', 1)[0] + ".mp4"
+    segment_dir = os.path.join(temp_path, "segments")
+    os.makedirs(segment_dir, exist_ok=True)
+    encoder_args = backend.video_args(info, threads=threads)
+    outputs = [os.path.join(segment_dir, f"{i:05d}.mkv") for i in range(len(segments))]
+    commands = [
+        segment_command(video_path, video_track.index, start, end, encoder_args, output)
+        for (start, end), output in zip(segments, outputs)
+    ]
+    labels = [f"{file_name} [seg {i + 1}/{len(segments)}]" for i in range(len(segments))]
+    durations = [end - start for start, end in segments]
+    try:
+        started = time.monotonic()
+        if not encode_segments(commands, workers, retries, durations, labels, log):
+            return failure
+        if pacing is not None:
+            pacing.record(backend, wall_time=time.monotonic() - started)
+
+        list_file = os.path.join(segment_dir, "segments.txt")
+        with open(list_file, "w", encoding="utf-8") as f:
+            for output in outputs:
+                escaped = output.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
+        output = os.path.join(temp_path, file_name)
+        command = [
+            "ffmpeg",
+            "-f", "concat", "-safe", "0", "-i", list_file,
+            "-i", video_path,
+            "-map", "0:v:0", "-c:v", "copy",
+        ]
+        command += audio_args(get_audio_info(media, log), input_index=1)
+        command += subtitle_args(media.subtitles, log, input_index=1)
+        command += [
+            "-c:s", "mov_text",
+            "-map_metadata", "1",
+            "-map_chapters", "1",
+            "-movflags", "+faststart",
+            "-loglevel", "info",
+            output
+        ]
+        run = run_ffmpeg(command, progress=f"{file_name} [concat]", duration=media.duration)
+        if not run.success:
+            report_failure(run, "la concaténation des segments", log)
+            if os.path.exists(output):
+                os.remove(output)
+            return failure
+        log("✅ Transcodage par segments ok", "OK")
+        return {
+            "success": True,
+            "output": output,
+            "file_name": file_name
+        }
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
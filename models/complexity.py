@@ -0,0 +1,171 @@
+"""Content complexity of a video (spatial detail, motion) measured on downscaled luma samples."""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import os
+import tempfile
+import threading
+from models.probe import cache_key
+from models.runner import run_many
+from utils import MediaInfo
+
+try:
+    import numpy as np
+except ImportError:  # optional: without NumPy the encode parameters only follow the resolution
+    np = None
+
+SAMPLE_COUNT = 12
+FRAMES_PER_SAMPLE = 4
+ANALYSIS_WIDTH = 320
+ANALYSIS_WORKERS = 6
+# Mean absolute luma gradient / frame difference (0-1) above which content counts as complex,
+# and below which it counts as flat
+SPATIAL_HIGH, SPATIAL_LOW = 0.055, 0.020
+TEMPORAL_HIGH, TEMPORAL_LOW = 0.045, 0.010
+
+_enabled = np is not None
+_cache: "OrderedDict[tuple, ComplexityScores | None]" = OrderedDict()
+_cache_lock = threading.Lock()
+_CACHE_SIZE = 256
+
+@dataclass
+class ComplexityScores:
+    """Class representing the complexity of a video, both scores between 0 and 1."""
+    spatial: float
+    temporal: float
+
+    @property
+    def cq_offset(self) -> int:
+        """ CQ correction: lower (more bits) for grain and motion, higher for flat content.
+
+        Returns:
+            int: value added to the CQ chosen from the resolution, between -2 and +2
+        """
+        offset = 0
+        if self.spatial >= SPATIAL_HIGH:
+            offset -= 1
+        elif self.spatial <= SPATIAL_LOW:
+            offset += 1
+        if self.temporal >= TEMPORAL_HIGH:
+            offset -= 1
+        elif self.temporal <= TEMPORAL_LOW:
+            offset += 1
+        return offset
+
+def set_enabled(enabled: bool):
+    """ Turn the complexity analysis on or off for the whole process.
+
+    Args:
+        enabled (bool): False to choose the parameters from the resolution only
+    """
+    global _enabled
+    _enabled = enabled and np is not None
+
+def is_enabled() -> bool:
+    """True if the analysis runs, which needs NumPy."""
+    return _enabled
+
+def sample_command(video_path: str, stream_index: int, start: float, width: int, height: int, output: str,
+                   frames: int = FRAMES_PER_SAMPLE, crop: str | None = None) -> list[str]:
+    """ Build the command decoding a few consecutive frames from start as downscaled 8-bit luma.
+
+    Args:
+        video_path (str): path to the video file
+        stream_index (int): absolute index of the video stream
+        start (float): seek position in seconds
+        width (int): analysis width
+        height (int): analysis height
+        output (str): raw gray frames file, width * height bytes each, possibly fewer frames near the end
+        frames (int, optional): consecutive frames to decode. Defaults to FRAMES_PER_SAMPLE.
+        crop (str | None, optional): ffmpeg crop "w:h:x:y" applied before scaling
+
+    Returns:
+        list[str]: ffmpeg command
+    """
+    return [
+        "ffmpeg",
+        "-v", "error",
+        "-y",
+        "-ss", f"{start:.3f}",
+        "-i", video_path,
+        "-map", f"0:{stream_index}",
+        "-frames:v", str(frames),
+        "-vf", f"{f'crop={crop},' if crop else ''}scale={width}:{height}:flags=area,format=gray",
+        "-f", "rawvideo",
+        output,
+    ]
+
+def scores_from_frames(samples):
+    """ Compute both scores on every sample at once.
+
+    Args:
+        samples (numpy.ndarray): uint8 array (samples, frames, height, width)
+
+    Returns:
+        ComplexityScores: mean gradient magnitude and mean frame-to-frame difference, scaled to 0-1
+    """
+    luma = samples.astype(np.float32) / 255.0
+    gradient_x = np.abs(np.diff(luma, axis=3))[:, :, :-1, :]
+    gradient_y = np.abs(np.diff(luma, axis=2))[:, :, :, :-1]
+    spatial = float(np.mean(np.sqrt(gradient_x ** 2 + gradient_y ** 2)))
+    temporal = float(np.mean(np.abs(np.diff(luma, axis=1)))) if luma.shape[1] > 1 else 0.0
+    return ComplexityScores(spatial=spatial, temporal=temporal)
+
+def analyze(video_path: str, media: MediaInfo, samples: int = SAMPLE_COUNT,
+            workers: int = ANALYSIS_WORKERS, crop: str | None = None) -> ComplexityScores | None:
+    """ Measure the complexity of a video from frames sampled across its duration, memoized per file version.
+
+    The samples are decoded by concurrent ffmpeg seeks on the shared runner; the scores
+    are computed on the whole batch with NumPy.
+
+    Args:
+        video_path (str): path to the video file
+        media (MediaInfo): probe of video_path
+        samples (int, optional): number of sampled positions. Defaults to SAMPLE_COUNT.
+        workers (int, optional): concurrent ffmpeg decoders. Defaults to ANALYSIS_WORKERS.
+        crop (str | None, optional): black bar crop "w:h:x:y", so that the bars do not lower the scores
+
+    Returns:
+        ComplexityScores | None: scores, None if disabled, without NumPy or if nothing could be decoded
+    """
+    track = media.video_track
+    if not _enabled or track is None or not track.width or not track.height or not media.duration:
+        return None
+    key = (*cache_key(video_path), crop)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    picture_width, picture_height = track.width, track.height
+    if crop:
+        picture_width, picture_height = map(int, crop.split(":")[:2])
+    width = min(ANALYSIS_WIDTH, picture_width) // 2 * 2
+    height = max(2, round(width * picture_height / picture_width / 2) * 2)
+    frame_size = width * height
+    # Skip the first and last 5% (logos, credits)
+    starts = [media.duration * (0.05 + 0.9 * (i + 0.5) / samples) for i in range(samples)]
+    name = os.path.basename(video_path)
+    with tempfile.TemporaryDirectory(prefix="complexity-") as sample_dir:
+        outputs = [os.path.join(sample_dir, f"sample{i}.gray") for i in range(len(starts))]
+        run_many([sample_command(video_path, track.index, start, width, height, output, crop=crop)
+                  for start, output in zip(starts, outputs)], workers,
+                 labels=[f"{name} [complexité {i + 1}/{len(starts)}]" for i in range(len(starts))])
+        raw = []
+        for output in outputs:
+            # A failed seek leaves no file or a short one, dropped below
+            if os.path.isfile(output):
+                with open(output, "rb") as f:
+                    raw.append(f.read())
+    # Keep the samples that decoded completely so they stack into one array
+    complete = [data for data in raw if len(data) >= frame_size * FRAMES_PER_SAMPLE]
+    scores = None
+    if complete:
+        batch = np.frombuffer(b"".join(data[:frame_size * FRAMES_PER_SAMPLE] for data in complete), dtype=np.uint8)
+        scores = scores_from_frames(batch.reshape(len(complete), FRAMES_PER_SAMPLE, height, width))
+
+    with _cache_lock:
+        _cache[key] = scores
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return scores
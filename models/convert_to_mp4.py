@@ -8,10 +8,11 @@ Returns:
 """
 
 import os
-import subprocess
-import sys
-import json
 import re
+from models.probe import probe
+from models.runner import report_failure, run_ffmpeg
+from models.track_policy import TrackPolicy, get_policy
+from utils import MediaInfo, SubtitleTrack
 
 def get_language_name(code: str) -> str:
     """
@@ -90,96 +91,29 @@ def get_language_name(code: str) -> str:
 
     return languages.get(code, "Unknown")
 
-def get_subtitles(video_path, log):
-    """_summary_
-
-    Args:
-        video_path (str): path to the video file
-        log (function): logging function
-
-    Raises:
-        FileNotFoundError: if the video file does not exist
-        Exception: on ffprobe error
-
-    Returns:
-        bool: True if the extraction was successful, False otherwise
-    """
-    if not os.path.isfile(video_path):
-        raise FileNotFoundError(f"Fichier vidéo non trouvé : {video_path}")
-    command = [
-        "ffprobe",
-        "-v", "error",
-        "-select_streams", "s",
-        "-show_entries", "stream=index,codec_name,codec_type:stream_tags=language,title",
-        "-of", "json",
-        video_path
-    ]
-
-    try:
-        res = subprocess.run(command, capture_output=True, text=True, check=True)
-        data = json.loads(res.stdout)
-        subtitles = data.get("streams", [])
-        log(f"{len(subtitles)} piste(s) de sous-titres détectée(s)")
-        return subtitles
-    except subprocess.CalledProcessError as e:
-        stderr = e.stderr.decode('utf-8')
-        sys.stderr.write((f"Error: {e}:\n{stderr}\n"))
-        sys.exit(-1)
-
-def get_audio_data(video_path):
-    """ Get audio stream data from a video file.
-
-    Args:
-        video_path (str): path to the video file
-    Raises:
-        FileNotFoundError: _if the video file does not exist
-        Exception: _if there is an error reading the audio streams
-    Returns:
-        list: list of audio streams in the video file
-    """
-    if not os.path.isfile(video_path):
-        raise FileNotFoundError(f"Fichier vidéo non trouvé : {video_path}")
-    command = [
-        "ffprobe",
-        "-v", "error",
-        "-select_streams", "a",
-        "-show_entries", "stream=index,:stream_tags=language,title",
-        "-of", "json",
-        video_path
-    ]
-    try:
-        res = subprocess.run(command, capture_output=True, text=True, check=True)
-        data = json.loads(res.stdout)
-        audios = data.get("streams", [])
-        return audios
-    except subprocess.CalledProcessError as e:
-        stderr = e.stderr.decode('utf-8')
-        sys.stderr.write((f"Error: {e}:\n{stderr}\n"))
-        sys.exit(-1)
-
-def is_forced(subtitle):
+def is_forced(subtitle: SubtitleTrack):
     """ Check if a subtitle stream is forced.
 
     Args:
-        subtitle (dict): subtitle stream data
+        subtitle (SubtitleTrack): subtitle stream data
     Returns:
         bool: True if the subtitle is forced, False otherwise
     """
-    forced = subtitle.get("tags", {}).get("forced", "0")
-    title = subtitle.get("tags", {}).get("title", "").lower()
+    forced = subtitle.tags.get("forced", "0")
+    title = subtitle.tags.get("title", "").lower()
     if "forcé" in title or "forced" in title:
         return True
     return forced == "1"
 
-def is_hearing_impaired(subtitle):
+def is_hearing_impaired(subtitle: SubtitleTrack):
     """ Check if a subtitle stream is for hearing impaired.
 
     Args:
-        subtitle (dict): subtitle stream data
+        subtitle (SubtitleTrack): subtitle stream data
     Returns:
         bool: True if the subtitle is for hearing impaired, False otherwise
     """
-    tags = subtitle.get("tags", {})
+    tags = subtitle.tags
     hearing_impaired = tags.get("hearing_impaired", "0")
     title = tags.get("title", "").lower()
 
@@ -199,17 +133,17 @@ def is_hearing_impaired(subtitle):
 
     return hearing_impaired == "1"
 
-def get_subtitle_data(subtitle):
+def get_subtitle_data(subtitle: SubtitleTrack):
     """ Get subtitle data from a subtitle stream.
 
     Args:
-        subtitle (dict): subtitle stream data
+        subtitle (SubtitleTrack): subtitle stream data
     Returns:
         dict: subtitle data
     """
-    codec = subtitle.get("codec_name", "unknown")
-    index = subtitle["index"]
-    lang_code = subtitle.get("tags", {}).get("language", "und")
+    codec = subtitle.codec_name
+    index = subtitle.index
+    lang_code = subtitle.tags.get("language", "und")
     title = get_language_name(lang_code)
     is_forced_sub = is_forced(subtitle)
     is_hearing_impaired_sub = is_hearing_impaired(subtitle)
@@ -226,13 +160,59 @@ def get_subtitle_data(subtitle):
         "is_hearing_impaired": is_hearing_impaired_sub,
     }
 
-def convert_to_mp4(video_path, temp_path, log):
+def subtitle_args(subtitles: list[SubtitleTrack], log, input_index: int = 0,
+                  policy: TrackPolicy | None = None) -> list[str]:
+    """ Build the ffmpeg arguments mapping the text subtitles with their metadata and dispositions.
+
+    Args:
+        subtitles (list[SubtitleTrack]): subtitle tracks of the source
+        log (function): logging function
+        input_index (int, optional): ffmpeg input holding the tracks. Defaults to 0.
+        policy (TrackPolicy | None, optional): track policy, the process-wide one if None
+
+    Returns:
+        list[str]: ffmpeg arguments (maps, metadata and dispositions)
+    """
+    policy = policy or get_policy()
+    command = []
+    index_out = 0
+    for subtitle in subtitles:
+        subtitle_data = get_subtitle_data(subtitle)
+        if subtitle_data.get("codec") not in {"subrip", "ass", "ssa", "text"}:
+            log(f"Piste #{subtitle_data.get("index")} ({subtitle_data.get("lang")}) de type {subtitle_data.get("codec")} est ignorée", "WARN")
+            continue
+        decision = policy.decide(subtitle, "subtitle")
+        if not decision.keep:
+            log(f"Piste #{subtitle_data.get("index")} ({subtitle_data.get("lang")}) supprimée par la politique de pistes", "WARN")
+            continue
+        if decision.label:
+            subtitle_data["title"] += f" ({decision.label})"
+        command += [
+            "-map", f"{input_index}:{subtitle_data.get("index")}",
+            f"-metadata:s:s:{index_out}", f"title={subtitle_data.get("title")}",
+            f"-metadata:s:s:{index_out}", f"handler_name={subtitle_data.get("title")}",
+            f"-metadata:s:s:{index_out}", f"language={subtitle_data.get("lang")}",
+        ]
+        if subtitle_data.get("is_forced"):
+            command += [f"-disposition:s:{index_out}", "forced"]
+        if subtitle_data.get("is_hearing_impaired"):
+            command += [
+                f"-metadata:s:s:{index_out}", f"title={subtitle_data.get("title")}",
+                f"-metadata:s:s:{index_out}", f"handler_name={subtitle_data.get("title")}",
+                f"-metadata:s:s:{index_out}", "hearing_impaired=1",
+                f"-disposition:s:{index_out}","hearing_impaired"
+            ]
+        index_out += 1
+    return command
+
+def convert_to_mp4(video_path, temp_path, log, media: MediaInfo | None = None):
     """ Convert a video file to MP4 format using ffmpeg.
 
     Args:
         video_path (str): path to the video file
         temp_path (str): temporary path to the video file in conversion
         log (function): logging function
+        media (MediaInfo, optional): probe of video_path, probed here if not given
 
     Raises:
         FileNotFoundError: _if the video file does not exist
@@ -248,8 +228,10 @@ def convert_to_mp4(video_path, temp_path, log):
 
     file_name = os.path.basename(video_path).rsplit('.', 1)[0] + ".mp4"
 
-    subtitles = get_subtitles(video_path, log)
-    audios = get_audio_data(video_path)
+    media = media or probe(video_path)
+    subtitles = media.subtitles
+    audios = media.audio
+    log(f"{len(subtitles)} piste(s) de sous-titres détectée(s)")
 
     command = [
         "ffmpeg",
@@ -262,69 +244,30 @@ def convert_to_mp4(video_path, temp_path, log):
 
     index_out = 0
     for audio in audios:
-        command += [f"-metadata:s:a:{index_out}", f"title={audio.get("tags").get("title")}",]
-        command += [f"-metadata:s:a:{index_out}", f"handler_name={audio.get("tags").get("title")}",]
+        command += [f"-metadata:s:a:{index_out}", f"title={audio.tags.title}",]
+        command += [f"-metadata:s:a:{index_out}", f"handler_name={audio.tags.title}",]
         index_out += 1
 
-    index_out = 0
-    for subtitle in subtitles:
-        subtitle_data = get_subtitle_data(subtitle)
-        if subtitle_data.get("codec") not in {"subrip", "ass", "ssa", "text"}:
-            log(f"Piste #{subtitle_data.get("index")} ({subtitle_data.get("lang")}) de type {subtitle_data.get("codec")} est ignorée", "WARN")
-            continue
-        command += [
-            "-map", f"0:{subtitle_data.get("index")}",
-            f"-metadata:s:s:{index_out}", f"title={subtitle_data.get("title")}",
-            f"-metadata:s:s:{index_out}", f"handler_name={subtitle_data.get("title")}",
-            f"-metadata:s:s:{index_out}", f"language={subtitle_data.get("lang")}",
-        ]
-        if subtitle_data.get("is_forced"):
-            command += [f"-disposition:s:{index_out}", "forced"]
-        if subtitle_data.get("is_hearing_impaired"):
-            command += [
-                f"-metadata:s:s:{index_out}", f"title={subtitle_data.get("title")}",
-                f"-metadata:s:s:{index_out}", f"handler_name={subtitle_data.get("title")}",
-                f"-metadata:s:s:{index_out}", "hearing_impaired=1",
-                f"-disposition:s:{index_out}","hearing_impaired"
-            ]
-        index_out += 1
+    command += subtitle_args(subtitles, log)
 
     command += [
         "-c:s", "mov_text",
         "-map_metadata", "0",
         "-map_chapters", "0",
-        f"{temp_path}\\{file_name}"
+        os.path.join(temp_path, file_name)
     ]
 
-    process = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1
-    )
-
-    for line in process.stdout:
-        if "frame=" in line or "time=" in line or "Subtitle" in line:
-            log(line, "INFO")
-    result = {
+    run = run_ffmpeg(command, progress=f"{file_name} [mp4]", duration=media.duration)
+    if run.success:
+        log("✅ Conversion en mp4 ok", "OK")
+        return {
+            "success": True,
+            "output": os.path.join(temp_path, file_name),
+            "file_name": file_name
+        }
+    report_failure(run, "la conversion en mp4", log)
+    return {
         "success": False,
         "output": "",
         "file_name": ""
     }
-    ret = process.wait()
-    if ret == 0:
-        result = {
-            "success": True,
-            "output": f"{temp_path}\\{file_name}",
-            "file_name": file_name
-        }
-        log("✅ Conversion en mp4 ok", "OK")
-    else:
-        result = {
-            "success": False,
-            "output": "",
-            "file_name": ""
-        }
-        log(f"❌ Échec pour le transcode audio (code retour {ret})", "ERROR")
-    return result
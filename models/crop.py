@@ -0,0 +1,151 @@
+"""Black-bar detection: cropdetect on frames sampled across the film, merged into one crop rectangle."""
+
+from collections import OrderedDict
+import os
+import re
+import threading
+from models.probe import cache_key
+from models.runner import run_many
+from utils import MediaInfo
+
+CROP_SAMPLES = 16
+CROP_FRAMES = 5
+CROP_WORKERS = 6
+# Encoder block size the rectangle is widened to
+CROP_ALIGN = 8
+# Relative luma under which a row or column counts as black (24/255, bit depth independent)
+CROP_LIMIT = 0.094
+# Smallest share of the picture worth cropping away
+MIN_CROP_RATIO = 0.02
+_CROP_LINE = re.compile(r"crop=(\d+):(\d+):(\d+):(\d+)")
+
+_enabled = True
+_cache: "OrderedDict[tuple, str | None]" = OrderedDict()
+_cache_lock = threading.Lock()
+_CACHE_SIZE = 256
+
+def set_enabled(enabled: bool):
+    """ Turn the crop detection on or off for the whole process.
+
+    Args:
+        enabled (bool): False to always encode the full picture
+    """
+    global _enabled
+    _enabled = enabled
+
+def is_enabled() -> bool:
+    """True if black bars are detected and cropped."""
+    return _enabled
+
+def crop_command(video_path: str, stream_index: int, start: float) -> list[str]:
+    """ Build the command running cropdetect on a few frames from start.
+
+    Args:
+        video_path (str): path to the video file
+        stream_index (int): absolute index of the video stream
+        start (float): seek position in seconds
+
+    Returns:
+        list[str]: ffmpeg command
+    """
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-ss", f"{start:.3f}",
+        "-i", video_path,
+        "-map", f"0:{stream_index}",
+        "-frames:v", str(CROP_FRAMES),
+        "-vf", f"cropdetect=limit={CROP_LIMIT}:round=2:reset=0",
+        "-f", "null", "-",
+    ]
+
+def parse_crop(lines: list[str]) -> tuple[int, int, int, int] | None:
+    """ Read the last rectangle reported by cropdetect.
+
+    Args:
+        lines (list[str]): stderr lines of a crop_command run
+
+    Returns:
+        tuple[int, int, int, int] | None: (width, height, x, y) of the picture, None if nothing was detected
+    """
+    matches = [match for line in lines for match in _CROP_LINE.findall(line)]
+    if not matches:
+        return None
+    width, height, x, y = map(int, matches[-1])
+    return (width, height, x, y) if width > 0 and height > 0 else None
+
+def consensus(rectangles: list[tuple[int, int, int, int]], frame_width: int, frame_height: int,
+              align: int = CROP_ALIGN) -> tuple[int, int, int, int] | None:
+    """ Merge the rectangles of every sample into one crop that never cuts picture.
+
+    Dark scenes make cropdetect shrink the rectangle, so the union of the samples is kept,
+    once the samples that are mostly black (fades, credits) are dropped. The result is
+    widened to a multiple of align, centered, and clamped to the frame.
+
+    Args:
+        rectangles (list[tuple[int, int, int, int]]): (width, height, x, y) of each sample
+        frame_width (int): width of the source
+        frame_height (int): height of the source
+        align (int, optional): block size. Defaults to CROP_ALIGN.
+
+    Returns:
+        tuple[int, int, int, int] | None: (width, height, x, y), None if fewer than half the samples agree
+    """
+    area = frame_width * frame_height
+    valid = [r for r in rectangles if r[0] * r[1] >= area / 4]
+    if not valid or len(valid) * 2 < len(rectangles):
+        return None
+    left = min(x for _, _, x, _ in valid)
+    top = min(y for _, _, _, y in valid)
+    right = max(x + w for w, _, x, _ in valid)
+    bottom = max(y + h for _, h, _, y in valid)
+
+    def widen(start: int, end: int, limit: int) -> tuple[int, int]:
+        size = min(limit, -(-(end - start) // align) * align)
+        start = max(0, min(start - (size - (end - start)) // 2, limit - size))
+        return start - start % 2, size
+
+    x, width = widen(left, right, frame_width)
+    y, height = widen(top, bottom, frame_height)
+    return width, height, x, y
+
+def detect_crop(video_path: str, media: MediaInfo, samples: int = CROP_SAMPLES,
+                workers: int = CROP_WORKERS) -> str | None:
+    """ Detect the black bars of a video from seek points analyzed in parallel, memoized per file version.
+
+    Args:
+        video_path (str): path to the video file
+        media (MediaInfo): probe of video_path
+        samples (int, optional): number of seek points. Defaults to CROP_SAMPLES.
+        workers (int, optional): concurrent ffmpeg processes. Defaults to CROP_WORKERS.
+
+    Returns:
+        str | None: ffmpeg crop "w:h:x:y", None if disabled or if cropping is not worth it
+    """
+    track = media.video_track
+    if not _enabled or track is None or not track.width or not track.height or not media.duration:
+        return None
+    key = cache_key(video_path)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    # Skip the first and last 5% (logos, credits)
+    starts = [media.duration * (0.05 + 0.9 * (i + 0.5) / samples) for i in range(samples)]
+    name = os.path.basename(video_path)
+    runs = run_many([crop_command(video_path, track.index, start) for start in starts], workers,
+                    labels=[f"{name} [recadrage {i + 1}/{len(starts)}]" for i in range(len(starts))])
+    results = [parse_crop(run.stderr_tail) for run in runs]
+    rectangle = consensus([r for r in results if r is not None], track.width, track.height)
+    crop = None
+    if rectangle is not None:
+        width, height, _, _ = rectangle
+        if width * height <= track.width * track.height * (1 - MIN_CROP_RATIO):
+            crop = ":".join(map(str, rectangle))
+
+    with _cache_lock:
+        _cache[key] = crop
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return crop
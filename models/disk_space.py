@@ -0,0 +1,205 @@
+"""Disk-space planning: estimate stage outputs, pick a temp volume and reserve the space before encoding."""
+
+from dataclasses import dataclass
+import errno
+import os
+import shutil
+import threading
+from models.track_policy import get_policy
+from models.transcode_av1 import classify_resolution, detect_hdr, pick_params_from_source, video_bitrate
+from utils import MediaInfo
+
+# Safety factor applied to every estimate
+SPACE_MARGIN = 1.15
+SPACE_RETRY_SECONDS = 60.0
+BALLAST_NAME = ".reserve"
+
+@dataclass
+class SpaceEstimate:
+    """Class representing the expected size in bytes of the output of each stage."""
+    remux: int = 0
+    audio: int = 0
+    video: int = 0
+
+    def temp_bytes(self, three_pass: bool) -> int:
+        """ Peak size of the job temp directory.
+
+        Args:
+            three_pass (bool): True if the remux and audio stages write intermediate files
+
+        Returns:
+            int: bytes, the intermediates of a job stay on disk until it ends
+        """
+        return self.remux + self.audio + self.video if three_pass else self.video
+
+def estimate(media: MediaInfo) -> SpaceEstimate:
+    """ Estimate the outputs of a job from the probe of its source.
+
+    The remux and audio stages copy the video, so they are bounded by the source size;
+    the AV1 output is b_v x duration plus the AAC tracks. b_v comes from the probe fields
+    only (resolution, HDR, bitrate): no crop, complexity or packet analysis runs here.
+
+    Args:
+        media (MediaInfo): probe of the source
+
+    Returns:
+        SpaceEstimate: expected sizes, margin included
+    """
+    policy = get_policy()
+    audio_bps = sum(int(policy.audio_bitrate(track).rstrip("k")) * 1000 for track in media.audio)
+    track = media.video_track
+    if track is None:
+        video_bps = media.bit_rate
+    else:
+        video_bps = int(pick_params_from_source({
+            "resolution": classify_resolution(track.width, track.height),
+            "is_hdr": detect_hdr(track),
+            "bitrate": video_bitrate(media, track),
+        })["b_v"])
+    video = (video_bps + audio_bps) * media.duration / 8 if media.duration else media.size
+    return SpaceEstimate(
+        remux=int(media.size * SPACE_MARGIN),
+        audio=int(media.size * SPACE_MARGIN),
+        video=int(video * SPACE_MARGIN),
+    )
+
+def allocated_bytes(directory: str) -> int:
+    """ Bytes actually allocated on disk by the files of a directory tree.
+
+    Args:
+        directory (str): directory to measure
+
+    Returns:
+        int: sum of the allocated blocks, 0 if the directory is gone
+    """
+    total = 0
+    for current, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(current, name)).st_blocks * 512
+            except FileNotFoundError:
+                continue
+    return total
+
+@dataclass
+class Reservation:
+    """Class representing the space held for one job on its temp and output volumes."""
+    job_id: str
+    temp_root: str
+    temp_device: int
+    temp_bytes: int
+    output_device: int
+    output_bytes: int
+    temp_dir: str = ""
+
+    @property
+    def ballast(self) -> str:
+        """Path of the preallocated file holding the space not written yet."""
+        return os.path.join(self.temp_dir, BALLAST_NAME)
+
+    def preallocate(self, temp_dir: str) -> bool:
+        """ Allocate the reserved temp space as a ballast file in the job temp directory.
+
+        Args:
+            temp_dir (str): temp directory of the job, on temp_root
+
+        Returns:
+            bool: False if the volume is full, True otherwise (also when fallocate is unsupported)
+        """
+        self.temp_dir = temp_dir
+        try:
+            with open(self.ballast, "wb") as f:
+                os.posix_fallocate(f.fileno(), 0, self.temp_bytes)
+        except OSError as e:
+            if os.path.exists(self.ballast):
+                os.remove(self.ballast)
+            return e.errno not in (errno.ENOSPC, errno.EDQUOT)
+        return True
+
+    def make_room(self, nbytes: int):
+        """ Shrink the ballast right before a stage writes nbytes.
+
+        Args:
+            nbytes (int): expected output size of the stage
+        """
+        try:
+            size = os.path.getsize(self.ballast)
+        except (FileNotFoundError, ValueError):
+            return
+        os.truncate(self.ballast, max(0, size - nbytes))
+
+class SpacePlanner:
+    """Class choosing the temp volume of each job and keeping track of the space promised to running jobs.
+
+    The free space of a volume is what statvfs reports minus, for every reservation on it,
+    the part not yet allocated on disk (neither by its ballast nor by the files it wrote).
+    """
+
+    def __init__(self, temp_roots: list[str], output_path: str, min_free: int = 0):
+        self.temp_roots = [root for root in temp_roots if root]
+        self.output_path = output_path
+        self.min_free = min_free
+        self._lock = threading.Lock()
+        self._reservations: dict[str, Reservation] = {}
+
+    def _pending(self, device: int) -> int:
+        pending = 0
+        for reservation in self._reservations.values():
+            if reservation.temp_device == device:
+                held = allocated_bytes(reservation.temp_dir) if reservation.temp_dir else 0
+                pending += max(0, reservation.temp_bytes - held)
+            if reservation.output_device == device:
+                pending += reservation.output_bytes
+        return pending
+
+    def reserve(self, job_id: str, space: SpaceEstimate, three_pass: bool) -> Reservation | None:
+        """ Pick the temp volume with the most free space that fits the job, and hold the space.
+
+        Args:
+            job_id (str): job identifier
+            space (SpaceEstimate): expected outputs of the job
+            three_pass (bool): True if the intermediates are written to the temp directory
+
+        Returns:
+            Reservation | None: the reservation, None if the job does not fit right now
+        """
+        temp_bytes = space.temp_bytes(three_pass)
+        with self._lock:
+            output_device = os.stat(self.output_path).st_dev
+            output_free = shutil.disk_usage(self.output_path).free - self._pending(output_device) - self.min_free
+            candidates = []
+            for root in self.temp_roots:
+                device = os.stat(root).st_dev
+                free = shutil.disk_usage(root).free - self._pending(device) - self.min_free
+                # The final file is renamed into the output folder when both are on the same volume
+                output_bytes = 0 if device == output_device else space.video
+                if free >= temp_bytes and output_free >= output_bytes:
+                    candidates.append((free, root, device, output_bytes))
+            if not candidates:
+                return None
+            _, root, device, output_bytes = max(candidates)
+            reservation = Reservation(job_id, root, device, temp_bytes, output_device, output_bytes)
+            self._reservations[job_id] = reservation
+            return reservation
+
+    def can_fit(self, space: SpaceEstimate, three_pass: bool) -> bool:
+        """ Check if a job could fit on an empty temp volume, to avoid waiting forever.
+
+        Args:
+            space (SpaceEstimate): expected outputs of the job
+            three_pass (bool): True if the intermediates are written to the temp directory
+
+        Returns:
+            bool: True if some temp volume is large enough
+        """
+        temp_bytes = space.temp_bytes(three_pass)
+        return any(shutil.disk_usage(root).total - self.min_free >= temp_bytes for root in self.temp_roots)
+
+    def release(self, reservation: Reservation):
+        """ Give back the space of a finished job.
+
+        Args:
+            reservation (Reservation): reservation returned by reserve
+        """
+        with self._lock:
+            self._reservations.pop(reservation.job_id, None)
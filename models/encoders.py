@@ -0,0 +1,267 @@
+"""AV1 encoder backends (av1_nvenc, libsvtav1, libaom-av1) with capability detection and fallback."""
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import functools
+import os
+import subprocess
+from models.runner import RunResult, report_failure, run_ffmpeg
+from utils import TranscodeData
+
+DEFAULT_ORDER = ("av1_nvenc", "libsvtav1", "libaom-av1")
+# Scale of the CQ chosen by pick_params_from_source: the av1_nvenc -cq values
+REFERENCE_CQ_RANGE = (1, 51)
+
+@dataclass(frozen=True)
+class Capabilities:
+    """Class representing what the local ffmpeg build can do."""
+    encoders: frozenset
+    hwaccels: frozenset
+    filters: frozenset = frozenset()
+
+@functools.lru_cache(maxsize=1)
+def detect_capabilities() -> Capabilities:
+    """ Parse `ffmpeg -encoders`, `ffmpeg -hwaccels` and `ffmpeg -filters` once per process.
+
+    Returns:
+        Capabilities: encoders, hardware accelerations and filters available, empty if ffmpeg is missing
+    """
+    def _run(flag: str) -> str:
+        try:
+            res = subprocess.run(["ffmpeg", "-hide_banner", flag], capture_output=True, text=True,
+                                 encoding="utf-8", errors="replace", check=True)
+            return res.stdout
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+
+    encoders = set()
+    for line in _run("-encoders").splitlines():
+        parts = line.split()
+        # " V....D libsvtav1   SVT-AV1(...)" : capability flags then the encoder name
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0][0] == "V" and parts[1] != "=":
+            encoders.add(parts[1])
+    hwaccels = {line.strip() for line in _run("-hwaccels").splitlines()[1:] if line.strip()}
+    # " TS. ssim  VV->V  Calculate the SSIM..." : flags, filter name then its pads
+    filters = {parts[1] for parts in map(str.split, _run("-filters").splitlines())
+               if len(parts) >= 3 and "->" in parts[2]}
+    return Capabilities(encoders=frozenset(encoders), hwaccels=frozenset(hwaccels), filters=frozenset(filters))
+
+def color_args(info: TranscodeData) -> list[str]:
+    """ Build the pixel format and colorimetry arguments shared by every backend.
+
+    Args:
+        info (TranscodeData): transcoding data of the source
+
+    Returns:
+        list[str]: ffmpeg arguments
+    """
+    pix_fmt_out = "yuv420p10le" if info.is_hdr else "yuv420p"
+    primaries, trc, cspace = (
+        ("bt2020","smpte2084","bt2020nc") if info.is_hdr else
+        ("bt709","bt709","bt709")
+    )
+    return [
+        "-pix_fmt", pix_fmt_out,
+        "-color_primaries", primaries,"-color_trc", trc,"-colorspace", cspace,"-color_range","tv",
+    ]
+
+def filter_args(info: TranscodeData) -> list[str]:
+    """ Build the video filters shared by every backend: the black bar crop, if any.
+
+    Args:
+        info (TranscodeData): transcoding data of the source
+
+    Returns:
+        list[str]: ffmpeg arguments
+    """
+    return ["-vf", f"crop={info.crop}"] if info.crop else []
+
+def gop_size(info: TranscodeData) -> str:
+    """GOP of two seconds at the source framerate."""
+    return str(int(round(2 * info.framerate)))
+
+class EncoderBackend(ABC):
+    """Base class of an AV1 encoder backend mapping TranscodeData targets to encoder flags."""
+    name = ""
+    hwaccel: str | None = None
+    # Presets from the slowest (best quality) to the fastest
+    presets: tuple = ()
+    default_preset = ""
+    # Valid quality values (cq or crf), lower is better
+    cq_range: tuple = (0, 63)
+
+    @property
+    def is_hardware(self) -> bool:
+        """True if the backend runs on a GPU."""
+        return self.hwaccel is not None
+
+    def is_available(self, capabilities: Capabilities) -> bool:
+        """ Check if the local ffmpeg build supports this backend.
+
+        Args:
+            capabilities (Capabilities): detected capabilities
+
+        Returns:
+            bool: True if the encoder (and its hardware acceleration) is available
+        """
+        if self.name not in capabilities.encoders:
+            return False
+        return self.hwaccel is None or self.hwaccel in capabilities.hwaccels
+
+    def scale_cq(self, cq: int) -> int:
+        """ Map a CQ of the reference scale (av1_nvenc -cq) to the same quality level on this encoder.
+
+        Args:
+            cq (int): CQ chosen by pick_params_from_source
+
+        Returns:
+            int: value on the cq_range scale of this encoder
+        """
+        low, high = REFERENCE_CQ_RANGE
+        cq = min(high, max(low, cq))
+        target_low, target_high = self.cq_range
+        return round(target_low + (cq - low) * (target_high - target_low) / (high - low))
+
+    def input_args(self) -> list[str]:
+        """Arguments placed before `-i` (hardware decoding)."""
+        return ["-hwaccel", self.hwaccel] if self.hwaccel else []
+
+    @abstractmethod
+    def video_args(self, info: TranscodeData, preset: str | None = None, threads: int | None = None) -> list[str]:
+        """ Build the encoder arguments for the video track.
+
+        Args:
+            info (TranscodeData): transcoding data of the source
+            preset (str | None, optional): encoder preset, info.preset or default_preset if None
+            threads (int | None, optional): CPU threads allowed to the encoder
+
+        Returns:
+            list[str]: ffmpeg arguments
+        """
+
+class NvencBackend(EncoderBackend):
+    """NVIDIA NVENC AV1 encoder."""
+    name = "av1_nvenc"
+    hwaccel = "cuda"
+    presets = ("p7", "p6", "p5", "p4", "p3", "p2", "p1")
+    default_preset = "p3"
+    cq_range = REFERENCE_CQ_RANGE
+
+    def video_args(self, info, preset=None, threads=None):
+        return [
+            "-c:v","av1_nvenc","-preset", preset or info.preset or self.default_preset,
+            "-rc","vbr","-b:v", str(info.b_v), "-maxrate", str(info.maxrate), "-bufsize", str(info.bufsize),
+            "-cq", str(info.cq),
+            "-g", gop_size(info),"-rc-lookahead","32","-spatial-aq","1","-temporal-aq","1",
+            "-tile-columns", str(info.tile_columns),"-tile-rows","1",
+            *filter_args(info),
+            *color_args(info),
+        ]
+
+class SvtAv1Backend(EncoderBackend):
+    """SVT-AV1 CPU encoder, capped CRF."""
+    name = "libsvtav1"
+    presets = tuple(str(p) for p in range(2, 13))
+    default_preset = "6"
+    cq_range = (1, 63)
+
+    def video_args(self, info, preset=None, threads=None):
+        tile_columns_log2 = max(0, int(info.tile_columns).bit_length() - 1)
+        params = f"tile-columns={tile_columns_log2}"
+        if threads:
+            params += f":lp={threads}"
+        return [
+            "-c:v","libsvtav1","-preset", preset or info.preset or self.default_preset,
+            "-crf", str(info.cq), "-maxrate", str(info.maxrate), "-bufsize", str(info.bufsize),
+            "-g", gop_size(info),
+            "-svtav1-params", params,
+            *filter_args(info),
+            *color_args(info),
+        ]
+
+class AomAv1Backend(EncoderBackend):
+    """libaom AV1 CPU encoder, constrained quality."""
+    name = "libaom-av1"
+    presets = tuple(str(p) for p in range(2, 9))
+    default_preset = "6"
+
+    def video_args(self, info, preset=None, threads=None):
+        tile_columns_log2 = max(0, int(info.tile_columns).bit_length() - 1)
+        args = [
+            "-c:v","libaom-av1","-cpu-used", preset or info.preset or self.default_preset,"-row-mt","1",
+            "-crf", str(info.cq), "-b:v", str(info.b_v), "-maxrate", str(info.maxrate), "-bufsize", str(info.bufsize),
+            "-g", gop_size(info),
+            "-tile-columns", str(tile_columns_log2),
+            *filter_args(info),
+            *color_args(info),
+        ]
+        if threads:
+            args += ["-threads", str(threads)]
+        return args
+
+BACKENDS: dict[str, EncoderBackend] = {
+    backend.name: backend for backend in (NvencBackend(), SvtAv1Backend(), AomAv1Backend())
+}
+
+def available_backends(preferred: list[str] | None = None, cpu_only: bool = False) -> list[EncoderBackend]:
+    """ List the usable backends in order of preference.
+
+    Args:
+        preferred (list[str] | None, optional): encoder names in order of preference,
+            AV1_ENCODERS (comma separated) or DEFAULT_ORDER if None
+        cpu_only (bool, optional): exclude hardware encoders. Defaults to False.
+
+    Returns:
+        list[EncoderBackend]: backends available on this node
+    """
+    if preferred is None:
+        env = os.getenv("AV1_ENCODERS")
+        preferred = [n.strip() for n in env.split(",") if n.strip()] if env else list(DEFAULT_ORDER)
+    capabilities = detect_capabilities()
+    backends = [BACKENDS[name] for name in preferred if name in BACKENDS]
+    return [b for b in backends if b.is_available(capabilities) and not (cpu_only and b.is_hardware)]
+
+def failed_at_startup(result: RunResult) -> bool:
+    """ Check if a failed run never produced a frame (missing device, unsupported option...).
+
+    Args:
+        result (RunResult): failed run
+
+    Returns:
+        bool: True if no frame was encoded
+    """
+    return result.last_progress is None or result.last_progress.frame == 0
+
+def encode_with_fallback(build_command, label: str, duration: float, log,
+                         preferred: list[str] | None = None, output_path: str | None = None,
+                         on_success=None) -> RunResult | None:
+    """ Run an encode with the first available backend, falling back to the next one if it fails at startup.
+
+    Args:
+        build_command (function): backend -> ffmpeg command
+        label (str): progress board label
+        duration (float): media duration in seconds
+        log (function): logging function
+        preferred (list[str] | None, optional): encoder names in order of preference
+        output_path (str | None, optional): output removed before trying the next backend
+        on_success (function, optional): (backend, result) callback of the successful encode
+
+    Returns:
+        RunResult | None: result of the last attempt, None if no backend is available
+    """
+    backends = available_backends(preferred)
+    if not backends:
+        log("❌ Aucun encodeur AV1 disponible sur cette machine", "ERROR")
+        return None
+    result = None
+    for backend in backends:
+        log(f"Encodage AV1 avec {backend.name}")
+        result = run_ffmpeg(build_command(backend), progress=f"{label} [{backend.name}]", duration=duration)
+        if result.success and on_success is not None:
+            on_success(backend, result)
+        if result.success or not failed_at_startup(result):
+            return result
+        report_failure(result, f"le démarrage de {backend.name}", log)
+        if output_path and os.path.exists(output_path):
+            os.remove(output_path)
+    return result
@@ -0,0 +1,605 @@
+"""Concurrent batch executor pipelining files through bounded per-stage pools."""
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from models.chunked import SEGMENT_SECONDS, transcode_chunked
+from models.complexity import is_enabled as complexity_enabled
+from models.convert_to_mp4 import convert_to_mp4 as mp4
+from models.crop import is_enabled as crop_enabled
+from models.disk_space import SPACE_RETRY_SECONDS, Reservation, SpaceEstimate, SpacePlanner, estimate
+from models.journal import Journal, JournalEntry, clean_partial
+from models.metrics import get_recorder, span
+from models.output_cache import OutputCache, fingerprint, params_hash
+from models.pipeline import transcode_single_pass as single_pass
+from models.probe import ProbeError, cache_key, probe
+from models.quality import QualityTarget
+from models.runner import terminate_all
+from models.streamed import transcode_streamed
+from models.throughput import DeadlineScheduler, EncodeProfile, Pacing, ThroughputModel, get_store
+from models.track_policy import get_policy
+from models.transcode_audio import transcode_audio as audio
+from models.transcode_av1 import classify_resolution, detect_hdr, get_framerate, transcode_video as video
+from utils import MediaInfo
+from utils.log import log_context
+
+@dataclass
+class Job:
+    """Class representing one source file going through the pipeline."""
+    source: str
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    temp_dir: str = ""
+    media: MediaInfo | None = None
+    current: str = ""
+    fingerprint: str = ""
+    space: SpaceEstimate | None = None
+    reservation: Reservation | None = None
+    waiting: bool = False
+    fallback: bool = False
+    preset: str = ""
+
+    @property
+    def file_name(self) -> str:
+        """Name of the MP4 file produced for this job."""
+        return os.path.basename(self.source).rsplit('.', 1)[0] + ".mp4"
+
+    def temp_file(self, suffix: str) -> str:
+        """ Build a temp file path unique to this job.
+
+        Args:
+            suffix (str): stage suffix, e.g. "audio"
+
+        Returns:
+            str: path inside the job temp directory
+        """
+        return os.path.join(self.temp_dir, f"{self.file_name.rsplit('.', 1)[0]}.{suffix}.mp4")
+
+def encode_profile(media: MediaInfo) -> EncodeProfile | None:
+    """ Profile of a source from its probe alone, before the complexity analysis.
+
+    Args:
+        media (MediaInfo): probe of the source
+
+    Returns:
+        EncodeProfile | None: profile of its encode, None without a video track
+    """
+    track = media.video_track
+    if track is None:
+        return None
+    framerate = get_framerate(track.r_frame_rate, track.avg_frame_rate)
+    return EncodeProfile(classify_resolution(track.width, track.height), detect_hdr(track), "unknown",
+                         int(media.duration * framerate))
+
+class BatchExecutor:
+    """Run files through the pipeline with separate pools for remux, audio encoding and video encoding.
+
+    The remux pool (I/O-bound) also probes the sources, the audio pool is CPU-bound
+    and the video pool has one worker per encoder slot (a chunked encode fills one slot
+    with its own parallel segment encoders). A job moves to the next pool
+    as soon as its stage is done, so file N+1 is remuxed and has its audio encoded
+    while file N is in the video encoder. In streamed mode the three stages of a job
+    run at once in the video pool, piped into each other without intermediate files.
+
+    Sources that already are AV1 MP4 files are skipped, and so are, when an output
+    cache is given, sources already produced with the same parameters.
+
+    With a journal, every stage transition is recorded before and after the stage;
+    in resume mode the unfinished jobs of a previous run continue from their last
+    completed stage instead of starting over.
+
+    With a space planner, a job starts only once its estimated outputs fit on one of the
+    temp volumes (and on the output volume); until then it waits instead of failing. A job
+    whose single-pass encode fails reserves again, intermediates included, before its three stages.
+
+    Every encode logs its predicted duration and records its measured throughput. With a
+    deadline, the preset of each encode is the slowest one that still lets the jobs
+    submitted so far finish in time, see models.throughput. The output cache records the
+    preset a deadline imposed, and such an output is encoded again instead of being reused.
+    """
+
+    def __init__(self, log, move_file, output_path: str, temp_root: str, catalog=None,
+                 remux_workers: int = 2, audio_workers: int | None = None, audio_track_workers: int = 1,
+                 video_slots: int = 1, three_pass: bool = False, streamed: bool = False, chunked: bool = False,
+                 chunk_workers: int | None = None, segment_seconds: float = SEGMENT_SECONDS,
+                 encoders: list[str] | None = None, quality: QualityTarget | None = None,
+                 cache: OutputCache | None = None, journal: Journal | None = None, resume: bool = False,
+                 planner: SpacePlanner | None = None, deadline: float | None = None):
+        self.log = log
+        self.move_file = move_file
+        self.output_path = output_path
+        self.temp_root = temp_root
+        self.catalog = catalog
+        self.three_pass = three_pass or streamed
+        self.streamed = streamed
+        self.audio_track_workers = audio_track_workers
+        self.chunked = chunked
+        self.chunk_workers = chunk_workers
+        self.segment_seconds = segment_seconds
+        self.encoders = encoders
+        self.quality = quality
+        self.cache = cache
+        self.throughput = ThroughputModel(get_store())
+        # Seconds from now in which every submitted job should be encoded
+        self.scheduler = None
+        if deadline is not None:
+            self.scheduler = DeadlineScheduler(self.throughput, time.time() + deadline, video_slots)
+        self.params = params_hash(self.effective_params())
+        self.journal = journal
+        self.planner = planner
+        # Jobs waiting for disk space, retried when a job ends and every SPACE_RETRY_SECONDS
+        self._waiting: list[tuple[Job, Future]] = []
+        self._retry_timer: threading.Timer | None = None
+        self._pending: dict[str, JournalEntry] = {
+            source: entry for source, entry in journal.pending().items() if not entry.owned_by_live_process
+        } if journal and resume else {}
+        self._stopping = threading.Event()
+        self._shutdown_reason = ""
+        # Does the work of request_shutdown, which has to stay safe to call from a signal handler
+        threading.Thread(target=self._shutdown_when_stopping, name="shutdown", daemon=True).start()
+        self._counts = {"done": 0, "failed": 0, "interrupted": 0}
+        self._remux = ThreadPoolExecutor(max(1, remux_workers), thread_name_prefix="remux")
+        self._audio = ThreadPoolExecutor(max(1, audio_workers or max(1, (os.cpu_count() or 2) // 2)),
+                                         thread_name_prefix="audio")
+        self._video = ThreadPoolExecutor(max(1, video_slots), thread_name_prefix="video")
+        self._futures: list[Future] = []
+        self._lock = threading.Lock()
+
+    def submit(self, video_path: str) -> Future:
+        """ Queue a source file; the returned future resolves to True once it is in output_path.
+
+        Args:
+            video_path (str): path to the source video file
+
+        Returns:
+            Future: future resolved with the success of the job
+        """
+        done: Future = Future()
+        with self._lock:
+            # Long-running watchers submit forever: only keep the jobs still in flight
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.append(done)
+            entry = self._pending.pop(os.path.abspath(video_path), None)
+        if entry is not None:
+            job = Job(source=video_path, job_id=entry.job_id, temp_dir=entry.temp_dir)
+            self._schedule(self._remux, lambda j, d: self._resume(j, d, entry), job, done)
+        else:
+            self._schedule(self._remux, self._start, Job(source=video_path), done)
+        return done
+
+    def request_shutdown(self, reason: str = ""):
+        """ Ask the executor to stop; unfinished jobs keep their completed stages for --resume.
+
+        Only sets a flag, so it can be called from a signal handler while the interrupted
+        thread holds the executor lock: a helper thread stops the ffmpeg children.
+
+        Args:
+            reason (str, optional): cause logged by the helper thread
+        """
+        self._shutdown_reason = reason
+        self._stopping.set()
+
+    def _shutdown_when_stopping(self):
+        """Stop the running ffmpeg children and the jobs waiting for disk space, once asked to."""
+        self._stopping.wait()
+        self.log(f"{self._shutdown_reason or 'Arrêt demandé'}, arrêt des encodages en cours", "WARN")
+        terminate_all()
+        with self._lock:
+            waiting, self._waiting = self._waiting, []
+        for job, done in waiting:
+            self._finish(job, done, False)
+
+    @property
+    def mode(self) -> str:
+        """Name of the pipeline used for the jobs, for the resource reports."""
+        if self.streamed:
+            return "streamed"
+        if self.three_pass:
+            return "three_pass"
+        return "chunked" if self.chunked else "single_pass"
+
+    @property
+    def stopping(self) -> bool:
+        """True once a shutdown was requested."""
+        return self._stopping.is_set()
+
+    def join(self) -> dict:
+        """ Wait for every submitted job, then release the pools.
+
+        Returns:
+            dict: counters {"done", "failed", "interrupted"}
+        """
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+        self._remux.shutdown()
+        self._audio.shutdown()
+        self._video.shutdown()
+        with self._lock:
+            return dict(self._counts)
+
+    def effective_params(self) -> dict:
+        """ Parameters changing the produced file, hashed into the output cache key.
+
+        Returns:
+            dict: JSON-serializable parameters
+        """
+        return {
+            "three_pass": self.three_pass,
+            "streamed": self.streamed,
+            "chunked": self.chunked,
+            "segment_seconds": self.segment_seconds if self.chunked else None,
+            "encoders": self.encoders or os.getenv("AV1_ENCODERS"),
+            "quality": None if self.quality is None else {
+                "target": self.quality.target,
+                "metric": self.quality.metric,
+                "samples": self.quality.samples,
+                "sample_seconds": self.quality.sample_seconds,
+            },
+            "track_policy": asdict(get_policy()),
+            "complexity": complexity_enabled(),
+            "crop": crop_enabled(),
+            "deadline": self.scheduler is not None,
+        }
+
+    def _schedule(self, pool: ThreadPoolExecutor, step, job: Job, done: Future):
+        """Run one stage of a job in a pool, isolating any exception to this job."""
+        def task():
+            if self._stopping.is_set():
+                self._finish(job, done, False)
+                return
+            try:
+                with log_context(job=job.job_id, file=job.source):
+                    step(job, done)
+            except Exception as e:
+                self.log(f"Échec du traitement de {job.source} : {e}", "ERROR")
+                self._finish(job, done, False)
+        pool.submit(task)
+
+    def _journal(self, job: Job, stage: str, state: str, **fields):
+        if self.journal is not None:
+            self.journal.record(job.job_id, os.path.abspath(job.source), stage, state, **fields)
+
+    def _finish(self, job: Job, done: Future, success: bool):
+        if done.done():
+            return
+        if self.scheduler is not None:
+            self.scheduler.discard(job.job_id)
+        if job.reservation is not None:
+            self.planner.release(job.reservation)
+            job.reservation = None
+            self._retry_waiting()
+        if not success and self._stopping.is_set():
+            if job.temp_dir:
+                # Keep the last completed artifact so that --resume continues from it
+                clean_partial(job.temp_dir, job.current)
+                self._journal(job, "job", "interrupted")
+            outcome = "interrupted"
+        else:
+            if job.temp_dir:
+                shutil.rmtree(job.temp_dir, ignore_errors=True)
+                self._journal(job, "job", "finished" if success else "failed")
+            outcome = "done" if success else "failed"
+        with self._lock:
+            self._counts[outcome] += 1
+        metrics = get_recorder().finish(job.job_id, outcome,
+                                        os.path.join(self.output_path, job.file_name) if success else None)
+        if metrics is not None and metrics.output_bytes and any(s.stage == "video" for s in metrics.stages):
+            self.log(f"Compression {metrics.compression_ratio:.2f}:1, {metrics.read_amplification:.1f} octet(s) lu(s) "
+                     f"par octet source en {metrics.total.wall_time:.0f}s", "INFO")
+        done.set_result(success)
+
+    def _start(self, job: Job, done: Future):
+        if job.fallback:
+            # Probed and looked up in the cache before its single-pass encode failed
+            self._prepare(job, done)
+            return
+        if not job.waiting:
+            self.log(f"Traitement du fichier vidéo : {job.source}", "INFO")
+        get_recorder().begin(job.job_id, job.source, self.mode)
+        with span(job.job_id, "probe"):
+            job.media = probe(job.source, self.catalog)
+        if job.media.is_av1_mp4:
+            self.log(f"Déjà en AV1/MP4, ignoré : {job.source}", "OK")
+            self._finish(job, done, True)
+            return
+        if self._cached(job):
+            self._finish(job, done, True)
+            return
+        self._prepare(job, done)
+
+    def _prepare(self, job: Job, done: Future):
+        """Reserve the disk space of a job, create its temp directory and send it to its first stage."""
+        temp_root = self.temp_root
+        if self.planner is not None:
+            if not self._reserve(job, done):
+                return
+            temp_root = job.reservation.temp_root
+        job.temp_dir = tempfile.mkdtemp(prefix=f"{job.job_id}-", dir=temp_root)
+        if job.reservation is not None and not job.reservation.preallocate(job.temp_dir):
+            shutil.rmtree(job.temp_dir, ignore_errors=True)
+            job.temp_dir = ""
+            self.planner.release(job.reservation)
+            job.reservation = None
+            self._wait_for_space(job, done)
+            return
+        self._journal(job, "job", "created", temp_dir=job.temp_dir, size=job.media.size, mtime=job.media.mtime,
+                      pid=os.getpid())
+        self._journal(job, "probe", "done")
+        self._queue_encode(job)
+        if self._three_pass(job):
+            self._remux_stage(job, done)
+        else:
+            self._schedule(self._video, self._single_pass_stage, job, done)
+
+    def _reserve(self, job: Job, done: Future) -> bool:
+        """Hold the disk space of a job on a temp volume; False if it has to wait for space."""
+        job.space = estimate(job.media)
+        three_pass = self._three_pass(job)
+        if not self.planner.can_fit(job.space, three_pass):
+            self.log(f"❌ Aucun volume temporaire assez grand pour {job.source}", "ERROR")
+            self._finish(job, done, False)
+            return False
+        job.reservation = self.planner.reserve(job.job_id, job.space, three_pass)
+        if job.reservation is None:
+            self._wait_for_space(job, done)
+            return False
+        return True
+
+    def _three_pass(self, job: Job) -> bool:
+        """Check if a job writes the remux and audio intermediates to its temp directory."""
+        return job.fallback or (self.three_pass and not self.streamed)
+
+    def _fall_back(self, job: Job, done: Future):
+        """Send a job whose single-pass encode failed through the three stages."""
+        self.log("Passage au traitement en trois passes.", "WARN")
+        job.fallback, job.waiting = True, False
+        if job.reservation is None:
+            self._queue_encode(job)
+            self._schedule(self._remux, self._remux_stage, job, done)
+            return
+        # The reservation did not count the intermediates: reserve again, waiting for the space if needed
+        self.planner.release(job.reservation)
+        job.reservation = None
+        shutil.rmtree(job.temp_dir, ignore_errors=True)
+        self._journal(job, "job", "abandoned")
+        job.temp_dir = job.current = ""
+        self._schedule(self._remux, self._start, job, done)
+
+    def _wait_for_space(self, job: Job, done: Future):
+        if not job.waiting and not self._stopping.is_set():
+            self.log(f"Espace disque insuffisant pour {job.source}, en attente", "WARN")
+            job.waiting = True
+        with self._lock:
+            # Checked under the lock: the shutdown thread drains the list under it too
+            stopped = self._stopping.is_set()
+            if not stopped:
+                self._waiting.append((job, done))
+            if not stopped and self._retry_timer is None:
+                self._retry_timer = threading.Timer(SPACE_RETRY_SECONDS, self._retry_waiting)
+                self._retry_timer.daemon = True
+                self._retry_timer.start()
+        if stopped:
+            self._finish(job, done, False)
+
+    def _retry_waiting(self):
+        """Start again, in arrival order, the jobs waiting for disk space."""
+        with self._lock:
+            waiting, self._waiting = self._waiting, []
+            if self._retry_timer is not None:
+                self._retry_timer.cancel()
+                self._retry_timer = None
+        for job, done in waiting:
+            self._schedule(self._remux, self._start, job, done)
+
+    def _make_room(self, job: Job, stage: str):
+        """Release from the ballast of a job the space its next stage is about to write."""
+        if job.reservation is not None and job.space is not None:
+            job.reservation.make_room(getattr(job.space, stage))
+
+    def _resume(self, job: Job, done: Future, entry: JournalEntry):
+        """Continue a job of a previous run from its last completed stage."""
+        _, size, mtime = cache_key(job.source)
+        resumable = (
+            (size, mtime) == (entry.size, entry.mtime)
+            and os.path.isdir(entry.temp_dir)
+            and entry.stage in ("remux", "audio", "video", "verify", "move")
+            and (entry.stage == "move" or os.path.isfile(entry.artifact))
+        )
+        if not resumable:
+            self.log(f"Reprise impossible pour {job.source}, traitement depuis le début", "WARN")
+            if entry.temp_dir:
+                shutil.rmtree(entry.temp_dir, ignore_errors=True)
+            self._journal(job, "job", "abandoned")
+            job.job_id, job.temp_dir = Job(source=job.source).job_id, ""
+            self._start(job, done)
+            return
+        clean_partial(entry.temp_dir, entry.artifact)
+        get_recorder().begin(job.job_id, job.source, self.mode)
+        with span(job.job_id, "probe"):
+            job.media = probe(job.source, self.catalog)
+        job.current, job.preset = entry.artifact, entry.preset
+        if self.cache is not None:
+            job.fingerprint = fingerprint(job.source)
+        self.log(f"Reprise de {job.source} après l'étape {entry.stage}", "INFO")
+        if entry.stage in ("remux", "audio"):
+            self._queue_encode(job)
+        match entry.stage:
+            case "remux":
+                self._schedule(self._audio, self._audio_stage, job, done)
+            case "audio":
+                self._schedule(self._video, self._video_stage, job, done)
+            case "video":
+                self._deliver(job, done)
+            case "verify":
+                self._move(job, done)
+            case "move":
+                self._finish(job, done, True)
+
+    def _cached(self, job: Job) -> bool:
+        """Check the output cache, restoring the output if needed; True if the job has nothing left to do."""
+        if self.cache is None:
+            return False
+        destination = os.path.join(self.output_path, job.file_name)
+        job.fingerprint = fingerprint(job.source)
+        entry = self.cache.lookup(job.fingerprint, self.params)
+        if entry is not None and not self.cache.source_matches(entry, job.source):
+            self.log(f"Source modifiée depuis la dernière sortie, nouvel encodage : {job.source}", "WARN")
+            entry = None
+        if entry is not None and entry.preset:
+            # The preset is not in the parameters hash: an output sped up by a deadline is not reused
+            self.log(f"Sortie encodée au preset {entry.preset} imposé par l'échéance, nouvel encodage : "
+                     f"{job.source}", "INFO")
+            entry = None
+        if entry is not None:
+            if self.cache.is_fresh(entry, destination):
+                self.cache.touch(entry)
+                self.log(f"Déjà traité avec les mêmes paramètres, ignoré : {job.source}", "OK")
+                return True
+            if self.cache.restore(entry, destination, job.source):
+                self.log(f"Sortie restaurée depuis le cache : {destination}", "OK")
+                return True
+        elif (os.path.isfile(destination) and not self.cache.is_recorded(os.path.abspath(destination))
+              and self._is_av1_output(destination)):
+            # Output produced before the manifest existed: adopt it instead of encoding again
+            self.cache.record(job.fingerprint, self.params, job.source, destination)
+            self.log(f"Sortie AV1 existante adoptée dans le cache : {destination}", "OK")
+            return True
+        return False
+
+    def _is_av1_output(self, path: str) -> bool:
+        """Check if a file left at the output path is a readable AV1 MP4; a corrupt one is encoded again."""
+        try:
+            return probe(path).is_av1_mp4
+        except ProbeError as e:
+            self.log(f"Sortie existante illisible, nouvel encodage : {path} ({e})", "WARN")
+            return False
+
+    def _queue_encode(self, job: Job):
+        """Count the encode of a job in the deadline plan, until it starts."""
+        if self.scheduler is not None and job.media is not None:
+            profile = encode_profile(job.media)
+            if profile is not None:
+                self.scheduler.queue(job.job_id, profile)
+
+    def _pacing(self, job: Job, mode: str) -> Pacing:
+        """Preset choice and throughput recording of the encode of a job."""
+        return Pacing(job.job_id, self.throughput, self.log, mode, self.scheduler)
+
+    def _single_pass_stage(self, job: Job, done: Future):
+        self._journal(job, "video", "start", artifact=os.path.join(job.temp_dir, job.file_name))
+        self._make_room(job, "video")
+        with span(job.job_id, "video"):
+            pacing = self._pacing(job, self.mode)
+            if self.streamed:
+                result = transcode_streamed(job.source, job.temp_dir, self.log, media=job.media,
+                                            encoders=self.encoders, quality=self.quality, pacing=pacing)
+            elif self.chunked:
+                result = transcode_chunked(job.source, job.temp_dir, self.log, media=job.media,
+                                           workers=self.chunk_workers, segment_seconds=self.segment_seconds,
+                                           encoders=self.encoders, quality=self.quality, pacing=pacing)
+            else:
+                result = single_pass(job.source, job.temp_dir, self.log, media=job.media,
+                                     encoders=self.encoders, quality=self.quality, pacing=pacing)
+        if self.scheduler is not None:
+            self.scheduler.discard(job.job_id)
+        if result["success"]:
+            job.current = result["output"]
+            job.preset = pacing.chosen_preset
+            self._journal(job, "video", "done", artifact=job.current, preset=job.preset)
+            self._deliver(job, done)
+        elif self.streamed:
+            # Streamed mode never writes intermediates: falling back to the three stages would fill the temp volume
+            self.log(f"❌ Échec du transcodage en flux de {job.source}", "ERROR")
+            self._finish(job, done, False)
+        else:
+            self._fall_back(job, done)
+
+    def _remux_stage(self, job: Job, done: Future):
+        self._journal(job, "remux", "start", artifact=os.path.join(job.temp_dir, job.file_name))
+        self._make_room(job, "remux")
+        with span(job.job_id, "remux"):
+            result = mp4(job.source, job.temp_dir, self.log, media=job.media)
+        if not result["success"]:
+            self._finish(job, done, False)
+            return
+        self.log("Conversion en MP4 terminée avec succès.", "OK")
+        job.current = result["output"]
+        self._journal(job, "remux", "done", artifact=job.current)
+        self._schedule(self._audio, self._audio_stage, job, done)
+
+    def _audio_stage(self, job: Job, done: Future):
+        output = job.temp_file("audio")
+        self._journal(job, "audio", "start", artifact=output)
+        self._make_room(job, "audio")
+        with span(job.job_id, "audio"):
+            success = audio(job.current, output, self.log, track_workers=self.audio_track_workers)
+        if not success:
+            self._finish(job, done, False)
+            return
+        self.log("Transcodage audio terminée avec succès.", "OK")
+        job.current = output
+        self._journal(job, "audio", "done", artifact=output)
+        self._schedule(self._video, self._video_stage, job, done)
+
+    def _video_stage(self, job: Job, done: Future):
+        output = job.temp_file("av1")
+        self._journal(job, "video", "start", artifact=output)
+        self._make_room(job, "video")
+        with span(job.job_id, "video"):
+            pacing = self._pacing(job, "three_pass")
+            success = video(job.current, output, self.log, encoders=self.encoders, quality=self.quality,
+                            pacing=pacing)
+        if self.scheduler is not None:
+            self.scheduler.discard(job.job_id)
+        if not success:
+            self._finish(job, done, False)
+            return
+        self.log("Transcodage vidéo AV1 terminé avec succès.", "OK")
+        job.current = output
+        job.preset = pacing.chosen_preset
+        self._journal(job, "video", "done", artifact=output, preset=job.preset)
+        self._deliver(job, done)
+
+    def _deliver(self, job: Job, done: Future):
+        self._journal(job, "verify", "start", artifact=job.current)
+        with span(job.job_id, "verify"):
+            verified = self._verify(job)
+        if not verified:
+            self._finish(job, done, False)
+            return
+        self._journal(job, "verify", "done", artifact=job.current)
+        self._move(job, done)
+
+    def _verify(self, job: Job) -> bool:
+        """Check that the produced file is a readable AV1 MP4 as long as its source."""
+        try:
+            output = probe(job.current)
+        except (ProbeError, FileNotFoundError) as e:
+            self.log(f"❌ Sortie illisible {job.current} : {e}", "ERROR")
+            return False
+        if not output.is_av1_mp4:
+            self.log(f"❌ La sortie {job.current} n'est pas un MP4 AV1", "ERROR")
+            return False
+        tolerance = max(2.0, job.media.duration * 0.01)
+        if job.media.duration and abs(output.duration - job.media.duration) > tolerance:
+            self.log(f"❌ Durée de la sortie {output.duration:.1f}s au lieu de {job.media.duration:.1f}s", "ERROR")
+            return False
+        return True
+
+    def _move(self, job: Job, done: Future):
+        destination = os.path.join(self.output_path, job.file_name)
+        self._journal(job, "move", "start", artifact=destination)
+        with span(job.job_id, "move"):
+            moved = self.move_file(job.current, destination)
+        if moved:
+            self._journal(job, "move", "done", artifact=destination)
+            if self.cache is not None:
+                # A copied file comes with the checksum taken during the copy
+                self.cache.record(job.fingerprint, self.params, job.source, destination,
+                                  digest=getattr(moved, "digest", None), preset=job.preset)
+        self._finish(job, done, bool(moved))
@@ -0,0 +1,194 @@
+"""Durable file moves across filesystems: rename, reflink or in-kernel copy, checksummed and fsynced."""
+
+from dataclasses import dataclass
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+
+# ioctl number of FICLONE (linux/fs.h), clones a whole file on btrfs / XFS / bcachefs
+FICLONE = 0x40049409
+# Bytes copied by one copy_file_range / sendfile call, then hashed
+COPY_CHUNK = 64 * 1024 * 1024
+# Buffer of the last-resort copy
+BUFFER_SIZE = 8 * 1024 * 1024
+# Errors meaning "this copy method is not available here", the next one is tried instead
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EBADF, errno.EPERM}
+
+@dataclass
+class MoveResult:
+    """Class representing the outcome of move_file; truthy when the file was moved."""
+    success: bool
+    method: str = ""
+    digest: str | None = None
+    error: str = ""
+
+    def __bool__(self) -> bool:
+        return self.success
+
+def new_digest():
+    """Hash object shared by every checksum of the project."""
+    return hashlib.blake2b(digest_size=32)
+
+def checksum(path: str) -> str:
+    """ Hash the full content of a file.
+
+    Args:
+        path (str): path to the file
+
+    Returns:
+        str: hex digest
+    """
+    digest = new_digest()
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buffer):
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+def _hash_range(fd: int, offset: int, length: int, digest, view: memoryview):
+    """Feed digest with a range of a file that was just copied, so still in the page cache."""
+    end = offset + length
+    while offset < end:
+        n = os.preadv(fd, [view[:min(len(view), end - offset)]], offset)
+        if n == 0:
+            raise OSError(errno.EIO, "fin de fichier inattendue pendant le calcul du checksum")
+        digest.update(view[:n])
+        offset += n
+
+def _reflink(src_fd: int, dest_fd: int, size: int, offset: int) -> int:
+    if offset:
+        raise OSError(errno.EINVAL, "reflink partiel")
+    fcntl.ioctl(dest_fd, FICLONE, src_fd)
+    return size
+
+def _copy_file_range(src_fd: int, dest_fd: int, size: int, offset: int) -> int:
+    while offset < size:
+        n = os.copy_file_range(src_fd, dest_fd, min(COPY_CHUNK, size - offset), offset, offset)
+        if n == 0:
+            break
+        offset += n
+    return offset
+
+def _sendfile(src_fd: int, dest_fd: int, size: int, offset: int) -> int:
+    os.lseek(dest_fd, offset, os.SEEK_SET)
+    while offset < size:
+        n = os.sendfile(dest_fd, src_fd, offset, min(COPY_CHUNK, size - offset))
+        if n == 0:
+            break
+        offset += n
+    return offset
+
+def _buffered(src_fd: int, dest_fd: int, size: int, offset: int) -> int:
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    while offset < size:
+        n = os.preadv(src_fd, [view[:min(BUFFER_SIZE, size - offset)]], offset)
+        if n == 0:
+            break
+        written = 0
+        while written < n:
+            written += os.pwrite(dest_fd, view[written:n], offset + written)
+        offset += n
+    return offset
+
+# Tried in order; each one continues from where the previous one stopped
+COPY_METHODS = [("reflink", _reflink), ("copy_file_range", _copy_file_range),
+                ("sendfile", _sendfile), ("buffered", _buffered)]
+
+def copy_file(src: str, dest: str) -> tuple[str, str]:
+    """ Copy src to dest with the cheapest method the filesystems support, hashing what was copied.
+
+    The data goes through the kernel (reflink, copy_file_range, sendfile) whenever possible;
+    the source is re-read chunk by chunk right after each copy, from the page cache, for the
+    checksum. dest is fsynced before returning.
+
+    Args:
+        src (str): source file
+        dest (str): destination file, overwritten
+
+    Raises:
+        OSError: if every method failed or the source changed during the copy
+
+    Returns:
+        tuple[str, str]: method that finished the copy, checksum of the copied content
+    """
+    size = os.path.getsize(src)
+    digest = new_digest()
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dest_fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            offset, method, last_error = 0, "", None
+            for name, copy in COPY_METHODS:
+                try:
+                    done = copy(src_fd, dest_fd, size, offset)
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED:
+                        raise
+                    last_error = e
+                    continue
+                _hash_range(src_fd, offset, done - offset, digest, view)
+                offset, method = done, name
+                if offset >= size:
+                    break
+            if offset < size:
+                raise last_error or OSError(errno.EIO, f"copie interrompue à {offset}/{size} octets")
+            if os.fstat(src_fd).st_size != size:
+                raise OSError(errno.EIO, "le fichier source a changé pendant la copie")
+            os.ftruncate(dest_fd, size)
+            os.fsync(dest_fd)
+        finally:
+            os.close(dest_fd)
+    finally:
+        os.close(src_fd)
+    return method, digest.hexdigest()
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def move_file(src: str, dest: str, verify: bool = True) -> MoveResult:
+    """ Move a file, across filesystems if needed, without ever losing it.
+
+    A rename is used when src and dest share a filesystem. Otherwise the content is copied
+    to a hidden partial file next to dest, fsynced, checked against the checksum taken
+    during the copy, renamed over dest, and only then is src unlinked.
+
+    Args:
+        src (str): source file
+        dest (str): destination path
+        verify (bool, optional): re-read dest and compare checksums before unlinking src. Defaults to True.
+
+    Returns:
+        MoveResult: success, method used and checksum of the content when it was copied
+    """
+    try:
+        os.rename(src, dest)
+        return MoveResult(True, "rename")
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            return MoveResult(False, "rename", error=str(e))
+
+    directory = os.path.dirname(os.path.abspath(dest))
+    partial = os.path.join(directory, f".{os.path.basename(dest)}.partial")
+    try:
+        method, digest = copy_file(src, partial)
+        shutil.copystat(src, partial)
+        if verify and checksum(partial) != digest:
+            raise OSError(errno.EIO, f"checksum différent après copie ({method})")
+        os.replace(partial, dest)
+        _fsync_dir(directory)
+    except OSError as e:
+        if os.path.exists(partial):
+            os.remove(partial)
+        return MoveResult(False, "copy", error=str(e))
+    os.remove(src)
+    return MoveResult(True, method, digest)
@@ -0,0 +1,314 @@
+"""Persistent SQLite job queue shared by several worker processes on the same host."""
+
+from concurrent.futures import wait
+from dataclasses import dataclass
+import os
+import sqlite3
+import threading
+import time
+
+MAX_ATTEMPTS = 3
+BACKOFF_SECONDS = 60.0
+BACKOFF_MAX_SECONDS = 3600.0
+HEARTBEAT_SECONDS = 30.0
+STALE_SECONDS = 180.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL UNIQUE,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    not_before REAL NOT NULL DEFAULT 0,
+    worker TEXT,
+    heartbeat REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, priority DESC, id);
+"""
+
+@dataclass
+class QueuedJob:
+    """Class representing one row of the job queue."""
+    id: int
+    source: str
+    priority: int
+    state: str
+    attempts: int
+    max_attempts: int
+    not_before: float
+    worker: str | None
+    heartbeat: float | None
+    last_error: str | None
+    created_at: float
+    updated_at: float
+
+_COLUMNS = ("id, source, priority, state, attempts, max_attempts, not_before, worker, heartbeat,"
+            " last_error, created_at, updated_at")
+
+def backoff(attempts: int) -> float:
+    """ Delay before retrying a job that failed attempts times.
+
+    Args:
+        attempts (int): number of failed attempts
+
+    Returns:
+        float: seconds, doubling at each attempt up to BACKOFF_MAX_SECONDS
+    """
+    return min(BACKOFF_MAX_SECONDS, BACKOFF_SECONDS * 2 ** max(0, attempts - 1))
+
+class JobQueue:
+    """Class wrapping the SQLite job queue.
+
+    Jobs go queued -> running -> done, or back to queued after a failure until
+    max_attempts is reached (then failed). Claims run in an IMMEDIATE transaction so
+    that several processes can pull from the same database without taking the same job.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def _write(self, sql: str, params: tuple = ()) -> int:
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
+
+    def enqueue(self, source: str, priority: int = 0, max_attempts: int = MAX_ATTEMPTS) -> bool:
+        """ Add a file to the queue, or raise its priority if it is already waiting.
+
+        A file already done or failed is queued again with its attempts reset.
+
+        Args:
+            source (str): path of the source file
+            priority (int, optional): higher runs first. Defaults to 0.
+            max_attempts (int, optional): attempts before the job is failed. Defaults to MAX_ATTEMPTS.
+
+        Returns:
+            bool: True if the job is queued or running after the call
+        """
+        now = time.time()
+        self._write(
+            "INSERT INTO jobs (source, priority, max_attempts, created_at, updated_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT(source) DO UPDATE SET"
+            " priority = CASE WHEN state IN ('done', 'failed') THEN excluded.priority"
+            "                 ELSE MAX(priority, excluded.priority) END,"
+            " attempts = CASE WHEN state IN ('done', 'failed') THEN 0 ELSE attempts END,"
+            " not_before = CASE WHEN state IN ('done', 'failed') THEN 0 ELSE not_before END,"
+            " last_error = CASE WHEN state IN ('done', 'failed') THEN NULL ELSE last_error END,"
+            " state = CASE WHEN state IN ('done', 'failed') THEN 'queued' ELSE state END,"
+            " max_attempts = excluded.max_attempts,"
+            " updated_at = excluded.updated_at",
+            (os.path.abspath(source), priority, max_attempts, now, now),
+        )
+        return True
+
+    def prioritize(self, source: str, priority: int) -> bool:
+        """ Change the priority of a file waiting in the queue.
+
+        Args:
+            source (str): path of the source file
+            priority (int): new priority, higher runs first
+
+        Returns:
+            bool: True if a job was updated
+        """
+        return self._write(
+            "UPDATE jobs SET priority = ?, updated_at = ? WHERE source = ?",
+            (priority, time.time(), os.path.abspath(source)),
+        ) > 0
+
+    def claim(self, worker: str) -> QueuedJob | None:
+        """ Take the queued job with the highest priority whose retry delay is over.
+
+        Args:
+            worker (str): identifier of the claiming worker
+
+        Returns:
+            QueuedJob | None: the claimed job, now running, None if nothing is ready
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT {_COLUMNS} FROM jobs WHERE state = 'queued' AND not_before <= ?"
+                    " ORDER BY priority DESC, id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET state = 'running', attempts = attempts + 1, worker = ?, heartbeat = ?,"
+                    " updated_at = ? WHERE id = ?",
+                    (worker, now, now, row[0]),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        job = QueuedJob(*row)
+        job.state, job.attempts, job.worker, job.heartbeat = "running", job.attempts + 1, worker, now
+        return job
+
+    def heartbeat(self, job_ids: list[int], worker: str):
+        """ Tell that a worker is still processing its jobs.
+
+        Args:
+            job_ids (list[int]): jobs held by the worker
+            worker (str): identifier of the worker
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                [(now, job_id, worker) for job_id in job_ids],
+            )
+
+    def complete(self, job: QueuedJob):
+        """ Mark a job as done.
+
+        Args:
+            job (QueuedJob): claimed job
+        """
+        self._write("UPDATE jobs SET state = 'done', updated_at = ? WHERE id = ? AND worker = ?",
+                    (time.time(), job.id, job.worker))
+
+    def fail(self, job: QueuedJob, error: str):
+        """ Record a failed attempt: retry later with exponential backoff, or fail the job for good.
+
+        Args:
+            job (QueuedJob): claimed job
+            error (str): description of the failure
+        """
+        now = time.time()
+        if job.attempts < job.max_attempts:
+            self._write(
+                "UPDATE jobs SET state = 'queued', not_before = ?, last_error = ?, worker = NULL, updated_at = ?"
+                " WHERE id = ? AND worker = ?",
+                (now + backoff(job.attempts), error, now, job.id, job.worker),
+            )
+        else:
+            self._write(
+                "UPDATE jobs SET state = 'failed', last_error = ?, updated_at = ? WHERE id = ? AND worker = ?",
+                (error, now, job.id, job.worker),
+            )
+
+    def release(self, job: QueuedJob):
+        """ Put back a job interrupted by a shutdown, without counting the attempt.
+
+        Args:
+            job (QueuedJob): claimed job
+        """
+        self._write(
+            "UPDATE jobs SET state = 'queued', attempts = MAX(0, attempts - 1), worker = NULL, updated_at = ?"
+            " WHERE id = ? AND worker = ?",
+            (time.time(), job.id, job.worker),
+        )
+
+    def requeue_stale(self, stale_seconds: float = STALE_SECONDS) -> int:
+        """ Requeue the running jobs of workers that stopped sending heartbeats.
+
+        Args:
+            stale_seconds (float, optional): heartbeat age after which a worker is considered dead
+
+        Returns:
+            int: number of jobs requeued or failed
+        """
+        now = time.time()
+        return self._write(
+            "UPDATE jobs SET state = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,"
+            " last_error = 'worker ' || COALESCE(worker, '?') || ' sans nouvelles', worker = NULL, updated_at = ?"
+            " WHERE state = 'running' AND heartbeat < ?",
+            (now, now - stale_seconds),
+        )
+
+    def jobs(self, states: tuple = ("queued", "running", "failed")) -> list[QueuedJob]:
+        """ List the jobs in some states, in the order they would run.
+
+        Args:
+            states (tuple, optional): states to list. Defaults to the unfinished and failed ones.
+
+        Returns:
+            list[QueuedJob]: jobs
+        """
+        marks = ", ".join("?" for _ in states)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE state IN ({marks})"
+                " ORDER BY state = 'running' DESC, priority DESC, id",
+                states,
+            ).fetchall()
+        return [QueuedJob(*row) for row in rows]
+
+    def counts(self) -> dict[str, int]:
+        """Number of jobs per state."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+def run_worker(queue: JobQueue, executor, worker: str, log, stop: threading.Event, capacity: int = 2,
+               poll_interval: float = 5.0, drain: bool = False, stale_seconds: float = STALE_SECONDS):
+    """ Pull jobs from the queue into a BatchExecutor until stop is set.
+
+    At most capacity jobs are claimed at a time, so a job queued or reprioritized while
+    the worker runs is picked up as soon as a slot frees up. Finished jobs are settled in
+    the queue by this loop, not by future callbacks, and the jobs still running when it
+    stops are waited for and settled before it returns, so the caller can close the
+    queue right after.
+
+    Args:
+        queue (JobQueue): job queue
+        executor (BatchExecutor): executor running the pipeline
+        worker (str): identifier of this worker
+        log (function): logging function
+        stop (threading.Event): set to stop claiming jobs
+        capacity (int, optional): jobs held at the same time. Defaults to 2.
+        poll_interval (float, optional): seconds between two looks at the queue. Defaults to 5.0.
+        drain (bool, optional): return once the queue has nothing ready and no job is running
+        stale_seconds (float, optional): heartbeat age after which a job of another worker is requeued
+    """
+    in_flight: dict[int, tuple[QueuedJob, object]] = {}
+
+    def settle(job_id: int):
+        job, future = in_flight.pop(job_id)
+        if future.result():
+            queue.complete(job)
+        elif executor.stopping:
+            queue.release(job)
+        else:
+            queue.fail(job, f"échec du traitement (essai {job.attempts}/{job.max_attempts})")
+
+    last_heartbeat = time.monotonic()
+    while not stop.is_set():
+        requeued = queue.requeue_stale(stale_seconds)
+        if requeued:
+            log(f"{requeued} travail(aux) d'un worker arrêté remis en file", "WARN")
+        for job_id in [i for i, (_, future) in in_flight.items() if future.done()]:
+            settle(job_id)
+        while len(in_flight) < capacity and not stop.is_set():
+            job = queue.claim(worker)
+            if job is None:
+                break
+            log(f"Travail {job.id} (priorité {job.priority}, essai {job.attempts}) : {job.source}", "INFO")
+            in_flight[job.id] = (job, executor.submit(job.source))
+        if drain and not in_flight:
+            break
+        if time.monotonic() - last_heartbeat >= HEARTBEAT_SECONDS and in_flight:
+            queue.heartbeat(list(in_flight), worker)
+            last_heartbeat = time.monotonic()
+        stop.wait(poll_interval)
+    wait([future for _, future in in_flight.values()])
+    for job_id in list(in_flight):
+        settle(job_id)
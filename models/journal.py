@@ -0,0 +1,198 @@
+"""Write-ahead job journal: every stage transition is appended and synced before moving on."""
+
+from dataclasses import dataclass
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+
+# Stages in pipeline order; single pass, chunked and streamed encodes are journaled as "video"
+STAGES = ("probe", "remux", "audio", "video", "verify", "move")
+
+class JournalLocked(RuntimeError):
+    """Raised when another live process already writes to a journal."""
+
+def pid_alive(pid: int) -> bool:
+    """ Check if a process exists.
+
+    Args:
+        pid (int): process id, 0 if unknown
+
+    Returns:
+        bool: True if the process is running (or exists under another user)
+    """
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+@dataclass
+class JournalEntry:
+    """Class representing the last known state of a job replayed from the journal."""
+    job_id: str
+    source: str
+    temp_dir: str = ""
+    size: int = 0
+    mtime: float = 0.0
+    # Last completed stage and the artifact it produced
+    stage: str = ""
+    artifact: str = ""
+    # Stage started but never completed, its artifact is partial
+    running: str = ""
+    running_artifact: str = ""
+    # Process that created the job, 0 for journals written before it was recorded
+    pid: int = 0
+    # Encoder preset a deadline chose for the completed video stage, "" for the default one
+    preset: str = ""
+
+    @property
+    def owned_by_live_process(self) -> bool:
+        """True if the job was created by another process that is still running."""
+        return self.pid != os.getpid() and pid_alive(self.pid)
+
+class Journal:
+    """Append-only JSON lines journal of the jobs of the executor.
+
+    Records are flushed and fsynced before the stage they announce starts, so after a
+    crash the journal tells for every unfinished job its temp directory, the last
+    completed stage with its artifact and the stage that was interrupted.
+
+    A journal has a single writer: an exclusive lock on `<path>.lock` is held while it
+    is open, so that a second process can never abandon the jobs of a live one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._lock_file = open(f"{path}.lock", "a", encoding="utf-8")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise JournalLocked(f"Journal {path} déjà utilisé par un autre processus, "
+                                "choisir un autre fichier avec --journal") from None
+        self._file = open(path, "a", encoding="utf-8")
+
+    def close(self):
+        """Close the journal file and release its lock."""
+        with self._lock:
+            self._file.close()
+            self._lock_file.close()
+
+    def record(self, job_id: str, source: str, stage: str, state: str, **fields):
+        """ Append one transition and sync it to disk.
+
+        Args:
+            job_id (str): job identifier
+            source (str): source file of the job
+            stage (str): one of STAGES, or "job" for the job lifecycle
+            state (str): "start" / "done" for stages, "created" / "finished" / "failed" / "interrupted" for jobs
+            **fields: extra values, e.g. artifact, temp_dir, size, mtime
+        """
+        line = json.dumps({"ts": time.time(), "job": job_id, "source": source,
+                           "stage": stage, "state": state, **fields}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def pending(self) -> dict[str, JournalEntry]:
+        """ Replay the journal and return the jobs that never finished.
+
+        Returns:
+            dict[str, JournalEntry]: source path -> state of its most recent unfinished job
+        """
+        with self._lock:
+            self._file.flush()
+        jobs: dict[str, JournalEntry] = {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line of a crash
+                    continue
+                job_id, stage, state = record["job"], record["stage"], record["state"]
+                if stage == "job" and state == "created":
+                    jobs[job_id] = JournalEntry(job_id, record["source"], record.get("temp_dir", ""),
+                                                record.get("size", 0), record.get("mtime", 0.0),
+                                                pid=record.get("pid", 0))
+                    continue
+                entry = jobs.get(job_id)
+                if entry is None:
+                    continue
+                if stage == "job" and state in ("finished", "failed", "abandoned"):
+                    del jobs[job_id]
+                elif state == "start":
+                    entry.running, entry.running_artifact = stage, record.get("artifact", "")
+                elif state == "done":
+                    entry.stage, entry.artifact = stage, record.get("artifact", "")
+                    entry.preset = record.get("preset", entry.preset)
+                    entry.running = entry.running_artifact = ""
+        return {entry.source: entry for entry in jobs.values()}
+
+    def compact(self):
+        """Rewrite the journal keeping only the records of unfinished jobs."""
+        keep = {entry.job_id for entry in self.pending().values()}
+        with self._lock:
+            self._file.close()
+            temp = f"{self.path}.tmp"
+            with open(self.path, encoding="utf-8") as src, open(temp, "w", encoding="utf-8") as dest:
+                for line in src:
+                    try:
+                        if json.loads(line)["job"] in keep:
+                            dest.write(line)
+                    except json.JSONDecodeError:
+                        continue
+                dest.flush()
+                os.fsync(dest.fileno())
+            os.replace(temp, self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
+
+def clean_partial(temp_dir: str, keep: str = ""):
+    """ Delete everything in the temp directory of a job except its last completed artifact.
+
+    Args:
+        temp_dir (str): temp directory of the job
+        keep (str, optional): path of the artifact to keep
+    """
+    if not temp_dir or not os.path.isdir(temp_dir):
+        return
+    for name in os.listdir(temp_dir):
+        path = os.path.join(temp_dir, name)
+        if path == keep:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+def abandon_pending(journal: Journal, log):
+    """ Remove the temp directories of the unfinished jobs of a previous run and forget them.
+
+    Jobs created by a process that is still running are left alone.
+
+    Args:
+        journal (Journal): journal of the previous runs
+        log (function): logging function
+    """
+    pending = {}
+    for source, entry in journal.pending().items():
+        if entry.owned_by_live_process:
+            log(f"{source} est en cours dans le processus {entry.pid}, non abandonné", "WARN")
+        else:
+            pending[source] = entry
+    for entry in pending.values():
+        if entry.temp_dir:
+            shutil.rmtree(entry.temp_dir, ignore_errors=True)
+        journal.record(entry.job_id, entry.source, "job", "abandoned")
+    if pending:
+        log(f"{len(pending)} travail(aux) interrompu(s) abandonné(s), relancer avec --resume pour les reprendre", "WARN")
+    journal.compact()
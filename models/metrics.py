@@ -0,0 +1,393 @@
+"""Resource accounting: timing spans around each job stage and /proc sampling of every ffmpeg child."""
+
+import asyncio
+import contextlib
+from dataclasses import asdict, dataclass, field
+import json
+import os
+import resource
+import threading
+import time
+from utils.log import log_context
+
+# Seconds between two /proc samples of a running child
+SAMPLE_INTERVAL = 0.5
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+@dataclass
+class Usage:
+    """Class representing the resources used by a process, or summed over the processes of a stage.
+
+    read_chars / write_chars count every byte read or written (files, pipes, page cache hits),
+    read_bytes / write_bytes only what actually reached the storage.
+    """
+    wall_time: float = 0.0
+    cpu_user: float = 0.0
+    cpu_system: float = 0.0
+    peak_rss: int = 0
+    read_chars: int = 0
+    write_chars: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+    processes: int = 0
+
+    def add(self, other: "Usage"):
+        """ Accumulate the usage of another process; the peak RSS is the largest of both.
+
+        Args:
+            other (Usage): usage to add
+        """
+        for name in ("cpu_user", "cpu_system", "read_chars", "write_chars", "read_bytes", "write_bytes", "processes"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.peak_rss = max(self.peak_rss, other.peak_rss)
+
+def _read_fields(path: str, separator: str = ":") -> dict[str, str]:
+    with open(path, encoding="ascii", errors="replace") as f:
+        return {key.strip(): value.strip() for key, _, value in (line.partition(separator) for line in f)}
+
+def read_proc(pid: int | str) -> Usage | None:
+    """ Read the cumulative counters of a running process from /proc.
+
+    Args:
+        pid (int | str): process id, or "thread-self" / "self"
+
+    Returns:
+        Usage | None: CPU times, peak RSS (VmHWM) and I/O counters, None once the process is gone
+    """
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii", errors="replace") as f:
+            # The command name may contain spaces, the fields start after its closing parenthesis
+            stat = f.read().rpartition(")")[2].split()
+        status = _read_fields(f"/proc/{pid}/status")
+        io = _read_fields(f"/proc/{pid}/io")
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    peak = status.get("VmHWM", "0 kB").split()[0]
+    return Usage(
+        cpu_user=int(stat[11]) / _CLOCK_TICKS,
+        cpu_system=int(stat[12]) / _CLOCK_TICKS,
+        peak_rss=int(peak) * 1024 if peak.isdigit() else 0,
+        read_chars=int(io.get("rchar", 0)),
+        write_chars=int(io.get("wchar", 0)),
+        read_bytes=int(io.get("read_bytes", 0)),
+        write_bytes=int(io.get("write_bytes", 0)),
+        processes=1,
+    )
+
+async def sample_child(process: asyncio.subprocess.Process, usage: Usage):
+    """ Keep usage up to date with the counters of a child until it exits.
+
+    The counters vanish when the child is reaped, so the last SAMPLE_INTERVAL of its
+    life is not accounted.
+
+    Args:
+        process (asyncio.subprocess.Process): running child
+        usage (Usage): filled in place
+    """
+    start = time.monotonic()
+    while process.returncode is None:
+        sample = read_proc(process.pid)
+        if sample is not None:
+            peak = max(usage.peak_rss, sample.peak_rss)
+            for name, value in asdict(sample).items():
+                setattr(usage, name, value)
+            usage.peak_rss = peak
+        usage.wall_time = time.monotonic() - start
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+def _thread_usage() -> Usage:
+    """CPU and I/O counters of the calling thread, for the work a stage does in Python."""
+    thread = resource.getrusage(resource.RUSAGE_THREAD)
+    usage = read_proc("thread-self") or Usage()
+    usage.cpu_user, usage.cpu_system = thread.ru_utime, thread.ru_stime
+    usage.peak_rss = 0
+    usage.processes = 0
+    return usage
+
+@dataclass
+class Span:
+    """Class representing one stage of a job: its own thread and the ffmpeg children it ran."""
+    job_id: str
+    stage: str
+    started: float = field(default_factory=time.time)
+    usage: Usage = field(default_factory=Usage)
+    children: list[dict] = field(default_factory=list)
+
+    def add_child(self, label: str, usage: Usage, frames: int = 0):
+        """ Account a finished child to this stage.
+
+        Args:
+            label (str): short description of the child (program and progress label)
+            usage (Usage): its sampled usage
+            frames (int, optional): frames it reported through `-progress`, 0 if unknown
+        """
+        self.usage.add(usage)
+        self.children.append({"label": label, **asdict(usage), "frames": frames})
+
+_local = threading.local()
+
+def current_span() -> Span | None:
+    """Span open in the calling thread, None outside of a stage."""
+    stack = getattr(_local, "spans", None)
+    return stack[-1] if stack else None
+
+@contextlib.contextmanager
+def span(job_id: str, stage: str):
+    """ Measure a stage of a job run in the calling thread, with every ffmpeg child it starts.
+
+    Args:
+        job_id (str): job identifier
+        stage (str): stage name, as in the journal
+
+    Yields:
+        Span: the open span
+    """
+    current = Span(job_id, stage)
+    before = _thread_usage()
+    start = time.monotonic()
+    if not hasattr(_local, "spans"):
+        _local.spans = []
+    stack = _local.spans
+    stack.append(current)
+    try:
+        with log_context(job=job_id, stage=stage):
+            yield current
+    finally:
+        stack.pop()
+        after = _thread_usage()
+        own = Usage(**{name: getattr(after, name) - getattr(before, name) for name in
+                       ("cpu_user", "cpu_system", "read_chars", "write_chars", "read_bytes", "write_bytes")})
+        current.usage.add(own)
+        current.usage.wall_time = time.monotonic() - start
+        get_recorder().add_span(current)
+
+def record_children(results: list, labels: list[str]):
+    """ Account finished runs to the span of the calling thread, if any.
+
+    Args:
+        results (list): RunResult of each child
+        labels (list[str]): label of each child
+    """
+    current = current_span()
+    if current is None:
+        return
+    for label, result in zip(labels, results):
+        if result.usage is not None:
+            # The sampled wall time stops up to SAMPLE_INTERVAL early, the run measured its own
+            result.usage.wall_time = result.wall_time
+            frames = result.last_progress.frame if result.last_progress is not None else 0
+            current.add_child(label, result.usage, frames)
+
+@dataclass
+class JobMetrics:
+    """Class representing the resource report of one job."""
+    job_id: str
+    source: str = ""
+    mode: str = ""
+    outcome: str = ""
+    started: float = field(default_factory=time.time)
+    finished: float = 0.0
+    input_bytes: int = 0
+    output_bytes: int = 0
+    stages: list[Span] = field(default_factory=list)
+
+    @property
+    def total(self) -> Usage:
+        """Usage summed over every stage, wall time included."""
+        total = Usage()
+        for stage in self.stages:
+            total.add(stage.usage)
+            total.wall_time += stage.usage.wall_time
+        return total
+
+    @property
+    def compression_ratio(self) -> float:
+        """Source size divided by output size, 0 without output."""
+        return self.input_bytes / self.output_bytes if self.output_bytes else 0.0
+
+    @property
+    def read_amplification(self) -> float:
+        """Bytes read by all the stages (files and pipes) per byte of source."""
+        return self.total.read_chars / self.input_bytes if self.input_bytes else 0.0
+
+    @property
+    def storage_read_amplification(self) -> float:
+        """Bytes read from the storage by all the stages per byte of source."""
+        return self.total.read_bytes / self.input_bytes if self.input_bytes else 0.0
+
+    def as_dict(self) -> dict:
+        """Serializable report, stage by stage."""
+        return {
+            "job_id": self.job_id,
+            "source": self.source,
+            "mode": self.mode,
+            "outcome": self.outcome,
+            "started": self.started,
+            "finished": self.finished,
+            "input_bytes": self.input_bytes,
+            "output_bytes": self.output_bytes,
+            "compression_ratio": self.compression_ratio,
+            "read_amplification": self.read_amplification,
+            "storage_read_amplification": self.storage_read_amplification,
+            "total": asdict(self.total),
+            "stages": [asdict(stage) for stage in self.stages],
+        }
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class MetricsRecorder:
+    """Collect the spans of every job, write a JSON report per job and a Prometheus textfile.
+
+    The textfile holds counters cumulated since the process started, rewritten after
+    each job for the node_exporter textfile collector.
+    """
+
+    def __init__(self, report_dir: str | None = None, textfile: str | None = None):
+        self.report_dir = report_dir
+        self.textfile = textfile
+        self._lock = threading.Lock()
+        self._jobs: dict[str, JobMetrics] = {}
+        self._outcomes: dict[str, int] = {}
+        self._stages: dict[str, Usage] = {}
+        self._input_bytes = 0
+        self._output_bytes = 0
+        self._last: JobMetrics | None = None
+        if report_dir:
+            os.makedirs(report_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        """True if reports are written somewhere."""
+        return bool(self.report_dir or self.textfile)
+
+    def begin(self, job_id: str, source: str, mode: str = ""):
+        """ Start or continue the report of a job.
+
+        Args:
+            job_id (str): job identifier
+            source (str): source file
+            mode (str, optional): pipeline used, e.g. "three_pass"
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            job = self._jobs.setdefault(job_id, JobMetrics(job_id))
+            job.source, job.mode = source, mode or job.mode
+            with contextlib.suppress(OSError):
+                job.input_bytes = os.path.getsize(source)
+
+    def add_span(self, finished: Span):
+        """ Attach a closed span to its job.
+
+        Args:
+            finished (Span): span closed by span()
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._jobs.setdefault(finished.job_id, JobMetrics(finished.job_id)).stages.append(finished)
+
+    def finish(self, job_id: str, outcome: str, output: str | None = None) -> JobMetrics | None:
+        """ Close the report of a job and write the reports.
+
+        Args:
+            job_id (str): job identifier
+            outcome (str): "done", "failed" or "interrupted"
+            output (str | None, optional): final file, for the output size and compression ratio
+
+        Returns:
+            JobMetrics | None: the closed report, None if nothing was recorded
+        """
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is None or not self.enabled:
+                return None
+            job.outcome, job.finished = outcome, time.time()
+            if output:
+                with contextlib.suppress(OSError):
+                    job.output_bytes = os.path.getsize(output)
+            self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+            for stage in job.stages:
+                total = self._stages.setdefault(stage.stage, Usage())
+                total.add(stage.usage)
+                total.wall_time += stage.usage.wall_time
+            if job.output_bytes:
+                self._input_bytes += job.input_bytes
+                self._output_bytes += job.output_bytes
+                self._last = job
+            if self.report_dir:
+                self._write(os.path.join(self.report_dir, f"{job_id}.json"),
+                            json.dumps(job.as_dict(), ensure_ascii=False, indent=2))
+            if self.textfile:
+                self._write(self.textfile, self.prometheus())
+        return job
+
+    def prometheus(self) -> str:
+        """Cumulated counters in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: list[tuple[dict, float]]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                rendered = ",".join(f'{key}="{_label(str(v))}"' for key, v in labels.items())
+                lines.append(f"{name}{{{rendered}}} {value}" if rendered else f"{name} {value}")
+
+        stages = sorted(self._stages.items())
+        metric("transcode_jobs_total", "counter", "Jobs finished, by outcome.",
+               [({"outcome": k}, v) for k, v in sorted(self._outcomes.items())])
+        metric("transcode_stage_seconds_total", "counter", "Wall time spent in each stage.",
+               [({"stage": s}, u.wall_time) for s, u in stages])
+        metric("transcode_stage_cpu_seconds_total", "counter", "CPU time of each stage and its children.",
+               [({"stage": s, "mode": mode}, getattr(u, f"cpu_{mode}")) for s, u in stages
+                for mode in ("user", "system")])
+        metric("transcode_stage_read_bytes_total", "counter", "Bytes read by each stage (files and pipes).",
+               [({"stage": s}, u.read_chars) for s, u in stages])
+        metric("transcode_stage_written_bytes_total", "counter", "Bytes written by each stage (files and pipes).",
+               [({"stage": s}, u.write_chars) for s, u in stages])
+        metric("transcode_stage_storage_read_bytes_total", "counter", "Bytes each stage read from the storage.",
+               [({"stage": s}, u.read_bytes) for s, u in stages])
+        metric("transcode_stage_storage_written_bytes_total", "counter", "Bytes each stage wrote to the storage.",
+               [({"stage": s}, u.write_bytes) for s, u in stages])
+        metric("transcode_stage_peak_rss_bytes", "gauge", "Largest resident set of a child of each stage.",
+               [({"stage": s}, u.peak_rss) for s, u in stages])
+        metric("transcode_input_bytes_total", "counter", "Size of the sources of the produced files.",
+               [({}, self._input_bytes)])
+        metric("transcode_output_bytes_total", "counter", "Size of the produced files.",
+               [({}, self._output_bytes)])
+        if self._last is not None:
+            metric("transcode_last_compression_ratio", "gauge", "Source size / output size of the last job.",
+                   [({}, self._last.compression_ratio)])
+            metric("transcode_last_read_amplification", "gauge", "Bytes read per source byte by the last job.",
+                   [({}, self._last.read_amplification)])
+            metric("transcode_last_job_timestamp_seconds", "gauge", "End of the last produced file.",
+                   [({}, self._last.finished)])
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write(path: str, content: str):
+        """Write a file aside then rename it, so that readers never see it half written."""
+        temp = f"{path}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(temp, path)
+
+_recorder = MetricsRecorder()
+
+def get_recorder() -> MetricsRecorder:
+    """ Get the process-wide metrics recorder.
+
+    Returns:
+        MetricsRecorder: shared recorder, writing nothing until configured with set_recorder
+    """
+    return _recorder
+
+def set_recorder(recorder: MetricsRecorder):
+    """ Replace the process-wide metrics recorder.
+
+    Args:
+        recorder (MetricsRecorder): recorder writing the reports
+    """
+    global _recorder
+    _recorder = recorder
@@ -0,0 +1,348 @@
+"""Content-addressed manifest of produced outputs, so re-runs skip files already done with the same parameters."""
+
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from models.fileops import checksum, copy_file
+
+# Bump when a pipeline change alters the produced files, to invalidate every entry
+CACHE_VERSION = 1
+FINGERPRINT_BLOCK = 4 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    fingerprint TEXT NOT NULL,
+    params TEXT NOT NULL,
+    source TEXT NOT NULL,
+    output TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    checksum TEXT NOT NULL,
+    artifact TEXT,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    source_checksum TEXT,
+    source_stat TEXT,
+    preset TEXT,
+    PRIMARY KEY (fingerprint, params)
+);
+"""
+# Columns added after the first version of the table, with their type
+ADDED_COLUMNS = {"source_checksum": "TEXT", "source_stat": "TEXT", "preset": "TEXT"}
+COLUMNS = ("fingerprint, params, source, output, size, mtime, checksum, artifact, created_at, last_used,"
+           " source_checksum, source_stat, preset")
+
+@dataclass
+class CacheEntry:
+    """Class representing one produced output recorded in the manifest."""
+    fingerprint: str
+    params: str
+    source: str
+    output: str
+    size: int
+    mtime: float
+    checksum: str
+    artifact: str | None
+    created_at: float
+    last_used: float
+    source_checksum: str | None = None
+    source_stat: str | None = None
+    # Encoder preset imposed by a deadline, not part of params; None or "" for the default one
+    preset: str | None = None
+
+def fingerprint(path: str) -> str:
+    """ Fingerprint a file from its size and its first and last blocks, without reading it all.
+
+    The fingerprint follows the content, not the path: a renamed source still matches.
+    It only finds the candidate entry, which OutputCache.source_matches then checks against
+    the recorded version of the source.
+
+    Args:
+        path (str): path to the file
+
+    Returns:
+        str: hex digest
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=20)
+    with open(path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_BLOCK))
+        if size > 2 * FINGERPRINT_BLOCK:
+            f.seek(-FINGERPRINT_BLOCK, os.SEEK_END)
+            digest.update(f.read(FINGERPRINT_BLOCK))
+    return digest.hexdigest()
+
+def file_stat(path: str) -> str:
+    """ Identity of a file version: device, inode, size and mtime in nanoseconds.
+
+    Args:
+        path (str): path to the file
+
+    Returns:
+        str: "dev:ino:size:mtime_ns"
+    """
+    stat = os.stat(path)
+    return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def params_hash(params: dict) -> str:
+    """ Hash the effective encode parameters.
+
+    Args:
+        params (dict): JSON-serializable parameters
+
+    Returns:
+        str: hex digest
+    """
+    payload = json.dumps({"version": CACHE_VERSION, **params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+class OutputCache:
+    """Class wrapping the SQLite output manifest and the optional size-bounded artifact store.
+
+    Without an artifact directory only the manifest is kept and an entry is valid as long
+    as its output is still in place. With one, outputs are also kept (hard-linked when
+    possible) under their checksum so they can be restored, the least recently used
+    artifacts being evicted above max_bytes. A hard-linked artifact shares its blocks
+    with the delivered output: it only counts in max_bytes once it is the last link.
+    """
+
+    def __init__(self, db_path: str, artifact_dir: str | None = None, max_bytes: int = 0):
+        self.db_path = db_path
+        self.artifact_dir = artifact_dir
+        self.max_bytes = max_bytes
+        if artifact_dir:
+            os.makedirs(artifact_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(outputs)")}
+        for column, kind in ADDED_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE outputs ADD COLUMN {column} {kind}")
+        self._conn.commit()
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def lookup(self, fingerprint_: str, params: str) -> CacheEntry | None:
+        """ Return the manifest entry of a source encoded with given parameters.
+
+        Args:
+            fingerprint_ (str): fingerprint of the source
+            params (str): hash of the encode parameters
+
+        Returns:
+            CacheEntry | None: entry, None if this source was never produced with these parameters
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {COLUMNS} FROM outputs WHERE fingerprint = ? AND params = ?",
+                (fingerprint_, params),
+            ).fetchone()
+        return CacheEntry(*row) if row else None
+
+    def source_matches(self, entry: CacheEntry, source: str) -> bool:
+        """ Check that a source really is the one an entry was produced from.
+
+        The fingerprint only reads the ends of the file, so a same-size edit in the middle
+        would match it. The same file version (device, inode, size, mtime) is trusted. Another
+        version is only accepted when the entry carries a source checksum and the source,
+        hashed in full, still has it; the checksum is never computed at record time, so a
+        touched or copied source is usually encoded again. Entries recorded before the source
+        identity existed adopt the current version of the source.
+
+        Args:
+            entry (CacheEntry): manifest entry found by fingerprint
+            source (str): path of the source file
+
+        Returns:
+            bool: True if the output of the entry can be reused for this source
+        """
+        stat = file_stat(source)
+        if entry.source_stat == stat:
+            return True
+        if entry.source_stat is not None:
+            if not entry.source_checksum or checksum(source) != entry.source_checksum:
+                return False
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outputs SET source_stat = ? WHERE fingerprint = ? AND params = ?",
+                (stat, entry.fingerprint, entry.params),
+            )
+            self._conn.commit()
+        entry.source_stat = stat
+        return True
+
+    def is_recorded(self, output: str) -> bool:
+        """ Check if an output path was produced by any manifest entry.
+
+        Args:
+            output (str): path of the output file
+
+        Returns:
+            bool: True if recorded
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM outputs WHERE output = ? LIMIT 1", (output,)).fetchone()
+        return row is not None
+
+    def is_fresh(self, entry: CacheEntry, destination: str) -> bool:
+        """ Check if the recorded output is still in place and untouched.
+
+        Args:
+            entry (CacheEntry): manifest entry
+            destination (str): where the output is expected
+
+        Returns:
+            bool: True if destination is the recorded output with its recorded size and mtime
+        """
+        if os.path.abspath(destination) != entry.output:
+            return False
+        try:
+            stat = os.stat(destination)
+        except FileNotFoundError:
+            return False
+        return stat.st_size == entry.size and stat.st_mtime == entry.mtime
+
+    def restore(self, entry: CacheEntry, destination: str, source: str | None = None) -> bool:
+        """ Put back an output from the artifact store after checking its checksum.
+
+        Args:
+            entry (CacheEntry): manifest entry
+            destination (str): where to restore the output
+            source (str | None, optional): current path of the source, entry.source if None
+
+        Returns:
+            bool: True if restored
+        """
+        if not entry.artifact or not os.path.isfile(entry.artifact):
+            return False
+        if checksum(entry.artifact) != entry.checksum:
+            os.remove(entry.artifact)
+            self._set_artifact(entry, None)
+            return False
+        temp = f"{destination}.restore"
+        _link_or_copy(entry.artifact, temp)
+        os.replace(temp, destination)
+        self.record(entry.fingerprint, entry.params, source or entry.source, destination, digest=entry.checksum,
+                    source_digest=entry.source_checksum, preset=entry.preset or "")
+        return True
+
+    def touch(self, entry: CacheEntry):
+        """ Mark an entry as just used, for the LRU eviction.
+
+        Args:
+            entry (CacheEntry): manifest entry
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outputs SET last_used = ? WHERE fingerprint = ? AND params = ?",
+                (time.time(), entry.fingerprint, entry.params),
+            )
+            self._conn.commit()
+
+    def record(self, fingerprint_: str, params: str, source: str, output: str, digest: str | None = None,
+               source_digest: str | None = None, preset: str = "") -> CacheEntry:
+        """ Record a produced output, keep it in the artifact store and evict old artifacts.
+
+        Only the version of the source is recorded, not its checksum: hashing it would read
+        the whole source once more after every job, see source_matches.
+
+        Args:
+            fingerprint_ (str): fingerprint of the source
+            params (str): hash of the encode parameters
+            source (str): path of the source file
+            output (str): path of the delivered output
+            digest (str | None, optional): checksum of output if already known
+            source_digest (str | None, optional): checksum of source, kept when already known
+            preset (str, optional): encoder preset chosen by a deadline, "" for the default one
+
+        Returns:
+            CacheEntry: the new entry
+        """
+        output = os.path.abspath(output)
+        stat = os.stat(output)
+        digest = digest or checksum(output)
+        source_stat = file_stat(source)
+        artifact = None
+        if self.artifact_dir:
+            artifact = os.path.join(self.artifact_dir, f"{digest}.mp4")
+            if not os.path.exists(artifact):
+                _link_or_copy(output, artifact)
+        now = time.time()
+        entry = CacheEntry(fingerprint_, params, os.path.abspath(source), output, stat.st_size, stat.st_mtime,
+                           digest, artifact, now, now, source_digest, source_stat, preset)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO outputs ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry.fingerprint, entry.params, entry.source, entry.output, entry.size, entry.mtime,
+                 entry.checksum, entry.artifact, entry.created_at, entry.last_used,
+                 entry.source_checksum, entry.source_stat, entry.preset),
+            )
+            self._conn.commit()
+        if artifact:
+            self.evict()
+        return entry
+
+    def evict(self) -> int:
+        """ Delete the least recently used artifacts until the store fits in max_bytes.
+
+        Artifacts still hard-linked to a delivered output take no space of their own: they
+        are neither counted nor deleted.
+
+        Returns:
+            int: number of artifacts deleted
+        """
+        if not self.artifact_dir or self.max_bytes <= 0:
+            return 0
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT artifact, MAX(last_used) FROM outputs WHERE artifact IS NOT NULL"
+                " GROUP BY artifact ORDER BY MAX(last_used)"
+            ).fetchall()
+        stats = {}
+        for artifact, _ in rows:
+            try:
+                stats[artifact] = os.stat(artifact)
+            except FileNotFoundError:
+                continue
+        sizes = {artifact: stat.st_size for artifact, stat in stats.items() if stat.st_nlink == 1}
+        total = sum(sizes.values())
+        evicted = 0
+        for artifact, _ in rows:
+            if total <= self.max_bytes:
+                break
+            if artifact in stats and artifact not in sizes:
+                continue
+            if artifact in sizes:
+                os.remove(artifact)
+                total -= sizes[artifact]
+                evicted += 1
+            with self._lock:
+                self._conn.execute("UPDATE outputs SET artifact = NULL WHERE artifact = ?", (artifact,))
+                self._conn.commit()
+        return evicted
+
+    def _set_artifact(self, entry: CacheEntry, artifact: str | None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outputs SET artifact = ? WHERE fingerprint = ? AND params = ?",
+                (artifact, entry.fingerprint, entry.params),
+            )
+            self._conn.commit()
+
+def _link_or_copy(src: str, dest: str):
+    """Hard-link src to dest, copying when both are not on the same filesystem."""
+    try:
+        os.link(src, dest)
+    except OSError:
+        copy_file(src, dest)
+        shutil.copystat(src, dest)
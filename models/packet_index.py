@@ -0,0 +1,332 @@
+"""Per-file packet index (pts, size, keyframe flag of every packet) stored as a memory-mapped binary file."""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from dataclasses import dataclass
+import hashlib
+import math
+import mmap
+import os
+import struct
+import subprocess
+import tempfile
+from models.probe import ProbeError, cache_key
+
+MAGIC = b"PIDX\x01\x00\x00\x00"
+# Window of the peak bitrate, in seconds
+PEAK_WINDOW = 1.0
+# Packets kept in memory per stream before being appended to the spool files
+FLUSH_EVERY = 65536
+KINDS = ("video", "audio", "subtitle", "data", "attachment")
+
+# Native byte order: the index is a local cache, read back by the machine that wrote it
+_HEADER = struct.Struct("=8sI4x")
+_STREAM = struct.Struct("=IIQQQdddQQQQ")
+
+_index_dir: str | None = None
+
+@dataclass
+class StreamPackets:
+    """Class representing the summary of one stream of the index, and where its arrays are."""
+    index: int
+    kind: str
+    count: int
+    keyframe_count: int
+    total_bytes: int
+    first_ts: float
+    last_ts: float
+    peak_bps: float
+    pts_offset: int = 0
+    size_offset: int = 0
+    flags_offset: int = 0
+    key_offset: int = 0
+
+    @property
+    def duration(self) -> float:
+        """Seconds between the first and last timestamped packets."""
+        return max(0.0, self.last_ts - self.first_ts)
+
+    @property
+    def avg_bps(self) -> int:
+        """Average bitrate of the stream alone, in bits per second."""
+        return int(self.total_bytes * 8 / self.duration) if self.duration else 0
+
+def set_index_dir(directory: str):
+    """ Set the folder holding the packet indexes, usually next to the catalog.
+
+    Args:
+        directory (str): folder, created if needed
+    """
+    global _index_dir
+    os.makedirs(directory, exist_ok=True)
+    _index_dir = directory
+
+def get_index_dir() -> str:
+    """ Get the folder holding the packet indexes.
+
+    Returns:
+        str: configured folder, or a folder in the system temp directory
+    """
+    if _index_dir is None:
+        set_index_dir(os.path.join(tempfile.gettempdir(), "packet_index"))
+    return _index_dir
+
+def index_path(video_path: str, directory: str | None = None) -> str:
+    """ Path of the index of this exact version of a file.
+
+    Args:
+        video_path (str): path to the video file
+        directory (str | None, optional): index folder, get_index_dir() if None
+
+    Returns:
+        str: path of the .pidx file
+    """
+    key = "|".join(str(part) for part in cache_key(video_path))
+    name = hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + ".pidx"
+    return os.path.join(directory or get_index_dir(), name)
+
+class _Spool:
+    """Packets of one stream being collected, appended to temp files every FLUSH_EVERY packets."""
+
+    def __init__(self, index: int, kind: str, directory: str):
+        self.stats = StreamPackets(index, kind, 0, 0, 0, math.inf, -math.inf, 0.0)
+        self.files = {name: tempfile.TemporaryFile(dir=directory) for name in ("pts", "size", "flags", "key")}
+        self.arrays = {"pts": array("d"), "size": array("I"), "flags": array("B"), "key": array("d")}
+        self.window: deque[tuple[float, int]] = deque()
+        self.window_bytes = 0
+        # Keyframes of video streams only: every audio packet is flagged K and would be listed
+        self.keyframes = kind == "video"
+        self.keys_sorted = True
+        self.last_key = -math.inf
+
+    def add(self, pts: float, dts: float, size: int, keyframe: bool):
+        stats = self.stats
+        stats.count += 1
+        stats.total_bytes += size
+        self.arrays["pts"].append(pts)
+        self.arrays["size"].append(size)
+        self.arrays["flags"].append(1 if keyframe else 0)
+        if not math.isnan(pts):
+            stats.first_ts = min(stats.first_ts, pts)
+            stats.last_ts = max(stats.last_ts, pts)
+            if keyframe and self.keyframes:
+                stats.keyframe_count += 1
+                self.arrays["key"].append(pts)
+                self.keys_sorted = self.keys_sorted and pts >= self.last_key
+                self.last_key = pts
+        # Decode order timestamps only grow, which the sliding window needs
+        ts = dts if not math.isnan(dts) else pts
+        if not math.isnan(ts):
+            self.window.append((ts, size))
+            self.window_bytes += size
+            while self.window and ts - self.window[0][0] >= PEAK_WINDOW:
+                self.window_bytes -= self.window.popleft()[1]
+            stats.peak_bps = max(stats.peak_bps, self.window_bytes * 8 / PEAK_WINDOW)
+        if len(self.arrays["pts"]) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        for name, values in self.arrays.items():
+            values.tofile(self.files[name])
+            del values[:]
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+def _number(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
+
+def build_index(video_path: str, output: str):
+    """ Demux a file once with ffprobe and write its packet index, streaming all the way.
+
+    Keyframe timestamps are kept for the video streams only.
+
+    Args:
+        video_path (str): path to the video file
+        output (str): path of the index to write
+
+    Raises:
+        ProbeError: if ffprobe fails
+    """
+    directory = os.path.dirname(output)
+    command = [
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "packet=codec_type,stream_index,pts_time,dts_time,size,flags",
+        "-of", "compact=p=0",
+        video_path
+    ]
+    spools: dict[int, _Spool] = {}
+    # Errors go to a file: a full stderr pipe would block ffprobe while stdout is being read
+    errors = tempfile.TemporaryFile(dir=directory)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors,
+                               text=True, encoding="utf-8", errors="replace", bufsize=1024 * 1024)
+    try:
+        for line in process.stdout:
+            fields = dict(part.partition("=")[::2] for part in line.rstrip("\n").split("|"))
+            try:
+                stream_index = int(fields["stream_index"])
+            except (KeyError, ValueError):
+                continue
+            spool = spools.get(stream_index)
+            if spool is None:
+                spool = spools[stream_index] = _Spool(stream_index, fields.get("codec_type", "data"), directory)
+            spool.add(_number(fields.get("pts_time", "")), _number(fields.get("dts_time", "")),
+                      int(fields.get("size") or 0), "K" in fields.get("flags", ""))
+        if process.wait() != 0:
+            # The last lines of a noisy run are enough for the report
+            errors.seek(max(0, errors.seek(0, os.SEEK_END) - 4096))
+            stderr = errors.read().decode("utf-8", errors="replace").strip().splitlines()
+            raise ProbeError(f"ffprobe a échoué sur {video_path} : {stderr[-1] if stderr else ''}")
+        _write_index(output, [spools[i] for i in sorted(spools)])
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        errors.close()
+        for spool in spools.values():
+            spool.close()
+
+def _write_index(output: str, spools: list[_Spool]):
+    """Assemble the spooled arrays into the final file, written aside then renamed."""
+    offset = _HEADER.size + _STREAM.size * len(spools)
+    for spool in spools:
+        spool.flush()
+        stats = spool.stats
+        if stats.first_ts == math.inf:
+            stats.first_ts = stats.last_ts = 0.0
+        for name in ("pts", "size", "flags", "key"):
+            offset += -offset % 8
+            setattr(stats, f"{name}_offset", offset)
+            offset += spool.files[name].tell()
+    fd, temp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(output))
+    with os.fdopen(fd, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(spools)))
+        for spool in spools:
+            s = spool.stats
+            f.write(_STREAM.pack(s.index, KINDS.index(s.kind) if s.kind in KINDS else len(KINDS), s.count,
+                                 s.keyframe_count, s.total_bytes, s.first_ts, s.last_ts, s.peak_bps,
+                                 s.pts_offset, s.size_offset, s.flags_offset, s.key_offset))
+        for spool in spools:
+            for name in ("pts", "size", "flags", "key"):
+                f.write(b"\0" * (getattr(spool.stats, f"{name}_offset") - f.tell()))
+                source = spool.files[name]
+                source.seek(0)
+                if name == "key" and not spool.keys_sorted:
+                    # Keyframes of a video stream are few; sorted for the bisect lookups
+                    keyframes = array("d")
+                    keyframes.frombytes(source.read())
+                    array("d", sorted(keyframes)).tofile(f)
+                    continue
+                while chunk := source.read(1024 * 1024):
+                    f.write(chunk)
+    os.replace(temp, output)
+
+class PacketIndex:
+    """Read-only view of a packet index; arrays are memoryviews over the mapped file, never copied."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Index de paquets invalide : {path}")
+        self.streams: dict[int, StreamPackets] = {}
+        for i in range(count):
+            values = list(_STREAM.unpack_from(self._mmap, _HEADER.size + i * _STREAM.size))
+            values[1] = KINDS[values[1]] if values[1] < len(KINDS) else "data"
+            stats = StreamPackets(*values)
+            self.streams[stats.index] = stats
+
+    def _array(self, offset: int, count: int, fmt: str) -> memoryview:
+        size = struct.calcsize(fmt)
+        return self._view[offset:offset + count * size].cast(fmt)
+
+    def pts(self, stream_index: int) -> memoryview:
+        """Presentation timestamps in seconds of every packet, in decode order (NaN when unknown)."""
+        s = self.streams[stream_index]
+        return self._array(s.pts_offset, s.count, "d")
+
+    def sizes(self, stream_index: int) -> memoryview:
+        """Size in bytes of every packet, in decode order."""
+        s = self.streams[stream_index]
+        return self._array(s.size_offset, s.count, "I")
+
+    def flags(self, stream_index: int) -> memoryview:
+        """1 for keyframe packets, 0 otherwise, in decode order."""
+        s = self.streams[stream_index]
+        return self._array(s.flags_offset, s.count, "B")
+
+    def keyframes(self, stream_index: int) -> memoryview:
+        """Keyframe timestamps in seconds, sorted; empty for a stream other than video."""
+        s = self.streams[stream_index]
+        return self._array(s.key_offset, s.keyframe_count, "d")
+
+    def keyframe_before(self, stream_index: int, time: float) -> float | None:
+        """ Last keyframe at or before a time, in O(log n).
+
+        Args:
+            stream_index (int): absolute index of the stream
+            time (float): time in seconds
+
+        Returns:
+            float | None: keyframe timestamp, None if the first keyframe is later
+        """
+        keyframes = self.keyframes(stream_index)
+        i = bisect_right(keyframes, time)
+        return keyframes[i - 1] if i else None
+
+    def keyframe_after(self, stream_index: int, time: float) -> float | None:
+        """ First keyframe at or after a time, in O(log n).
+
+        Args:
+            stream_index (int): absolute index of the stream
+            time (float): time in seconds
+
+        Returns:
+            float | None: keyframe timestamp, None if the last keyframe is earlier
+        """
+        keyframes = self.keyframes(stream_index)
+        i = bisect_left(keyframes, time)
+        return keyframes[i] if i < len(keyframes) else None
+
+    def gop(self, stream_index: int) -> tuple[float, float]:
+        """ GOP structure of a stream from the distance between its keyframes.
+
+        Args:
+            stream_index (int): absolute index of the stream
+
+        Returns:
+            tuple[float, float]: mean and longest GOP in seconds, (0, 0) without two keyframes
+        """
+        keyframes = self.keyframes(stream_index)
+        if len(keyframes) < 2:
+            return 0.0, 0.0
+        longest = max(keyframes[i + 1] - keyframes[i] for i in range(len(keyframes) - 1))
+        return (keyframes[-1] - keyframes[0]) / (len(keyframes) - 1), longest
+
+def open_index(video_path: str, directory: str | None = None) -> PacketIndex:
+    """ Open the packet index of a file, building it on first use.
+
+    Args:
+        video_path (str): path to the video file
+        directory (str | None, optional): index folder, get_index_dir() if None
+
+    Raises:
+        ProbeError: if the index has to be built and ffprobe fails
+
+    Returns:
+        PacketIndex: index of this exact version of the file
+    """
+    path = index_path(video_path, directory)
+    if not os.path.isfile(path):
+        # Concurrent builds of the same file each write their own temp file, the last rename wins
+        build_index(video_path, path)
+    return PacketIndex(path)
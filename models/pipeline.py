@@ -0,0 +1,128 @@
+"""Single-pass pipeline: remux, AAC audio and AV1 video in one ffmpeg invocation."""
+
+import os
+from models.convert_to_mp4 import subtitle_args
+from models.encoders import EncoderBackend, encode_with_fallback
+from models.probe import probe
+from models.quality import QualityTarget, tune_info
+from models.runner import report_failure
+from models.throughput import Pacing
+from models.transcode_audio import audio_args, get_audio_info
+from models.transcode_av1 import get_info
+from utils import MediaInfo, TranscodeData
+
+def single_pass_stream_args(output_path, log, media: MediaInfo) -> list[str]:
+    """ Build the audio, subtitle and container part of the single pass command.
+
+    Subtitles are filtered and converted to mov_text like in convert_to_mp4 and audio
+    tracks are filtered and encoded like in transcode_audio, following the track policy.
+    Built once per file, so that the track decisions are logged once and not again for
+    every backend tried.
+
+    Args:
+        output_path (str): path of the MP4 file to produce
+        log (function): logging function
+        media (MediaInfo): probe of the source
+
+    Returns:
+        list[str]: ffmpeg arguments following the video encoder arguments
+    """
+    command = audio_args(get_audio_info(media, log))
+    log(f"{len(media.subtitles)} piste(s) de sous-titres détectée(s)")
+    command += subtitle_args(media.subtitles, log)
+    command += [
+        "-c:s", "mov_text",
+        "-map_metadata", "0",
+        "-map_chapters", "0",
+        "-movflags", "+faststart",
+        "-loglevel","info",
+        output_path
+    ]
+    return command
+
+def build_single_pass_command(video_path, backend: EncoderBackend, info: TranscodeData,
+                              media: MediaInfo, stream_args: list[str]) -> list[str]:
+    """ Build the ffmpeg command doing the three stages at once from the source probe.
+
+    The video is encoded with the parameters of pick_params_from_source like in transcode_video.
+
+    Args:
+        video_path (str): path to the source video file
+        backend (EncoderBackend): AV1 encoder backend
+        info (TranscodeData): transcoding data of the source
+        media (MediaInfo): probe of video_path
+        stream_args (list[str]): result of single_pass_stream_args
+
+    Raises:
+        RuntimeError: if the source has no video track
+
+    Returns:
+        list[str]: ffmpeg command
+    """
+    video_track = media.video_track
+    if video_track is None:
+        raise RuntimeError("Aucune piste vidéo trouvée")
+    return [
+        "ffmpeg",
+        *backend.input_args(),
+        "-i", video_path,
+        "-map", f"0:{video_track.index}",
+        *backend.video_args(info),
+        *stream_args,
+    ]
+
+def transcode_single_pass(video_path, temp_path, log, media: MediaInfo | None = None,
+                          encoders: list[str] | None = None, quality: QualityTarget | None = None,
+                          pacing: Pacing | None = None):
+    """ Produce the final AV1/AAC MP4 from the source in a single read and a single write.
+
+    Args:
+        video_path (str): path to the source video file
+        temp_path (str): temporary directory receiving the output
+        log (function): logging function
+        media (MediaInfo, optional): probe of video_path, probed here if not given
+        encoders (list[str] | None, optional): AV1 encoders in order of preference, see available_backends
+        quality (QualityTarget | None, optional): target-quality CQ search, None to keep the default CQ
+        pacing (Pacing | None, optional): preset choice and throughput recording of the job
+
+    Raises:
+        FileNotFoundError: _if the video file does not exist
+        NotADirectoryError: _if the temporary path does not exist
+
+    Returns:
+        dict: {"success": bool, "output": str, "file_name": str}, same shape as convert_to_mp4
+    """
+    if not os.path.isfile(video_path):
+        raise FileNotFoundError(f"Fichier vidéo non trouvé : {video_path}")
+    if not os.path.isdir(temp_path):
+        raise NotADirectoryError(f"Dossier temporaire non trouvé : {temp_path}")
+
+    file_name = os.path.basename(video_path).rsplit('.', 1)[0] + ".mp4"
+    output = os.path.join(temp_path, file_name)
+    media = media or probe(video_path)
+    info: TranscodeData = TranscodeData(**get_info(video_path, media))
+    stream_args = single_pass_stream_args(output, log, media)
+
+    run = encode_with_fallback(
+        lambda backend: build_single_pass_command(
+            video_path, backend, tune_info(video_path, temp_path, log, media, info, backend, quality, pacing),
+            media, stream_args),
+        file_name, media.duration, log, preferred=encoders, output_path=output,
+        on_success=pacing.record if pacing is not None else None,
+    )
+    if run is not None and run.success:
+        log("✅ Transcodage en une passe ok", "OK")
+        return {
+            "success": True,
+            "output": output,
+            "file_name": file_name
+        }
+    if run is not None:
+        report_failure(run, "le transcodage en une passe", log)
+    if os.path.exists(output):
+        os.remove(output)
+    return {
+        "success": False,
+        "output": "",
+        "file_name": ""
+    }
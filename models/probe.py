@@ -0,0 +1,91 @@
+"""Probe a media file once with ffprobe and share the result between every stage."""
+
+from collections import OrderedDict
+import json
+import os
+import subprocess
+import threading
+from utils import MediaInfo
+
+_CACHE_SIZE = 512
+_cache: "OrderedDict[tuple, MediaInfo]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+class ProbeError(RuntimeError):
+    """Raised when ffprobe cannot read a file."""
+
+def cache_key(video_path: str) -> tuple:
+    """ Build the memoization key of a file: (absolute path, size, mtime).
+
+    Args:
+        video_path (str): path to the video file
+
+    Returns:
+        tuple: key identifying this exact version of the file
+    """
+    stat = os.stat(video_path)
+    return (os.path.abspath(video_path), stat.st_size, stat.st_mtime)
+
+def run_ffprobe(video_path: str) -> dict:
+    """ Run a single ffprobe call returning streams, format and chapters.
+
+    Args:
+        video_path (str): path to the video file
+
+    Raises:
+        ProbeError: if ffprobe fails or returns invalid output
+
+    Returns:
+        dict: parsed JSON output of ffprobe
+    """
+    command = [
+        "ffprobe",
+        "-v", "error",
+        "-show_streams",
+        "-show_format",
+        "-show_chapters",
+        "-of", "json",
+        video_path
+    ]
+    try:
+        res = subprocess.run(command, capture_output=True, text=True, check=True, encoding="utf-8", errors="replace")
+        return json.loads(res.stdout)
+    except subprocess.CalledProcessError as e:
+        raise ProbeError(f"ffprobe a échoué sur {video_path} : {e.stderr.strip()}") from e
+    except json.JSONDecodeError as e:
+        raise ProbeError(f"Sortie ffprobe invalide pour {video_path}") from e
+
+def probe(video_path: str, catalog=None) -> MediaInfo:
+    """ Probe a media file, memoized per (path, size, mtime).
+
+    Args:
+        video_path (str): path to the video file
+        catalog (Catalog, optional): persistent catalog read before, and filled after, ffprobe
+
+    Raises:
+        FileNotFoundError: if the video file does not exist
+        ProbeError: if ffprobe cannot read the file
+
+    Returns:
+        MediaInfo: typed description of the file
+    """
+    if not os.path.isfile(video_path):
+        raise FileNotFoundError(f"Fichier vidéo non trouvé : {video_path}")
+
+    key = cache_key(video_path)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    info = catalog.lookup(*key) if catalog is not None else None
+    if info is None:
+        info = MediaInfo.from_probe(key[0], key[1], key[2], run_ffprobe(video_path))
+        if catalog is not None:
+            catalog.store(info)
+
+    with _cache_lock:
+        _cache[key] = info
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return info
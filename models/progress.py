@@ -0,0 +1,260 @@
+"""Typed ffmpeg `-progress` events and a throttled dashboard covering every running job."""
+
+from dataclasses import asdict, dataclass, field
+import json
+import os
+import sys
+import threading
+import time
+from utils.log import log, set_console_writer
+
+@dataclass
+class ProgressEvent:
+    """Class representing one block of ffmpeg `-progress` key=value output."""
+    out_time: float = 0.0
+    frame: int = 0
+    fps: float = 0.0
+    speed: float = 0.0
+    total_size: int = 0
+    bitrate: float = 0.0
+    done: bool = False
+
+def _to_float(value: str | None, suffix: str = "") -> float:
+    if not value or value == "N/A":
+        return 0.0
+    try:
+        return float(value.strip().removesuffix(suffix))
+    except ValueError:
+        return 0.0
+
+def _parse_out_time(values: dict) -> float:
+    if values.get("out_time_us", "N/A") != "N/A":
+        return _to_float(values["out_time_us"]) / 1_000_000
+    out_time = values.get("out_time", "")
+    try:
+        hours, minutes, seconds = out_time.split(":")
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return 0.0
+
+class ProgressParser:
+    """Accumulate ffmpeg `-progress` lines and emit a ProgressEvent at the end of each block.
+
+    Values persist across blocks, so a short final block still reports the last known stats.
+    """
+
+    def __init__(self):
+        self._values: dict[str, str] = {}
+
+    def feed(self, line: str) -> ProgressEvent | None:
+        """ Feed one line of `-progress` output.
+
+        Args:
+            line (str): "key=value" line
+
+        Returns:
+            ProgressEvent | None: the event once a block is complete ("progress=..."), None otherwise
+        """
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+        self._values[key] = value
+        if key != "progress":
+            return None
+        values = self._values
+        return ProgressEvent(
+            out_time=_parse_out_time(values),
+            frame=int(_to_float(values.get("frame"))),
+            fps=_to_float(values.get("fps")),
+            speed=_to_float(values.get("speed"), "x"),
+            total_size=int(_to_float(values.get("total_size"))),
+            bitrate=_to_float(values.get("bitrate"), "kbits/s"),
+            done=value == "end",
+        )
+
+@dataclass
+class JobProgress:
+    """Class representing the live state of one running ffmpeg job."""
+    label: str
+    duration: float
+    started: float = field(default_factory=time.monotonic)
+    last: ProgressEvent = field(default_factory=ProgressEvent)
+
+    @property
+    def percent(self) -> float:
+        """Completion in percent, 0 when the duration is unknown."""
+        if self.duration <= 0:
+            return 0.0
+        return min(100.0, 100.0 * self.last.out_time / self.duration)
+
+    @property
+    def eta(self) -> float | None:
+        """Estimated seconds left, from the encode speed, None when it cannot be estimated."""
+        if self.duration <= 0 or self.last.out_time <= 0:
+            return None
+        speed = self.last.speed or self.last.out_time / max(time.monotonic() - self.started, 1e-6)
+        if speed <= 0:
+            return None
+        return max(0.0, (self.duration - self.last.out_time) / speed)
+
+    def as_dict(self) -> dict:
+        """Serializable view of the job for the status file."""
+        return {
+            "label": self.label,
+            "duration": self.duration,
+            "elapsed": round(time.monotonic() - self.started, 1),
+            "percent": round(self.percent, 1),
+            "eta": None if self.eta is None else round(self.eta),
+            **asdict(self.last),
+        }
+
+def format_duration(seconds: float | None) -> str:
+    """ Format seconds as H:MM:SS.
+
+    Args:
+        seconds (float | None): number of seconds
+
+    Returns:
+        str: formatted duration, "--:--" if unknown
+    """
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+class ProgressBoard:
+    """Single live view of every running job, rendered at most once per interval.
+
+    The board is redrawn in place when the terminal is a TTY and, if configured, written
+    to a JSON status file. Every event is also logged as a PROGRESS record, which the
+    log rate-limits per job; off a TTY those records are the console output. The console
+    log lines go through print_line, which prints them above the board under its lock.
+    """
+
+    def __init__(self, interval: float = 5.0, status_file: str | None = None, stream=None):
+        self.interval = interval
+        self.status_file = status_file
+        self.stream = stream or sys.stdout
+        self._jobs: dict[str, JobProgress] = {}
+        self._lock = threading.Lock()
+        self._last_render = 0.0
+        self._drawn_lines = 0
+
+    def configure(self, interval: float | None = None, status_file: str | None = None):
+        """ Change the render interval and/or the status file.
+
+        Args:
+            interval (float | None, optional): minimum seconds between two renders
+            status_file (str | None, optional): path of the JSON status file
+        """
+        if interval is not None:
+            self.interval = interval
+        if status_file is not None:
+            self.status_file = status_file
+
+    def start(self, job_id: str, label: str, duration: float):
+        """ Register a new running job.
+
+        Args:
+            job_id (str): unique job identifier
+            label (str): text shown for the job
+            duration (float): media duration in seconds, used for percent and ETA
+        """
+        with self._lock:
+            self._jobs[job_id] = JobProgress(label=label, duration=duration or 0.0)
+
+    def update(self, job_id: str, event: ProgressEvent):
+        """ Record a progress event, rendering the board if the interval has elapsed.
+
+        Args:
+            job_id (str): job identifier given to start
+            event (ProgressEvent): parsed progress block
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.last = event
+            log(self._line(job), "PROGRESS", key=job_id, **job.as_dict())
+            if time.monotonic() - self._last_render < self.interval:
+                return
+            self._render()
+
+    def finish(self, job_id: str):
+        """ Remove a job from the board.
+
+        Args:
+            job_id (str): job identifier given to start
+        """
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._write_status()
+
+    def snapshot(self) -> list[dict]:
+        """Serializable view of all running jobs."""
+        with self._lock:
+            return [job.as_dict() for job in self._jobs.values()]
+
+    def print_line(self, stream, line: str):
+        """ Print a log line; on the terminal of the board, above it, then redraw the board below.
+
+        Args:
+            stream: console stream of the log
+            line (str): formatted log line
+        """
+        with self._lock:
+            if not self._drawn_lines or not _same_terminal(stream, self.stream):
+                stream.write(line + "\n")
+                stream.flush()
+                return
+            self.stream.flush()
+            self.stream.write(f"\033[{self._drawn_lines}F\033[J{line}\n")
+            self._draw()
+
+    @staticmethod
+    def _line(job: JobProgress) -> str:
+        return (f"{job.label[:48]:<48} {job.percent:5.1f}% {job.last.fps:6.1f} fps "
+                f"x{job.last.speed:<5.2f} {job.last.total_size / 1_048_576:8.1f} Mo ETA {format_duration(job.eta)}")
+
+    def _render(self):
+        self._last_render = time.monotonic()
+        if self.stream.isatty():
+            if self._drawn_lines:
+                self.stream.write(f"\033[{self._drawn_lines}F\033[J")
+            self._draw()
+        self._write_status()
+
+    def _draw(self):
+        lines = [self._line(job) for job in self._jobs.values()]
+        self.stream.write("\n".join(lines) + ("\n" if lines else ""))
+        self._drawn_lines = len(lines)
+        self.stream.flush()
+
+    def _write_status(self):
+        if not self.status_file:
+            return
+        temp = f"{self.status_file}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump({"updated": time.time(), "jobs": [j.as_dict() for j in self._jobs.values()]},
+                      f, ensure_ascii=False, indent=2)
+        os.replace(temp, self.status_file)
+
+def _same_terminal(a, b) -> bool:
+    """True if both streams are the same terminal, e.g. stdout and stderr of an interactive shell."""
+    if a is b:
+        return True
+    try:
+        return a.isatty() and b.isatty() and os.fstat(a.fileno()).st_rdev == os.fstat(b.fileno()).st_rdev
+    except (AttributeError, OSError, ValueError):
+        return False
+
+_board = ProgressBoard()
+set_console_writer(_board.print_line)
+
+def get_board() -> ProgressBoard:
+    """ Get the process-wide progress board shared by every stage.
+
+    Returns:
+        ProgressBoard: shared board
+    """
+    return _board
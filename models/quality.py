@@ -0,0 +1,293 @@
+"""Target-quality search: pick the CQ reaching a VMAF (or SSIM) target from a few encoded samples."""
+
+from dataclasses import dataclass, replace
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from models.encoders import EncoderBackend, detect_capabilities
+from models.runner import RunResult, report_failure, run_many
+from models.throughput import Pacing
+from utils import MediaInfo, TranscodeData
+
+DEFAULT_TARGETS = {"vmaf": 93.0, "ssim": 0.98}
+SAMPLE_COUNT = 4
+SAMPLE_SECONDS = 4.0
+CQ_STEP = 4
+
+_VMAF_SCORE = re.compile(r"VMAF score[:=]\s*([\d.]+)")
+_SSIM_SCORE = re.compile(r"SSIM .*All:([\d.]+)")
+
+@dataclass
+class QualityTarget:
+    """Class representing a target-quality search request."""
+    target: float
+    metric: str = "vmaf"
+    samples: int = SAMPLE_COUNT
+    sample_seconds: float = SAMPLE_SECONDS
+    # Catalog caching the sample scores per file, optional
+    catalog: object = None
+
+    @property
+    def sampling(self) -> str:
+        """Description of the samples, part of the cache key."""
+        return f"{self.samples}x{self.sample_seconds}"
+
+def resolve_metric(quality: QualityTarget, log) -> tuple[str, float]:
+    """ Choose the metric actually measured, falling back to SSIM if ffmpeg has no libvmaf.
+
+    Args:
+        quality (QualityTarget): search request
+        log (function): logging function
+
+    Returns:
+        tuple[str, float]: metric ("vmaf" or "ssim") and target score
+    """
+    if quality.metric == "vmaf" and "libvmaf" not in detect_capabilities().filters:
+        target = DEFAULT_TARGETS["ssim"]
+        log(f"libvmaf indisponible, recherche de qualité sur le SSIM (cible {target})", "WARN")
+        return "ssim", target
+    return quality.metric, quality.target
+
+def sample_starts(duration: float, count: int, seconds: float) -> list[float]:
+    """ Spread sample start times evenly over the media, away from the very start and end.
+
+    Args:
+        duration (float): duration of the media in seconds
+        count (int): wanted number of samples
+        seconds (float): length of one sample
+
+    Returns:
+        list[float]: start time of each sample, fewer than count for short media
+    """
+    count = max(1, min(count, int(duration // (2 * seconds))))
+    return [max(0.0, duration * (i + 1) / (count + 1) - seconds / 2) for i in range(count)]
+
+def candidate_cqs(base: int, cq_range: tuple, known: dict[int, float], target: float) -> list[int]:
+    """ Choose the next CQ values to measure around the base CQ.
+
+    Starts with base - CQ_STEP, base and base + CQ_STEP, then widens once on the side
+    where the target was not reached.
+
+    Args:
+        base (int): CQ picked by pick_params_from_source, on the scale of the encoder
+        cq_range (tuple): valid CQ values of the encoder
+        known (dict[int, float]): CQ -> score already measured
+        target (float): target score
+
+    Returns:
+        list[int]: CQ values still to measure, empty when the target is bracketed
+    """
+    low, high = cq_range
+    wanted = [base - CQ_STEP, base, base + CQ_STEP]
+    if all(cq in known for cq in wanted):
+        scores = [known[cq] for cq in wanted]
+        if min(scores) >= target:
+            wanted = [base + 2 * CQ_STEP]
+        elif max(scores) < target:
+            wanted = [base - 2 * CQ_STEP]
+        else:
+            return []
+    return sorted({min(high, max(low, cq)) for cq in wanted} - known.keys())
+
+def interpolate_cq(scores: dict[int, float], target: float, cq_range: tuple) -> int:
+    """ Find the highest CQ whose interpolated score still reaches the target.
+
+    Args:
+        scores (dict[int, float]): CQ -> mean score, the score decreasing as the CQ increases
+        target (float): target score
+        cq_range (tuple): valid CQ values of the encoder
+
+    Returns:
+        int: CQ to encode with
+    """
+    points = sorted(scores.items())
+    if points[0][1] < target:
+        return max(cq_range[0], points[0][0])
+    for (cq_a, score_a), (cq_b, score_b) in zip(points, points[1:]):
+        if score_a >= target > score_b:
+            cq = cq_a + (score_a - target) * (cq_b - cq_a) / (score_a - score_b)
+            return int(cq)
+    return min(cq_range[1], points[-1][0])
+
+def parse_score(result: RunResult, metric: str) -> float | None:
+    """ Read the score printed by the libvmaf or ssim filter.
+
+    Args:
+        result (RunResult): finished measurement run
+        metric (str): "vmaf" or "ssim"
+
+    Returns:
+        float | None: score, None if not found
+    """
+    pattern = _VMAF_SCORE if metric == "vmaf" else _SSIM_SCORE
+    for line in reversed(result.stderr_tail):
+        match = pattern.search(line)
+        if match:
+            return float(match.group(1))
+    return None
+
+def cut_command(video_path: str, stream_index: int, start: float, seconds: float, output: str) -> list[str]:
+    """Stream-copy one sample of the video track, starting on the keyframe before start."""
+    return [
+        "ffmpeg", "-y",
+        "-ss", f"{start:.3f}", "-i", video_path,
+        "-t", f"{seconds:.3f}",
+        "-map", f"0:{stream_index}", "-c", "copy",
+        "-loglevel", "error",
+        "-f", "matroska", output
+    ]
+
+def encode_command(sample: str, backend: EncoderBackend, info: TranscodeData, threads: int | None,
+                   output: str) -> list[str]:
+    """Encode one sample with the encoder arguments of the full encode."""
+    return [
+        "ffmpeg", "-y",
+        *backend.input_args(), "-i", sample,
+        "-map", "0:v:0",
+        *backend.video_args(info, threads=threads),
+        "-loglevel", "error",
+        "-f", "matroska", output
+    ]
+
+def metric_command(distorted: str, reference: str, metric: str, info: TranscodeData, threads: int) -> list[str]:
+    """Compare an encoded sample to its reference with libvmaf or ssim."""
+    pix_fmt = "yuv420p10le" if info.is_hdr else "yuv420p"
+    compare = f"libvmaf=n_threads={threads}" if metric == "vmaf" else "ssim"
+    # The encoded sample is cropped, the reference must be too
+    crop = f"crop={info.crop}," if info.crop else ""
+    graph = (f"[0:v]format={pix_fmt},setpts=PTS-STARTPTS[d];"
+             f"[1:v]{crop}format={pix_fmt},setpts=PTS-STARTPTS[r];"
+             f"[d][r]{compare}")
+    return [
+        "ffmpeg",
+        "-i", distorted, "-i", reference,
+        "-lavfi", graph,
+        "-loglevel", "info",
+        "-f", "null", "-"
+    ]
+
+def encoder_key(backend: EncoderBackend, info: TranscodeData) -> str:
+    """ Identify the encoder settings of the samples apart from the CQ (preset, crop, colors...).
+
+    Args:
+        backend (EncoderBackend): encoder of the samples
+        info (TranscodeData): transcoding data of the full encode
+
+    Returns:
+        str: encoder name and a hash of its arguments, e.g. "libsvtav1:3f2a9c01d4e7"
+    """
+    args = backend.video_args(replace(info, cq="0"))
+    return f"{backend.name}:{hashlib.blake2b(chr(0).join(args).encode(), digest_size=6).hexdigest()}"
+
+def search_cq(video_path, temp_path, log, media: MediaInfo, info: TranscodeData, backend: EncoderBackend,
+              quality: QualityTarget) -> int | None:
+    """ Encode a few samples at several CQ values and interpolate the CQ reaching the target.
+
+    Scores are the mean over the samples; they are cached in the catalog per file,
+    encoder settings (see encoder_key), metric and sampling, so a new search only
+    measures the missing CQ values.
+
+    Args:
+        video_path (str): path to the video file to encode
+        temp_path (str): directory receiving the samples
+        log (function): logging function
+        media (MediaInfo): probe of video_path
+        info (TranscodeData): transcoding data of the source
+        backend (EncoderBackend): encoder of the full encode
+        quality (QualityTarget): search request
+
+    Returns:
+        int | None: CQ to use, None if no sample could be measured
+    """
+    video_track = media.video_track
+    if video_track is None or not media.duration:
+        return None
+    metric, target = resolve_metric(quality, log)
+    key = (media.path, media.size, media.mtime, encoder_key(backend, info), metric, quality.sampling)
+    scores = quality.catalog.quality_scores(*key) if quality.catalog else {}
+    cpus = os.cpu_count() or 4
+    workers = 2 if backend.is_hardware else max(1, cpus // 4)
+    threads = max(1, cpus // workers)
+    file_name = os.path.basename(video_path)
+
+    starts = sample_starts(media.duration, quality.samples, quality.sample_seconds)
+    sample_dir = tempfile.mkdtemp(prefix="quality-", dir=temp_path)
+    samples: list[str] = []
+    tried: set[int] = set()
+    try:
+        while cqs := [cq for cq in candidate_cqs(int(info.cq), backend.cq_range, scores, target) if cq not in tried]:
+            tried.update(cqs)
+            if not samples:
+                samples = [os.path.join(sample_dir, f"sample{i}.mkv") for i in range(len(starts))]
+                cuts = run_many([cut_command(video_path, video_track.index, start, quality.sample_seconds, sample)
+                                 for start, sample in zip(starts, samples)], workers)
+                if not all(result.success for result in cuts):
+                    report_failure(next(r for r in cuts if not r.success), "la découpe des échantillons", log)
+                    break
+            jobs = [(cq, sample, os.path.join(sample_dir, f"cq{cq}-{i}.mkv"))
+                    for cq in cqs for i, sample in enumerate(samples)]
+            encodes = run_many(
+                [encode_command(sample, backend, replace(info, cq=str(cq)), threads, output)
+                 for cq, sample, output in jobs],
+                workers,
+                labels=[f"{file_name} [qualité cq {cq}]" for cq, _, _ in jobs],
+                durations=[quality.sample_seconds] * len(jobs),
+            )
+            measures = run_many(
+                [metric_command(output, sample, metric, info, threads) for _, sample, output in jobs],
+                workers,
+            )
+            measured: dict[int, list[float]] = {}
+            for (cq, _, _), encode, measure in zip(jobs, encodes, measures):
+                score = parse_score(measure, metric) if encode.success and measure.success else None
+                if score is None:
+                    report_failure(measure if encode.success else encode, f"l'échantillon cq {cq}", log)
+                    continue
+                measured.setdefault(cq, []).append(score)
+            new_scores = {cq: sum(values) / len(values) for cq, values in measured.items()}
+            if not new_scores:
+                break
+            scores |= new_scores
+            if quality.catalog:
+                quality.catalog.store_quality_scores(*key, new_scores)
+    finally:
+        shutil.rmtree(sample_dir, ignore_errors=True)
+
+    if not scores:
+        log(f"❌ Recherche de qualité impossible pour {file_name}, CQ par défaut conservé", "ERROR")
+        return None
+    cq = interpolate_cq(scores, target, backend.cq_range)
+    measured_points = ", ".join(f"{c}={s:.3f}" for c, s in sorted(scores.items()))
+    log(f"CQ {cq} retenu pour {metric} {target} avec {backend.name} ({measured_points})")
+    return cq
+
+def tune_info(video_path, temp_path, log, media: MediaInfo, info: TranscodeData, backend: EncoderBackend,
+              quality: QualityTarget | None, pacing: Pacing | None = None) -> TranscodeData:
+    """ Set the CQ of the transcoding data for a backend, from a target-quality search if requested.
+
+    The CQ of pick_params_from_source is on the av1_nvenc scale: it is first mapped to the
+    scale of the backend, so that a fallback encoder produces the same quality level. The
+    preset is chosen next, so that the samples are encoded like the full encode.
+
+    Args:
+        video_path (str): path to the video file to encode
+        temp_path (str): directory receiving the samples
+        log (function): logging function
+        media (MediaInfo): probe of video_path
+        info (TranscodeData): transcoding data of the source
+        backend (EncoderBackend): encoder of the full encode
+        quality (QualityTarget | None): search request, None to keep the CQ of pick_params_from_source
+        pacing (Pacing | None, optional): preset choice of the job, None for the default preset
+
+    Returns:
+        TranscodeData: transcoding data with the chosen preset and the CQ of the backend
+    """
+    info = replace(info, cq=str(backend.scale_cq(int(info.cq))))
+    if pacing is not None:
+        info = pacing.apply(backend, info)
+    if quality is None:
+        return info
+    cq = search_cq(video_path, temp_path, log, media, info, backend, quality)
+    return info if cq is None else replace(info, cq=str(cq))
@@ -0,0 +1,328 @@
+"""Shared asyncio runner supervising ffmpeg children from a single event loop."""
+
+import asyncio
+from collections import deque
+import contextlib
+from dataclasses import dataclass, field
+import os
+import re
+import threading
+import time
+import uuid
+from models.metrics import Usage, record_children, sample_child
+from models.progress import ProgressEvent, ProgressParser, get_board
+
+TAIL_SIZE = 40
+_LINE_SPLIT = re.compile(r"[\r\n]+")
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+# Children currently running, terminated on shutdown; registered under the lock that sets _stopping
+_children: set[asyncio.subprocess.Process] = set()
+_children_lock = threading.Lock()
+_stopping = threading.Event()
+
+@dataclass
+class RunResult:
+    """Class representing the outcome of an ffmpeg child process."""
+    returncode: int
+    wall_time: float
+    last_stats: str = ""
+    stderr_tail: list[str] = field(default_factory=list)
+    last_progress: ProgressEvent | None = None
+    usage: Usage | None = None
+
+    @property
+    def success(self) -> bool:
+        """True if the process exited with code 0."""
+        return self.returncode == 0
+
+    def error_summary(self) -> str:
+        """Last meaningful error line of the process, for one-line reports."""
+        for line in reversed(self.stderr_tail):
+            if line.strip():
+                return line.strip()
+        return ""
+
+def is_stats_line(line: str) -> bool:
+    """ Check if an ffmpeg output line is a periodic statistics line.
+
+    Args:
+        line (str): output line
+
+    Returns:
+        bool: True for "frame=... time=..." / "size=... time=..." lines
+    """
+    return "time=" in line and ("frame=" in line or "size=" in line)
+
+async def _read_lines(stream: asyncio.StreamReader):
+    """Yield decoded lines from a stream, splitting on both \\n and the \\r used by ffmpeg stats."""
+    pending = ""
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        pending += chunk.decode("utf-8", errors="replace")
+        parts = _LINE_SPLIT.split(pending)
+        pending = parts.pop()
+        for part in parts:
+            yield part
+    if pending:
+        yield pending
+
+def child_label(command: list[str], progress: str | None = None) -> str:
+    """Short description of a child for the resource reports: its progress label, or its program."""
+    return progress or os.path.basename(command[0])
+
+def with_progress(command: list[str]) -> list[str]:
+    """ Make ffmpeg write machine-readable progress to stdout instead of stats to stderr.
+
+    Args:
+        command (list[str]): ffmpeg command
+
+    Returns:
+        list[str]: command with `-progress pipe:1 -nostats` as global options
+    """
+    return [command[0], "-progress", "pipe:1", "-nostats", *command[1:]]
+
+async def run_ffmpeg_async(command: list[str], on_line=None, tail_size: int = TAIL_SIZE,
+                           progress: str | None = None, duration: float = 0.0, on_start=None) -> RunResult:
+    """ Run an ffmpeg (or ffprobe) command and collect a structured result.
+
+    Args:
+        command (list[str]): command to run
+        on_line (function, optional): called with every stderr line, must not block
+        tail_size (int, optional): number of non-stats stderr lines kept for error reports
+        progress (str | None, optional): label shown on the progress board; enables `-progress`
+        duration (float, optional): media duration in seconds, used for percent and ETA
+        on_start (function, optional): called with the child process once it is spawned
+
+    Returns:
+        RunResult: exit code, wall time, last stats and stderr tail
+    """
+    start = time.monotonic()
+    if _stopping.is_set():
+        return RunResult(returncode=-1, wall_time=0.0, stderr_tail=["Arrêt en cours, commande non lancée"])
+    if progress is not None:
+        command = with_progress(command)
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE if progress is not None else asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    with _children_lock:
+        _children.add(process)
+        late = _stopping.is_set()
+    if late:
+        # Spawned while terminate_all was running: it may have missed this child
+        with contextlib.suppress(ProcessLookupError):
+            process.kill()
+    if on_start is not None:
+        on_start(process)
+    usage = Usage(processes=1)
+    sampler = asyncio.ensure_future(sample_child(process, usage))
+    tail: deque[str] = deque(maxlen=tail_size)
+    state = {"last_stats": "", "last_progress": None}
+
+    async def _stderr():
+        async for line in _read_lines(process.stderr):
+            if is_stats_line(line):
+                state["last_stats"] = line.strip()
+            else:
+                tail.append(line)
+            if on_line is not None:
+                on_line(line)
+
+    async def _progress(job_id: str):
+        parser = ProgressParser()
+        async for line in _read_lines(process.stdout):
+            event = parser.feed(line)
+            if event is not None:
+                state["last_progress"] = event
+                get_board().update(job_id, event)
+
+    readers = [_stderr()]
+    job_id = uuid.uuid4().hex
+    if progress is not None:
+        get_board().start(job_id, progress, duration)
+        readers.append(_progress(job_id))
+    try:
+        await asyncio.gather(*readers)
+        returncode = await process.wait()
+    finally:
+        with _children_lock:
+            _children.discard(process)
+        sampler.cancel()
+        if progress is not None:
+            get_board().finish(job_id)
+
+    last_progress: ProgressEvent | None = state["last_progress"]
+    last_stats = state["last_stats"]
+    if last_progress is not None:
+        last_stats = (f"frame={last_progress.frame} fps={last_progress.fps:.1f} "
+                      f"size={last_progress.total_size} time={last_progress.out_time:.2f} "
+                      f"bitrate={last_progress.bitrate:.1f}kbits/s speed={last_progress.speed:.2f}x")
+    return RunResult(
+        returncode=returncode,
+        wall_time=time.monotonic() - start,
+        last_stats=last_stats,
+        stderr_tail=list(tail),
+        last_progress=last_progress,
+        usage=usage,
+    )
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """ Get the shared event loop, started on a daemon thread on first use.
+
+    Returns:
+        asyncio.AbstractEventLoop: loop supervising every ffmpeg child
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="ffmpeg-runner", daemon=True).start()
+        return _loop
+
+def run_ffmpeg(command: list[str], on_line=None, tail_size: int = TAIL_SIZE,
+               progress: str | None = None, duration: float = 0.0) -> RunResult:
+    """ Blocking wrapper of run_ffmpeg_async for the stage functions, safe to call from any thread.
+
+    Args:
+        command (list[str]): command to run
+        on_line (function, optional): called with every stderr line, from the runner thread
+        tail_size (int, optional): number of non-stats stderr lines kept for error reports
+        progress (str | None, optional): label shown on the progress board; enables `-progress`
+        duration (float, optional): media duration in seconds, used for percent and ETA
+
+    Returns:
+        RunResult: exit code, wall time, last stats and stderr tail
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        run_ffmpeg_async(command, on_line, tail_size, progress, duration), get_loop())
+    result = future.result()
+    record_children([result], [child_label(command, progress)])
+    return result
+
+def terminate_all(grace: float = 5.0):
+    """ Stop every running ffmpeg child and refuse to start new ones.
+
+    Children get SIGTERM so ffmpeg can close its outputs, then SIGKILL after the grace delay.
+
+    Args:
+        grace (float, optional): seconds given to the children to exit. Defaults to 5.0.
+    """
+    with _children_lock:
+        _stopping.set()
+    if _loop is None:
+        return
+
+    async def _terminate():
+        with _children_lock:
+            processes = list(_children)
+        for process in processes:
+            with contextlib.suppress(ProcessLookupError):
+                process.terminate()
+        if not processes:
+            return
+        _, still_running = await asyncio.wait([asyncio.ensure_future(p.wait()) for p in processes], timeout=grace)
+        if still_running:
+            for process in processes:
+                if process.returncode is None:
+                    with contextlib.suppress(ProcessLookupError):
+                        process.kill()
+
+    asyncio.run_coroutine_threadsafe(_terminate(), _loop).result()
+
+def is_stopping() -> bool:
+    """True once terminate_all has been called."""
+    return _stopping.is_set()
+
+def run_many(commands: list[list[str]], limit: int, on_line=None,
+             labels: list[str] | None = None, durations: list[float] | None = None) -> list[RunResult]:
+    """ Run several commands concurrently on the shared loop, at most `limit` at a time.
+
+    Args:
+        commands (list[list[str]]): commands to run
+        limit (int): maximum number of concurrent children
+        on_line (function, optional): called with (command index, line) for every stderr line
+        labels (list[str] | None, optional): progress board label of each command
+        durations (list[float] | None, optional): media duration of each command
+
+    Returns:
+        list[RunResult]: results, in the order of the commands
+    """
+    async def _gather():
+        semaphore = asyncio.Semaphore(max(1, limit))
+
+        async def _one(i, command):
+            async with semaphore:
+                callback = (lambda line: on_line(i, line)) if on_line else None
+                label = labels[i] if labels else None
+                duration = durations[i] if durations else 0.0
+                return await run_ffmpeg_async(command, callback, progress=label, duration=duration)
+
+        return await asyncio.gather(*(_one(i, c) for i, c in enumerate(commands)))
+
+    results = asyncio.run_coroutine_threadsafe(_gather(), get_loop()).result()
+    record_children(results, [child_label(c, labels[i] if labels else None) for i, c in enumerate(commands)])
+    return results
+
+def run_chain(commands: list[list[str]], labels: list[str] | None = None, durations: list[float] | None = None,
+              grace: float = 5.0) -> list[RunResult]:
+    """ Run commands connected by pipes all at once, stopping the whole chain as soon as one fails.
+
+    A child blocked opening a FIFO whose other end will never be opened does not react to
+    SIGTERM, hence the SIGKILL after the grace delay.
+
+    Args:
+        commands (list[list[str]]): commands, each reading what the previous one writes
+        labels (list[str] | None, optional): progress board label of each command
+        durations (list[float] | None, optional): media duration of each command
+        grace (float, optional): seconds given to the other children to exit. Defaults to 5.0.
+
+    Returns:
+        list[RunResult]: results, in the order of the commands
+    """
+    async def _chain():
+        processes: list[asyncio.subprocess.Process] = []
+        tasks = [
+            asyncio.ensure_future(run_ffmpeg_async(
+                command, progress=labels[i] if labels else None,
+                duration=durations[i] if durations else 0.0, on_start=processes.append))
+            for i, command in enumerate(commands)
+        ]
+        pending = set(tasks)
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if any(not task.result().success for task in finished) and pending:
+                for process in processes:
+                    if process.returncode is None:
+                        with contextlib.suppress(ProcessLookupError):
+                            process.terminate()
+                _, still_running = await asyncio.wait(pending, timeout=grace)
+                for process in processes:
+                    if process.returncode is None:
+                        with contextlib.suppress(ProcessLookupError):
+                            process.kill()
+                if still_running:
+                    await asyncio.wait(still_running)
+                break
+        return [task.result() for task in tasks]
+
+    results = asyncio.run_coroutine_threadsafe(_chain(), get_loop()).result()
+    record_children(results, [child_label(c, labels[i] if labels else None) for i, c in enumerate(commands)])
+    return results
+
+def report_failure(result: RunResult, what: str, log):
+    """ Log a failed run with its exit code and the tail of its error output.
+
+    Args:
+        result (RunResult): failed run
+        what (str): description of the step, e.g. "le transcode audio"
+        log (function): logging function
+    """
+    log(f"❌ Échec pour {what} (code retour {result.returncode}) : {result.error_summary()}", "ERROR")
+    for line in result.stderr_tail[-10:]:
+        log(f"    {line}", "ERROR")
@@ -0,0 +1,176 @@
+"""Three-stage pipeline (remux, audio, AV1) as separate processes connected by FIFOs carrying Matroska."""
+
+import dataclasses
+import os
+from models.convert_to_mp4 import subtitle_args
+from models.encoders import EncoderBackend, available_backends, failed_at_startup
+from models.probe import probe
+from models.quality import QualityTarget, tune_info
+from models.runner import report_failure, run_chain
+from models.throughput import Pacing
+from models.transcode_audio import audio_args, get_audio_info
+from models.transcode_av1 import get_info
+from utils import AudioStream, MediaInfo, TranscodeData
+
+# Streamable container between the stages: keeps text subtitles, chapters and metadata
+STREAM_FORMAT = "matroska"
+
+def remux_command(video_path, media: MediaInfo, audio_stream: list[AudioStream], log, fifo: str) -> list[str]:
+    """ Build the first stage: copy the video, the kept audio tracks and the text subtitles into a FIFO.
+
+    The streams are written in that order, so the next stages find the video at index 0
+    and the audio tracks right after it.
+
+    Args:
+        video_path (str): path to the source video file
+        media (MediaInfo): probe of video_path
+        audio_stream (list[AudioStream]): audio streams returned by get_audio_info
+        log (function): logging function
+        fifo (str): FIFO read by the audio stage
+
+    Raises:
+        RuntimeError: if the source has no video track
+
+    Returns:
+        list[str]: ffmpeg command
+    """
+    video_track = media.video_track
+    if video_track is None:
+        raise RuntimeError("Aucune piste vidéo trouvée")
+    command = ["ffmpeg", "-y", "-i", video_path, "-map", f"0:{video_track.index}", "-c:v", "copy"]
+    for audio in audio_stream:
+        command += ["-map", f"0:{audio.index}"]
+    command += ["-c:a", "copy"]
+    log(f"{len(media.subtitles)} piste(s) de sous-titres détectée(s)")
+    command += subtitle_args(media.subtitles, log)
+    command += [
+        "-c:s", "srt",
+        "-map_metadata", "0",
+        "-map_chapters", "0",
+        "-f", STREAM_FORMAT, fifo,
+    ]
+    return command
+
+def audio_command(audio_stream: list[AudioStream], fifo_in: str, fifo_out: str) -> list[str]:
+    """ Build the second stage: encode the audio tracks to AAC, copy everything else.
+
+    Args:
+        audio_stream (list[AudioStream]): audio streams returned by get_audio_info
+        fifo_in (str): FIFO written by the remux stage
+        fifo_out (str): FIFO read by the AV1 stage
+
+    Returns:
+        list[str]: ffmpeg command
+    """
+    # Input index of every track in the output of remux_command
+    renumbered = [dataclasses.replace(audio, index=i + 1) for i, audio in enumerate(audio_stream)]
+    return [
+        "ffmpeg", "-y",
+        "-f", STREAM_FORMAT, "-i", fifo_in,
+        "-map", "0:v", "-c:v", "copy",
+        *audio_args(renumbered),
+        "-map", "0:s?", "-c:s", "copy",
+        "-f", STREAM_FORMAT, fifo_out,
+    ]
+
+def av1_command(backend: EncoderBackend, info: TranscodeData, fifo: str, output_path: str) -> list[str]:
+    """ Build the last stage: encode the video to AV1 and write the final MP4.
+
+    Args:
+        backend (EncoderBackend): AV1 encoder backend
+        info (TranscodeData): transcoding data of the source
+        fifo (str): FIFO written by the audio stage
+        output_path (str): path of the MP4 file to produce
+
+    Returns:
+        list[str]: ffmpeg command
+    """
+    return [
+        "ffmpeg", "-y",
+        *backend.input_args(),
+        "-f", STREAM_FORMAT, "-i", fifo,
+        "-map", "0:v",
+        *backend.video_args(info),
+        "-map", "0:a?", "-c:a", "copy",
+        "-map", "0:s?", "-c:s", "mov_text",
+        "-movflags", "+faststart",
+        output_path,
+    ]
+
+def transcode_streamed(video_path, temp_path, log, media: MediaInfo | None = None,
+                       encoders: list[str] | None = None, quality: QualityTarget | None = None,
+                       pacing: Pacing | None = None):
+    """ Run the remux, audio and AV1 stages at the same time, streaming from one to the next.
+
+    Only the final MP4 is written to temp_path; the stages exchange Matroska through
+    two FIFOs. A backend failing at startup is replaced by the next one, which restarts
+    the whole chain since a pipe cannot be replayed.
+
+    Args:
+        video_path (str): path to the source video file
+        temp_path (str): temporary directory receiving the output
+        log (function): logging function
+        media (MediaInfo, optional): probe of video_path, probed here if not given
+        encoders (list[str] | None, optional): AV1 encoders in order of preference, see available_backends
+        quality (QualityTarget | None, optional): target-quality CQ search, None to keep the default CQ
+        pacing (Pacing | None, optional): preset choice and throughput recording of the job
+
+    Raises:
+        FileNotFoundError: _if the video file does not exist
+        NotADirectoryError: _if the temporary path does not exist
+
+    Returns:
+        dict: {"success": bool, "output": str, "file_name": str}, same shape as convert_to_mp4
+    """
+    if not os.path.isfile(video_path):
+        raise FileNotFoundError(f"Fichier vidéo non trouvé : {video_path}")
+    if not os.path.isdir(temp_path):
+        raise NotADirectoryError(f"Dossier temporaire non trouvé : {temp_path}")
+
+    file_name = os.path.basename(video_path).rsplit('.', 1)[0] + ".mp4"
+    output = os.path.join(temp_path, file_name)
+    failure = {"success": False, "output": "", "file_name": ""}
+    media = media or probe(video_path)
+    info: TranscodeData = TranscodeData(**get_info(video_path, media))
+    audio_stream = get_audio_info(media, log)
+    backends = available_backends(encoders)
+    if not backends:
+        log("❌ Aucun encodeur AV1 disponible sur cette machine", "ERROR")
+        return failure
+
+    fifos = [os.path.join(temp_path, "remux.fifo"), os.path.join(temp_path, "audio.fifo")]
+    stages = ["mp4", "audio"]
+    try:
+        for backend in backends:
+            for fifo in fifos:
+                if os.path.exists(fifo):
+                    os.remove(fifo)
+                os.mkfifo(fifo)
+            log(f"Encodage AV1 en flux avec {backend.name}")
+            commands = [
+                remux_command(video_path, media, audio_stream, log, fifos[0]),
+                audio_command(audio_stream, fifos[0], fifos[1]),
+                av1_command(backend, tune_info(video_path, temp_path, log, media, info, backend, quality, pacing),
+                            fifos[1], output),
+            ]
+            results = run_chain(commands, labels=[f"{file_name} [{stage}]" for stage in [*stages, backend.name]],
+                                durations=[media.duration] * len(commands))
+            if all(result.success for result in results):
+                if pacing is not None:
+                    pacing.record(backend, results[-1])
+                log("✅ Transcodage en flux ok", "OK")
+                return {"success": True, "output": output, "file_name": file_name}
+            if os.path.exists(output):
+                os.remove(output)
+            if results[-1].success or not failed_at_startup(results[-1]):
+                for stage, result in zip([*stages, backend.name], results):
+                    if not result.success:
+                        report_failure(result, f"l'étape {stage} du transcodage en flux", log)
+                return failure
+            # The upstream stages were stopped with the encoder, only its error matters
+            report_failure(results[-1], f"le démarrage de {backend.name}", log)
+        return failure
+    finally:
+        for fifo in fifos:
+            if os.path.exists(fifo):
+                os.remove(fifo)
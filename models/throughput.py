@@ -0,0 +1,433 @@
+"""Measured encode throughput per backend, preset and content class, used to predict encode times and fit a deadline."""
+
+from dataclasses import dataclass, replace
+import sqlite3
+import statistics
+import threading
+import time
+from models.complexity import ComplexityScores
+from models.encoders import EncoderBackend
+from models.progress import format_duration
+from models.runner import RunResult
+from utils import TranscodeData
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS throughput (
+    backend TEXT NOT NULL,
+    preset TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    hdr INTEGER NOT NULL,
+    complexity TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    frames INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    wall_time REAL NOT NULL,
+    fps REAL NOT NULL,
+    realtime REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS throughput_key ON throughput (backend, mode, created_at);
+"""
+
+# Most recent samples of a key used for the median, older ones describe another machine state
+HISTORY = 20
+# Samples loaded per backend and mode, enough for every key of a library
+SCAN_LIMIT = 2000
+# Encode time ratio between two neighbouring presets, when only one of them was measured
+PRESET_STEP = 1.35
+# Pixels per frame of each resolution class, speed is taken as inversely proportional
+RESOLUTION_PIXELS = {
+    "2160p": 3840 * 2160, "1440p": 2560 * 1440, "1080p": 1920 * 1080,
+    "720p": 1280 * 720, "480p": 854 * 480, "SD": 720 * 400,
+}
+# Frames per second assumed at 1080p with the default preset before anything was measured
+DEFAULT_FPS = {"av1_nvenc": 150.0, "libsvtav1": 30.0, "libaom-av1": 6.0}
+
+def complexity_class(info: TranscodeData) -> str:
+    """ Classify the content complexity like the CQ correction of models.complexity does.
+
+    Args:
+        info (TranscodeData): transcoding data of the source
+
+    Returns:
+        str: "high", "medium", "low", or "unknown" when the analysis did not run
+    """
+    if info.spatial_complexity is None or info.temporal_complexity is None:
+        return "unknown"
+    offset = ComplexityScores(info.spatial_complexity, info.temporal_complexity).cq_offset
+    return "high" if offset < 0 else "low" if offset > 0 else "medium"
+
+@dataclass(frozen=True)
+class EncodeProfile:
+    """Class representing what makes an encode slow or fast, besides the backend and its preset."""
+    resolution: str
+    hdr: bool
+    complexity: str
+    frames: int
+
+    @classmethod
+    def from_info(cls, info: TranscodeData) -> "EncodeProfile":
+        """ Build the profile of a source from its transcoding data.
+
+        Args:
+            info (TranscodeData): transcoding data of the source
+
+        Returns:
+            EncodeProfile: profile of the encode
+        """
+        return cls(info.resolution, bool(info.is_hdr), complexity_class(info), int(info.duration * info.framerate))
+
+@dataclass
+class ThroughputSample:
+    """Class representing one finished encode."""
+    backend: str
+    preset: str
+    resolution: str
+    hdr: bool
+    complexity: str
+    mode: str
+    frames: int
+    duration: float
+    wall_time: float
+
+    @property
+    def fps(self) -> float:
+        """Encoded frames per second."""
+        return self.frames / self.wall_time if self.wall_time > 0 else 0.0
+
+    @property
+    def realtime(self) -> float:
+        """Seconds of media encoded per second, above 1 the encode is faster than playback."""
+        return self.duration / self.wall_time if self.wall_time > 0 else 0.0
+
+class ThroughputStore:
+    """Class storing the speed of every finished encode, in the catalog database."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def record(self, sample: ThroughputSample):
+        """ Store a finished encode.
+
+        Args:
+            sample (ThroughputSample): measured encode
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO throughput VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (sample.backend, sample.preset, sample.resolution, int(sample.hdr), sample.complexity,
+                 sample.mode, sample.frames, sample.duration, sample.wall_time, sample.fps,
+                 sample.realtime, time.time()))
+            self._conn.commit()
+
+    def speeds(self, backend: str, mode: str | None = None) -> list[tuple[str, str, bool, str, float]]:
+        """ List the measured speeds of a backend, newest first.
+
+        Args:
+            backend (str): encoder name
+            mode (str | None, optional): pipeline mode, None for every mode
+
+        Returns:
+            list[tuple[str, str, bool, str, float]]: (preset, resolution, hdr, complexity, fps) rows
+        """
+        query = "SELECT preset, resolution, hdr, complexity, fps FROM throughput WHERE backend = ?"
+        params: list = [backend]
+        if mode is not None:
+            query += " AND mode = ?"
+            params.append(mode)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(SCAN_LIMIT)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [(preset, resolution, bool(hdr), complexity, fps) for preset, resolution, hdr, complexity, fps in rows]
+
+_store: ThroughputStore | None = None
+
+def get_store() -> ThroughputStore | None:
+    """ Get the process-wide throughput store.
+
+    Returns:
+        ThroughputStore | None: shared store, None until configured with set_store
+    """
+    return _store
+
+def set_store(store: ThroughputStore | None):
+    """ Replace the process-wide throughput store.
+
+    Args:
+        store (ThroughputStore | None): store receiving the finished encodes, None to stop recording
+    """
+    global _store
+    _store = store
+
+def _preset_index(backend: EncoderBackend, preset: str) -> int:
+    try:
+        return backend.presets.index(preset)
+    except ValueError:
+        return backend.presets.index(backend.default_preset) if backend.default_preset in backend.presets else 0
+
+class ThroughputModel:
+    """Predict the speed of an encode from the closest measured encodes.
+
+    The samples of the same resolution, HDR flag and complexity are preferred, then the
+    match is loosened one criterion at a time (complexity, HDR, resolution scaled by its
+    pixel count). Samples of another preset are converted with PRESET_STEP per step,
+    and a backend never measured gets DEFAULT_FPS.
+    """
+
+    def __init__(self, store: ThroughputStore | None = None):
+        self.store = store
+        self._rows: dict[tuple[str, str | None], list] = {}
+        self._lock = threading.Lock()
+
+    def record(self, sample: ThroughputSample):
+        """ Store a finished encode and take it into account in the next predictions.
+
+        Args:
+            sample (ThroughputSample): measured encode
+        """
+        if self.store is None:
+            return
+        self.store.record(sample)
+        with self._lock:
+            self._rows.clear()
+
+    def _speeds(self, backend: str, mode: str) -> list:
+        if self.store is None:
+            return []
+        with self._lock:
+            for key in ((backend, mode), (backend, None)):
+                if key not in self._rows:
+                    self._rows[key] = self.store.speeds(*key)
+            # The same mode first: segment encoders and piped stages do not run at the same speed
+            return self._rows[(backend, mode)] or self._rows[(backend, None)]
+
+    def fps(self, backend: EncoderBackend, preset: str, profile: EncodeProfile, mode: str) -> float:
+        """ Predict the encoded frames per second.
+
+        Args:
+            backend (EncoderBackend): encoder
+            preset (str): encoder preset
+            profile (EncodeProfile): source to encode
+            mode (str): pipeline mode, see BatchExecutor.mode
+
+        Returns:
+            float: predicted frames per second
+        """
+        target = _preset_index(backend, preset)
+        pixels = RESOLUTION_PIXELS.get(profile.resolution, RESOLUTION_PIXELS["1080p"])
+        best_rank, speeds = None, []
+        for row_preset, resolution, hdr, complexity, fps in self._speeds(backend.name, mode):
+            if resolution != profile.resolution:
+                level = 3
+            elif hdr != profile.hdr:
+                level = 2
+            elif complexity != profile.complexity or complexity == "unknown":
+                level = 1
+            else:
+                level = 0
+            steps = target - _preset_index(backend, row_preset)
+            rank = (level, steps != 0)
+            if best_rank is not None and rank > best_rank:
+                continue
+            if best_rank is None or rank < best_rank:
+                best_rank, speeds = rank, []
+            if len(speeds) < HISTORY:
+                scale = RESOLUTION_PIXELS.get(resolution, RESOLUTION_PIXELS["1080p"]) / pixels
+                speeds.append(fps * scale * PRESET_STEP ** steps)
+        if speeds:
+            return statistics.median(speeds)
+        steps = target - _preset_index(backend, backend.default_preset)
+        return DEFAULT_FPS.get(backend.name, 10.0) * RESOLUTION_PIXELS["1080p"] / pixels * PRESET_STEP ** steps
+
+    def seconds(self, backend: EncoderBackend, preset: str, profile: EncodeProfile, mode: str) -> float:
+        """ Predict the wall time of an encode.
+
+        Args:
+            backend (EncoderBackend): encoder
+            preset (str): encoder preset
+            profile (EncodeProfile): source to encode
+            mode (str): pipeline mode, see BatchExecutor.mode
+
+        Returns:
+            float: predicted encode time in seconds
+        """
+        return profile.frames / max(self.fps(backend, preset, profile, mode), 0.01)
+
+def plan_presets(seconds: dict[str, list[float]], capacity: float) -> dict[str, int] | None:
+    """ Choose the slowest preset of every job such that the sum of the encode times fits the capacity.
+
+    Every job starts on the fastest preset; then, round after round, each job moves one
+    preset slower, the cheapest moves first, as long as the total still fits. The
+    presets stay close to each other across the queue instead of spending the whole
+    budget on the first jobs.
+
+    Args:
+        seconds (dict[str, list[float]]): per job, predicted encode time of each preset from the slowest to the fastest
+        capacity (float): encoder seconds available
+
+    Returns:
+        dict[str, int] | None: per job, index of the chosen preset; None if even the fastest presets do not fit
+    """
+    choice = {job_id: len(times) - 1 for job_id, times in seconds.items()}
+    total = sum(times[-1] for times in seconds.values())
+    if total > capacity:
+        return None
+    moved = True
+    while moved:
+        moved = False
+        moves = sorted((seconds[job_id][index - 1] - seconds[job_id][index], job_id)
+                       for job_id, index in choice.items() if index > 0)
+        for extra, job_id in moves:
+            if total + extra <= capacity:
+                total += extra
+                choice[job_id] -= 1
+                moved = True
+    return choice
+
+class DeadlineScheduler:
+    """Share a time budget between the queued encodes by choosing their presets.
+
+    The jobs waiting for the encoder are queued with a profile of their source; when one
+    starts, the presets are planned over it and the queue, in the time left before the
+    deadline on every slot, minus what the running encodes are predicted to still take.
+    """
+
+    def __init__(self, model: ThroughputModel, deadline: float, slots: int = 1):
+        self.model = model
+        self.deadline = deadline
+        self.slots = max(1, slots)
+        self._queued: dict[str, EncodeProfile] = {}
+        self._running: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def queue(self, job_id: str, profile: EncodeProfile):
+        """ Count a job in the work left before the deadline.
+
+        Args:
+            job_id (str): job identifier
+            profile (EncodeProfile): profile of its source
+        """
+        with self._lock:
+            self._queued[job_id] = profile
+
+    def discard(self, job_id: str):
+        """ Stop counting a job, once its encode ended or it left the pipeline.
+
+        Args:
+            job_id (str): job identifier
+        """
+        with self._lock:
+            self._queued.pop(job_id, None)
+            self._running.pop(job_id, None)
+
+    def choose(self, job_id: str, backend: EncoderBackend, profile: EncodeProfile, mode: str) -> tuple[str, float, bool]:
+        """ Choose the preset of an encode about to start.
+
+        The queued jobs are planned as if they used the same backend and mode.
+
+        Args:
+            job_id (str): job identifier
+            backend (EncoderBackend): encoder of the job
+            profile (EncodeProfile): profile of its source
+            mode (str): pipeline mode, see BatchExecutor.mode
+
+        Returns:
+            tuple[str, float, bool]: preset, predicted encode time, False if the deadline cannot be met
+        """
+        presets = backend.presets or (backend.default_preset,)
+        with self._lock:
+            now = time.time()
+            self._queued.pop(job_id, None)
+            self._running.pop(job_id, None)
+            busy = sum(max(0.0, start + predicted - now) for start, predicted in self._running.values())
+            capacity = max(0.0, self.deadline - now) * self.slots - busy
+            jobs = {job_id: profile, **self._queued}
+            seconds = {key: [self.model.seconds(backend, preset, job, mode) for preset in presets]
+                       for key, job in jobs.items()}
+            choice = plan_presets(seconds, capacity)
+            feasible = choice is not None
+            index = choice[job_id] if feasible else len(presets) - 1
+            self._running[job_id] = (now, seconds[job_id][index])
+        return presets[index], seconds[job_id][index], feasible
+
+class Pacing:
+    """Preset choice and throughput recording of the encodes of one job.
+
+    Given to the encode stages: apply picks the preset of a backend (the planned one in
+    deadline mode, the default one otherwise) and logs the predicted encode time;
+    record stores the measured speed once the encode succeeded, and keeps in
+    chosen_preset the preset the deadline imposed on it.
+    """
+
+    def __init__(self, job_id: str, model: ThroughputModel, log, mode: str = "single_pass",
+                 scheduler: DeadlineScheduler | None = None):
+        self.job_id = job_id
+        self.model = model
+        self.log = log
+        self.mode = mode
+        self.scheduler = scheduler
+        self._applied: dict[str, TranscodeData] = {}
+        # Preset of the successful encode when the deadline moved it off the default, "" otherwise
+        self.chosen_preset = ""
+
+    def apply(self, backend: EncoderBackend, info: TranscodeData) -> TranscodeData:
+        """ Set the preset of an encode about to start with a backend.
+
+        Args:
+            backend (EncoderBackend): encoder
+            info (TranscodeData): transcoding data of the source
+
+        Returns:
+            TranscodeData: transcoding data with the chosen preset
+        """
+        if backend.name in self._applied:
+            return replace(info, preset=self._applied[backend.name].preset)
+        profile = EncodeProfile.from_info(info)
+        if self.scheduler is not None:
+            preset, seconds, feasible = self.scheduler.choose(self.job_id, backend, profile, self.mode)
+            if not feasible:
+                self.log(f"Échéance intenable même au preset le plus rapide, {backend.name} preset {preset}", "WARN")
+        else:
+            preset = info.preset or backend.default_preset
+            seconds = self.model.seconds(backend, preset, profile, self.mode)
+        self.log(f"Encodage estimé à {format_duration(seconds)} avec {backend.name} preset {preset}")
+        tuned = replace(info, preset=preset)
+        self._applied[backend.name] = tuned
+        return tuned
+
+    def record(self, backend: EncoderBackend, result: RunResult | None = None, wall_time: float | None = None):
+        """ Store the speed of a successful encode.
+
+        Args:
+            backend (EncoderBackend): encoder that produced the output
+            result (RunResult | None, optional): run of the encoder, for its frame count and wall time
+            wall_time (float | None, optional): encode time, instead of the one of result
+        """
+        info = self._applied.get(backend.name)
+        if info is None:
+            return
+        if self.scheduler is not None and info.preset != backend.default_preset:
+            self.chosen_preset = info.preset
+        frames = int(info.duration * info.framerate)
+        if result is not None and result.last_progress is not None and result.last_progress.frame:
+            frames = result.last_progress.frame
+        wall_time = wall_time if wall_time is not None else result.wall_time if result is not None else 0.0
+        if wall_time <= 0 or frames <= 0:
+            return
+        profile = EncodeProfile.from_info(info)
+        sample = ThroughputSample(backend.name, info.preset, profile.resolution, profile.hdr, profile.complexity,
+                                  self.mode, frames, info.duration, wall_time)
+        self.model.record(sample)
+        self.log(f"Débit {backend.name} preset {info.preset} : {sample.fps:.1f} img/s, "
+                 f"{sample.realtime:.2f}x temps réel")
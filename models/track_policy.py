@@ -0,0 +1,198 @@
+"""Declarative policy deciding which audio and subtitle tracks are kept, and the AAC bitrate of each layout."""
+
+from dataclasses import dataclass, field
+import json
+import re
+from utils import AudioTrack, SubtitleTrack
+
+# Same decisions as the old interactive prompt answered with its default (keep, labelled)
+DEFAULT_RULES = [
+    {"kind": "audio", "action": "keep", "title": r"\bvfq\b|qu[ée]b[ée]c", "label": "québécoise"},
+    {"kind": "audio", "action": "keep", "title": r"\bad\b|audio[ -]?descri", "label": "audio descriptive"},
+    {"kind": "audio", "action": "keep", "disposition": {"visual_impaired": 1}, "label": "audio descriptive"},
+]
+# kbps used when the source bitrate is unknown, by channel count; at most the caps below
+DEFAULT_BITRATES = {"1": 96, "2": 192, "6": 384, "8": 512}
+# Upper bound in kbps, by channel layout or channel count (other counts use the nearest lower one)
+DEFAULT_BITRATE_CAPS = {"1": 96, "2": 192, "6": 384, "8": 512}
+
+@dataclass
+class TrackRule:
+    """Class representing one rule of the policy; every criterion given must match."""
+    action: str = "keep"
+    kind: str = "any"
+    languages: list[str] | None = None
+    title: str | None = None
+    codecs: list[str] | None = None
+    channels: list[int] | None = None
+    disposition: dict[str, int] | None = None
+    label: str = ""
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TrackRule":
+        """Create a TrackRule instance from a rule of the policy file.
+
+        Args:
+            data (dict): rule
+
+        Raises:
+            ValueError: if the action or the kind is unknown
+
+        Returns:
+            TrackRule: instance of TrackRule
+        """
+        rule = cls(**data)
+        if rule.action not in ("keep", "drop"):
+            raise ValueError(f"Action inconnue dans la politique de pistes : {rule.action}")
+        if rule.kind not in ("audio", "subtitle", "any"):
+            raise ValueError(f"Type de piste inconnu dans la politique de pistes : {rule.kind}")
+        return rule
+
+    def matches(self, track: AudioTrack | SubtitleTrack, kind: str) -> bool:
+        """ Check if the rule applies to a track.
+
+        Args:
+            track (AudioTrack | SubtitleTrack): track of the source
+            kind (str): "audio" or "subtitle"
+
+        Returns:
+            bool: True if every criterion of the rule matches
+        """
+        language, title, channels = track_fields(track)
+        if self.kind not in ("any", kind):
+            return False
+        if self.languages is not None and language.lower() not in {l.lower() for l in self.languages}:
+            return False
+        if self.title is not None and not re.search(self.title, title, re.IGNORECASE):
+            return False
+        if self.codecs is not None and track.codec_name not in self.codecs:
+            return False
+        if self.channels is not None and channels not in self.channels:
+            return False
+        if self.disposition is not None:
+            disposition = track.disposition or {}
+            if any(int(disposition.get(key, 0)) != int(value) for key, value in self.disposition.items()):
+                return False
+        return True
+
+@dataclass
+class TrackDecision:
+    """Class representing the outcome of the policy for one track."""
+    keep: bool = True
+    label: str = ""
+    rule: TrackRule | None = None
+
+@dataclass
+class TrackPolicy:
+    """Class representing the whole policy: ordered rules (first match wins) and AAC bitrates."""
+    rules: list[TrackRule] = field(default_factory=lambda: [TrackRule.from_dict(r) for r in DEFAULT_RULES])
+    default_bitrates: dict[str, int] = field(default_factory=lambda: dict(DEFAULT_BITRATES))
+    bitrate_caps: dict[str, int] = field(default_factory=lambda: dict(DEFAULT_BITRATE_CAPS))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TrackPolicy":
+        """Create a TrackPolicy instance from the content of a policy file.
+
+        Args:
+            data (dict): {"rules": [...], "default_bitrates": {...}, "bitrate_caps": {...}}, every key optional
+
+        Returns:
+            TrackPolicy: instance of TrackPolicy
+        """
+        policy = cls()
+        if "rules" in data:
+            policy.rules = [TrackRule.from_dict(rule) for rule in data["rules"]]
+        policy.default_bitrates |= {str(k): int(v) for k, v in data.get("default_bitrates", {}).items()}
+        policy.bitrate_caps |= {str(k): int(v) for k, v in data.get("bitrate_caps", {}).items()}
+        return policy
+
+    @classmethod
+    def load(cls, path: str) -> "TrackPolicy":
+        """ Read a JSON policy file.
+
+        Args:
+            path (str): path of the policy file
+
+        Returns:
+            TrackPolicy: instance of TrackPolicy
+        """
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def decide(self, track: AudioTrack | SubtitleTrack, kind: str) -> TrackDecision:
+        """ Apply the first matching rule to a track; tracks matching no rule are kept.
+
+        Args:
+            track (AudioTrack | SubtitleTrack): track of the source
+            kind (str): "audio" or "subtitle"
+
+        Returns:
+            TrackDecision: keep or drop, and the label to add to the title
+        """
+        for rule in self.rules:
+            if rule.matches(track, kind):
+                return TrackDecision(keep=rule.action == "keep", label=rule.label, rule=rule)
+        return TrackDecision()
+
+    def audio_bitrate(self, track: AudioTrack) -> str:
+        """ Choose the AAC bitrate of a track: the source bitrate, capped for its layout.
+
+        Args:
+            track (AudioTrack): audio track of the source
+
+        Returns:
+            str: ffmpeg bitrate, e.g. "192k"
+        """
+        kbps = int(track.bit_rate or 0) // 1000 or by_channels(self.default_bitrates, track.channels) or 192
+        cap = self.bitrate_caps.get(track.channel_layout) or by_channels(self.bitrate_caps, track.channels)
+        if cap:
+            kbps = min(kbps, cap)
+        return f"{kbps}k"
+
+def by_channels(table: dict[str, int], channels: int) -> int | None:
+    """ Look up a per channel count value, falling back to the nearest lower channel count.
+
+    Args:
+        table (dict[str, int]): values by channel count, other keys (layouts) are ignored
+        channels (int): channel count of the track
+
+    Returns:
+        int | None: value, None if no channel count up to channels is listed
+    """
+    if str(channels) in table:
+        return table[str(channels)]
+    lower = [int(key) for key in table if key.isdigit() and int(key) <= int(channels or 0)]
+    return table[str(max(lower))] if lower else None
+
+def track_fields(track: AudioTrack | SubtitleTrack) -> tuple[str, str, int]:
+    """ Get the language, title and channel count of an audio or subtitle track.
+
+    Args:
+        track (AudioTrack | SubtitleTrack): track of the source
+
+    Returns:
+        tuple[str, str, int]: language code, title, channels (0 for subtitles)
+    """
+    if isinstance(track, AudioTrack):
+        return track.tags.language, track.tags.title or "", track.channels
+    tags = track.tags or {}
+    return tags.get("language", "und"), tags.get("title") or tags.get("handler_name", ""), 0
+
+_policy = TrackPolicy()
+
+def get_policy() -> TrackPolicy:
+    """ Get the process-wide track policy.
+
+    Returns:
+        TrackPolicy: policy used by every stage
+    """
+    return _policy
+
+def set_policy(policy: TrackPolicy):
+    """ Replace the process-wide track policy.
+
+    Args:
+        policy (TrackPolicy): new policy
+    """
+    global _policy
+    _policy = policy
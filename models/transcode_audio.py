@@ -1,10 +1,10 @@
 """Module for transcoding audio streams in a video file to AAC format using ffmpeg."""
 
-import json
 import os
-import subprocess
-import sys
-from utils import AudioStream, AudioTrack
+from models.probe import probe
+from models.runner import report_failure, run_ffmpeg, run_many
+from models.track_policy import TrackPolicy, get_policy
+from utils import AudioStream, MediaInfo
 
 def get_language_name(code: str) -> str:
     """
@@ -83,152 +83,168 @@ def get_language_name(code: str) -> str:
 
     return languages.get(code, "Unknown")
 
-def verif_audio(title, index, log) -> bool:
-    """Function to verify if the audio track should be removed based on its title.
+def get_audio_info(media: MediaInfo, log, policy: TrackPolicy | None = None) -> list[AudioStream]:
+    """ Function to get the audio streams to keep from the probe of a video file.
 
     Args:
-        title (str): title of the audio track
-        index (int): index of the audio track
+        media (MediaInfo): probe of the video file
         log (function): logging function
+        policy (TrackPolicy | None, optional): track policy, the process-wide one if None
 
     Returns:
-        bool: True if the audio track should be removed, False otherwise
+        list[AudioStream]: list of audio streams in the video file
+    """
+    policy = policy or get_policy()
+    audios = media.audio
+    log(f"{len(audios)} piste(s) audio détectée(s)")
+    command_data: list[AudioStream] = []
+    for audio in audios:
+        is_aac = False
+        new_title = get_language_name(audio.tags.language)
+        decision = policy.decide(audio, "audio")
+        if not decision.keep:
+            log(f"La piste audio {audio.index} {audio.tags.title} est supprimée par la politique de pistes", "WARN")
+            continue
+        if decision.label:
+            log(f"La piste audio {audio.index} {audio.tags.title} a été détectée comme {decision.label}", "INFO")
+            new_title += f" ({decision.label})"
+        if audio.codec_name == "aac":
+            is_aac = True
+            log(f"La piste audio {audio.tags.title} sera copiée car elle est déjà en aac", "WARN")
+        bitrate = policy.audio_bitrate(audio)
+        command_data.append(
+            AudioStream(
+                index=audio.index,
+                channels=audio.channels,
+                bitrate=bitrate,
+                is_aac=is_aac,
+                title=new_title,
+                lang=audio.tags.language
+            )
+        )
+
+    return command_data
+
+def audio_args(audio_stream: list[AudioStream], input_index: int = 0,
+               sidecars: dict[int, int] | None = None) -> list[str]:
+    """ Build the ffmpeg arguments mapping the kept audio tracks, AAC-encoded or copied.
+
+    Args:
+        audio_stream (list[AudioStream]): audio streams returned by get_audio_info
+        input_index (int, optional): ffmpeg input holding the tracks. Defaults to 0.
+        sidecars (dict[int, int] | None, optional): source stream index -> ffmpeg input holding
+            that track already encoded, copied instead of being encoded again
+
+    Returns:
+        list[str]: ffmpeg arguments (maps, codecs and metadata)
     """
-    name = ""
-    if "vfq" in title.lower():
-        name += "québécoise"
-    if "ad" in title.lower():
-        name += "audio descriptive"
-    if name != "":
-        log(f"La piste audio {index} {title} a été détécté comme {name}", "WARN")
-        response = input("Voulez vous supprimer cette piste ❓ (y/N)").strip().lower()
-        if response == "y":
-            log(f"La piste audio {index} {title} sera supprimée")
-            return {
-                "remove": True,
-                "name": name
-            }
+    sidecars = sidecars or {}
+    command = []
+    index_out = 0
+    for audio in audio_stream:
+
+        if audio.index in sidecars:
+            command += ["-map", f"{sidecars[audio.index]}:a:0"]
         else:
-            log(f"La piste audio {index} {title} est gardée")
-            return {
-                "remove": False,
-                "name": name
-            }
-    return {
-        "remove": False,
-        "name": name
-    }
+            command += ["-map", f"{input_index}:{audio.index}"]
+
+        if audio.is_aac or audio.index in sidecars:
+            command += [
+                f"-c:a:{index_out}", "copy",
+                f"-metadata:s:a:{index_out}", f"language={audio.lang}",
+                f"-metadata:s:a:{index_out}", f"handler_name={audio.title}",
+                f"-metadata:s:a:{index_out}", f"title={audio.title}"
+            ]
+        else:
+            command += [
+                f"-c:a:{index_out}", "aac",
+                f"-b:a:{index_out}", audio.bitrate,
+                f"-ac:a:{index_out}", str(audio.channels),
+                f"-metadata:s:a:{index_out}", f"language={audio.lang}",
+                f"-metadata:s:a:{index_out}", f"handler_name={audio.title}",
+                f"-metadata:s:a:{index_out}", f"title={audio.title}",
+            ]
+
+        index_out += 1
+    return command
 
-def get_subtitles(video_path, log):
-    """_summary_
+def sidecar_command(video_path: str, audio: AudioStream, output_path: str) -> list[str]:
+    """ Build the ffmpeg command encoding a single audio track of the source to an AAC sidecar file.
 
     Args:
         video_path (str): path to the video file
-        log (function): logging function
-
-    Raises:
-        FileNotFoundError: if the video file does not exist
-        Exception: on ffprobe error
+        audio (AudioStream): track to encode
+        output_path (str): path of the sidecar file (.m4a)
 
     Returns:
-        bool: True if the extraction was successful, False otherwise
+        list[str]: ffmpeg command
     """
-    if not os.path.isfile(video_path):
-        raise FileNotFoundError(f"Fichier vidéo non trouvé : {video_path}")
-    command = [
-        "ffprobe",
-        "-v", "error",
-        "-select_streams", "s",
-        "-show_entries", "stream=index,codec_name,codec_type:stream_tags=language,title,handler_name",
-        "-of", "json",
-        video_path
+    return [
+        "ffmpeg", "-y",
+        "-i", video_path,
+        "-map", f"0:{audio.index}",
+        "-vn", "-sn", "-dn",
+        "-c:a", "aac",
+        "-b:a", audio.bitrate,
+        "-ac", str(audio.channels),
+        output_path,
     ]
 
-    try:
-        res = subprocess.run(command, capture_output=True, text=True, check=True, encoding="utf-8", errors="replace")
-        data = json.loads(res.stdout)
-        subtitles = data.get("streams", [])
-        log(f"{len(subtitles)} piste(s) de sous-titres détectée(s)")
-        return subtitles
-    except subprocess.CalledProcessError as e:
-        stderr = e.stderr.decode('utf-8')
-        sys.stderr.write((f"Error: {e}:\n{stderr}\n"))
-        sys.exit(-1)
-
-def get_audio_info(video_path, log) -> list[AudioStream]:
-    """ Function to get audio stream information from a video file using ffprobe.
+def encode_sidecars(video_path: str, output_path: str, audio_stream: list[AudioStream], log,
+                    workers: int, duration: float = 0.0) -> dict[int, str] | None:
+    """ Encode every track that is not already AAC as its own ffmpeg process, at most workers at a time.
 
     Args:
         video_path (str): path to the video file
+        output_path (str): path of the final output, the sidecars are written next to it
+        audio_stream (list[AudioStream]): audio streams returned by get_audio_info
         log (function): logging function
-
-    Raises:
-        FileNotFoundError: _if the video file does not exist
-        Exception: _if there is an error reading the audio streams
+        workers (int): maximum number of concurrent encoders
+        duration (float, optional): media duration in seconds, for the progress board
 
     Returns:
-        list[AudioStream]: list of audio streams in the video file
+        dict[int, str] | None: source stream index -> sidecar file, None if a track failed
     """
-    if not os.path.isfile(video_path):
-        raise FileNotFoundError(f"Fichier vidéo non trouvé : {video_path}")
-    command = [
-        "ffprobe",
-        "-v", "error",
-        "-select_streams", "a",
-        "-show_entries", "stream=index,codec_name,channels,channel_layout,bit_rate:stream_tags=language,handler_name",
-        "-of", "json",
-        video_path
-    ]
-    try:
-        res = subprocess.run(command, capture_output=True, text=True, check=True, encoding="utf-8", errors="replace")
-        data = json.loads(res.stdout)
-        audios: list[AudioTrack] = [AudioTrack.from_dict(d) for d in data.get("streams")]
-        log(f"{len(audios)} piste(s) audio détectée(s)")
-        command_data: list[AudioStream] = []
-        for audio in audios:
-            is_aac = False
-            new_title = get_language_name(audio.tags.language)
-            verification_audio = verif_audio(audio.tags.title, audio.index, log)
-            if verification_audio["remove"]:
-                continue
-            if verification_audio["name"] != "":
-                new_title += f" ({verification_audio['name']})"
-            if audio.codec_name == "aac":
-                is_aac = True
-                log(f"La piste audio {audio.tags.title} sera copiée car elle est déjà en aac", "WARN")
-            if audio.bit_rate:
-                bitrate = str(int(audio.bit_rate) // 1000) + "k"
-            else:
-                bitrate = "192k"
-                match audio.channels:
-                    case 2: bitrate = "192k"
-                    case 6: bitrate = "512k"
-                    case 8: bitrate = "640k"
-            command_data.append(
-                AudioStream(
-                    index=audio.index,
-                    channels=audio.channels,
-                    bitrate=bitrate,
-                    is_aac=is_aac,
-                    title=new_title,
-                    lang=audio.tags.language
-                )
-            )
-
-        return command_data
-    except subprocess.CalledProcessError as e:
-        stderr = e.stderr.decode('utf-8')
-        sys.stderr.write((f"Error: {e}:\n{stderr}\n"))
-        sys.exit(-1)
+    stem = os.path.splitext(output_path)[0]
+    tracks = [audio for audio in audio_stream if not audio.is_aac]
+    sidecars = {audio.index: f"{stem}.a{audio.index}.m4a" for audio in tracks}
+    log(f"Encodage de {len(tracks)} piste(s) audio en parallèle ({workers} à la fois)", "INFO")
+    name = os.path.basename(video_path)
+    results = run_many([sidecar_command(video_path, audio, sidecars[audio.index]) for audio in tracks],
+                       workers, labels=[f"{name} [audio {audio.index}]" for audio in tracks],
+                       durations=[duration] * len(tracks))
+    success = True
+    for audio, result in zip(tracks, results):
+        if not result.success:
+            report_failure(result, f"l'encodage de la piste audio {audio.index}", log)
+            success = False
+    if not success:
+        remove_sidecars(sidecars)
+        return None
+    return sidecars
+
+def remove_sidecars(sidecars: dict[int, str]):
+    """ Delete the sidecar files of encode_sidecars.
 
+    Args:
+        sidecars (dict[int, str]): source stream index -> sidecar file
+    """
+    for path in sidecars.values():
+        if os.path.exists(path):
+            os.remove(path)
 
-def transcode_audio(video_path, output_path, log):
+def transcode_audio(video_path, output_path, log, media: MediaInfo | None = None, track_workers: int = 1):
     """ function to transcode audio streams of a video file to AAC format using ffmpeg.
 
+    With track_workers above 1 and several tracks to encode, each track is encoded by its
+    own ffmpeg process into a sidecar file, then everything is muxed with stream copy.
+
     Args:
         video_path (str): path to the video file
         output_path (str): path to the output file
         log (function): logging function
+        media (MediaInfo, optional): probe of video_path, probed here if not given
+        track_workers (int, optional): audio tracks encoded at the same time. Defaults to 1.
 
     Raises:
         FileNotFoundError: _if the video file does not exist
@@ -238,39 +254,26 @@ def transcode_audio(video_path, output_path, log):
     """
     if not os.path.isfile(video_path):
         raise FileNotFoundError(f"Fichier vidéo non trouvé : {video_path}")
-    audio_stream = get_audio_info(video_path, log)
-    subtitles = get_subtitles(video_path, log)
-
-    command = [
-        "ffmpeg",
-        "-i", video_path,
+    media = media or probe(video_path)
+    audio_stream = get_audio_info(media, log)
+    subtitles = media.subtitles
+    log(f"{len(subtitles)} piste(s) de sous-titres détectée(s)")
+
+    sidecars: dict[int, str] = {}
+    if track_workers > 1 and sum(not audio.is_aac for audio in audio_stream) > 1:
+        sidecars = encode_sidecars(video_path, output_path, audio_stream, log, track_workers, media.duration)
+        if sidecars is None:
+            return False
+
+    command = ["ffmpeg", "-i", video_path]
+    for path in sidecars.values():
+        command += ["-i", path]
+    command += [
         "-map", "0:v",
         "-c:v", "copy",
     ]
 
-    index_out = 0
-    for audio in audio_stream:
-
-        command += ["-map", f"0:{audio.index}"]
-
-        if audio.is_aac:
-            command += [
-                f"-c:a:{index_out}", "copy",        
-                f"-metadata:s:a:{index_out}", f"language={audio.lang}",
-                f"-metadata:s:a:{index_out}", f"handler_name={audio.title}",
-                f"-metadata:s:a:{index_out}", f"title={audio.title}"
-            ]
-        else:
-            command += [
-                f"-c:a:{index_out}", "aac",
-                f"-b:a:{index_out}", audio.bitrate,
-                f"-ac:a:{index_out}", str(audio.channels),
-                f"-metadata:s:a:{index_out}", f"language={audio.lang}",
-                f"-metadata:s:a:{index_out}", f"handler_name={audio.title}",
-                f"-metadata:s:a:{index_out}", f"title={audio.title}",
-            ]
-
-        index_out += 1
+    command += audio_args(audio_stream, sidecars={index: i + 1 for i, index in enumerate(sidecars)})
 
     command += [
         "-map", "0:s",
@@ -280,9 +283,9 @@ def transcode_audio(video_path, output_path, log):
     index_out = 0
     for subtitle in subtitles:
         command += [
-            f"-metadata:s:s:{index_out}", f"language={subtitle.get("tags", {}).get("language", "und")}",
-            f"-metadata:s:s:{index_out}", f"handler_name={subtitle.get("tags", {}).get("handler_name", "Unknown")}",
-            f"-metadata:s:s:{index_out}", f"title={subtitle.get("tags", {}).get("handler_name", "Unknown")}",
+            f"-metadata:s:s:{index_out}", f"language={subtitle.tags.get('language', 'und')}",
+            f"-metadata:s:s:{index_out}", f"handler_name={subtitle.tags.get('handler_name', 'Unknown')}",
+            f"-metadata:s:s:{index_out}", f"title={subtitle.tags.get('handler_name', 'Unknown')}",
         ]
         index_out += 1
 
@@ -292,27 +295,10 @@ def transcode_audio(video_path, output_path, log):
     ]
     command += [output_path]
 
-    process = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        encoding="utf-8",
-        errors="replace",
-        bufsize=1
-    )
-
-    for line in process.stdout:
-        if "frame=" in line or "time=" in line or "Audio" in line:
-            sys.stdout.write(line)
-            sys.stdout.flush()
-    result = False
-
-    ret = process.wait()
-    if ret == 0:
-        result = True
+    run = run_ffmpeg(command, progress=f"{os.path.basename(video_path)} [audio]", duration=media.duration)
+    remove_sidecars(sidecars)
+    if run.success:
         log("✅ Transcode audio ok", "OK")
     else:
-        result = False
-        log(f"❌ Échec pour le transcode audio (code retour {ret})", "ERROR")
-    return result
+        report_failure(run, "le transcode audio", log)
+    return run.success
@@ -1,11 +1,16 @@
-"""Transcode a video file to AV1 format using NVIDIA NVENC."""
+"""Transcode a video file to AV1 format (NVIDIA NVENC, or a CPU encoder as fallback)."""
 
 from fractions import Fraction
-import json
 import os
-import subprocess
-import sys
-from utils import VideoTrack, TranscodeData
+from models.complexity import ComplexityScores, analyze
+from models.crop import detect_crop
+from models.encoders import EncoderBackend, encode_with_fallback
+from models.packet_index import open_index
+from models.probe import ProbeError, probe
+from models.quality import QualityTarget, tune_info
+from models.runner import report_failure
+from models.throughput import Pacing
+from utils import MediaInfo, VideoTrack, TranscodeData
 
 def classify_resolution(width: int, height: int) -> str:
     """ Classify video resolution based on width and height.
@@ -124,6 +129,8 @@ def pick_params_from_source(info):
             resolution (str): resolution classification    
             is_hdr (bool): HDR status
             bitrate (int): source bitrate in bps
+            spatial_complexity (float, optional): detail score of models.complexity
+            temporal_complexity (float, optional): motion score of models.complexity
         }): video track info
 
     Returns:
@@ -148,7 +155,7 @@ def pick_params_from_source(info):
     target_ratio = ratio_min
     target_br = int(src_br * target_ratio)
 
-    # 3) cq de base selon résolution
+    # 3) cq de base selon résolution, sur l'échelle -cq de av1_nvenc (convertie par tune_info)
     if res == "2160p":
         cq = 26 if is_hdr else 27
         tiles = 2
@@ -166,6 +173,12 @@ def pick_params_from_source(info):
     if target_ratio <= 0.48:  # objectif agressif
         cq += 1
 
+    # Ajuste CQ selon le contenu : grain / mouvement -> plus de débit, aplats -> moins
+    spatial = info.get('spatial_complexity')
+    temporal = info.get('temporal_complexity')
+    if spatial is not None and temporal is not None:
+        cq += ComplexityScores(spatial, temporal).cq_offset
+
     # 4) garde-fous VBR
     maxrate = int(target_br * 1.30)
     bufsize = int(target_br * 2.00)
@@ -178,78 +191,60 @@ def pick_params_from_source(info):
         "tile_columns": str(tiles)
     }
 
-def get_subtitles(video_path, log):
-    """_summary_
+def stream_bitrate(stream: dict) -> int:
+    """ Bitrate of one ffprobe stream: its bit_rate field, or the statistics tags mkvmerge writes.
 
     Args:
-        video_path (str): path to the video file
-        log (function): logging function
-
-    Raises:
-        FileNotFoundError: if the video file does not exist
-        Exception: on ffprobe error
+        stream (dict): stream of the ffprobe output
 
     Returns:
-        bool: True if the extraction was successful, False otherwise
+        int: bitrate in bps, 0 if unknown
     """
-    if not os.path.isfile(video_path):
-        raise FileNotFoundError(f"Fichier vidéo non trouvé : {video_path}")
-    command = [
-        "ffprobe",
-        "-v", "error",
-        "-select_streams", "s",
-        "-show_entries", "stream=index,codec_name,codec_type:stream_tags=language,title,handler_name",
-        "-of", "json",
-        video_path
-    ]
-
-    try:
-        res = subprocess.run(command, capture_output=True, text=True, check=True, encoding="utf-8", errors="replace")
-        data = json.loads(res.stdout)
-        subtitles = data.get("streams", [])
-        log(f"{len(subtitles)} piste(s) de sous-titres détectée(s)")
-        return subtitles
-    except subprocess.CalledProcessError as e:
-        stderr = e.stderr.decode('utf-8')
-        sys.stderr.write((f"Error: {e}:\n{stderr}\n"))
-        sys.exit(-1)
-
-def get_audio_data(video_path):
-    """ Get audio stream data from a video file.
+    tags = stream.get("tags") or {}
+    for value in (stream.get("bit_rate"), tags.get("BPS"), tags.get("BPS-eng")):
+        try:
+            if value and int(value) > 0:
+                return int(value)
+        except ValueError:
+            continue
+    return 0
+
+def video_bitrate(media: MediaInfo, track: VideoTrack, video_path: str | None = None) -> int:
+    """ Bitrate of the video track alone, in bps.
+
+    Without a bit_rate field, the Matroska BPS tags are used, then the packet index of
+    video_path if given (built once per file version, see models.packet_index). Failing
+    that, the overall bitrate of the file minus the other streams whose bitrate is known.
 
     Args:
-        video_path (str): path to the video file
-    Raises:
-        FileNotFoundError: _if the video file does not exist
-        Exception: _if there is an error reading the audio streams
+        media (MediaInfo): probe of the video file
+        track (VideoTrack): video track
+        video_path (str | None, optional): path to the video file, None to use the probe alone
+
     Returns:
-        list: list of audio streams in the video file
+        int: bitrate in bps, 0 if the file has neither a bitrate nor a duration
     """
-    if not os.path.isfile(video_path):
-        raise FileNotFoundError(f"Fichier vidéo non trouvé : {video_path}")
-    command = [
-        "ffprobe",
-        "-v", "error",
-        "-select_streams", "a",
-        "-show_entries", "stream=index,:stream_tags=language,handler_name",
-        "-of", "json",
-        video_path
-    ]
-    try:
-        res = subprocess.run(command, capture_output=True, text=True, check=True, encoding="utf-8", errors="replace")
-        data = json.loads(res.stdout)
-        audios = data.get("streams", [])
-        return audios
-    except subprocess.CalledProcessError as e:
-        stderr = e.stderr.decode('utf-8')
-        sys.stderr.write((f"Error: {e}:\n{stderr}\n"))
-        sys.exit(-1)
-
-def get_info(video_path):
+    streams = {stream.get("index"): stream for stream in media.raw.get("streams", []) or []}
+    own = stream_bitrate(streams.get(track.index, {"bit_rate": track.bit_rate}))
+    if own:
+        return own
+    if video_path is not None:
+        try:
+            stream = open_index(video_path).streams.get(track.index)
+            if stream is not None and stream.avg_bps:
+                return stream.avg_bps
+        except (ProbeError, OSError, ValueError):
+            pass
+    total = media.bit_rate or (int(media.size * 8 / media.duration) if media.duration else 0)
+    others = sum(stream_bitrate(stream) for index, stream in streams.items() if index != track.index)
+    return total - others if total > others else total
+
+def get_info(video_path, media: MediaInfo | None = None):
     """ Get transcoding information from the video file.
 
     Args:
         video_path (srt): path to the video file
+        media (MediaInfo, optional): probe of video_path, probed here if not given
 
     Raises:
         FileNotFoundError: _if the video file does not exist
@@ -258,28 +253,11 @@ def get_info(video_path):
     Returns:
         TranscodeData: transcoding data
     """
-    if not os.path.isfile(video_path):
-        raise FileNotFoundError(f"Fichier vidéo non trouvé : {video_path}")
-
-    size = os.path.getsize(video_path)
-
-    command = [
-        "ffprobe", "-v", "error",
-        "-select_streams", "v:0",
-        "-show_entries",
-        "stream=width,height,bit_rate,r_frame_rate,avg_frame_rate,pix_fmt,color_primaries,color_transfer,color_space,mastering_display_metadata,content_light_metadata,side_data_list",
-        "-show_entries",
-        "format=duration",
-        "-of", "json",
-        video_path
-    ]
-
-    res = subprocess.run(command, capture_output=True, text=True, check=True)
-    infos = json.loads(res.stdout)
-    if not infos.get("streams"):
+    media = media or probe(video_path)
+    infos: VideoTrack | None = media.video_track
+    if infos is None:
         raise RuntimeError("Aucune piste vidéo trouvée")
-    duration = float(infos.get("format").get("duration"))
-    infos: VideoTrack = VideoTrack.from_dict(infos.get("streams")[0])
+    duration = media.duration
     resolution = classify_resolution(infos.width, infos.height)
     resolution_param = get_resolution_param(resolution)
     framerate = get_framerate(infos.r_frame_rate, infos.avg_frame_rate)
@@ -295,19 +273,30 @@ def get_info(video_path):
         "framerate": framerate,
         "cq": resolution_param["cq"],
         "tile_columns": resolution_param["tile_columns"],
-        "bitrate": infos.bit_rate or int(size * 8 / duration),
+        "bitrate": video_bitrate(media, infos, video_path),
         "duration": duration,
     }
+    data["crop"] = detect_crop(video_path, media)
+    scores = analyze(video_path, media, crop=data["crop"])
+    if scores is not None:
+        data["spatial_complexity"] = scores.spatial
+        data["temporal_complexity"] = scores.temporal
     data |= pick_params_from_source(data)
     return data
 
-def transcode_video(video_path, output_path, log):
+def transcode_video(video_path, output_path, log, media: MediaInfo | None = None,
+                    encoders: list[str] | None = None, quality: QualityTarget | None = None,
+                    pacing: Pacing | None = None):
     """_summary_
 
     Args:
         video_path (str): path to the video file
         output_path (str): path to save the transcoded video
         log (function): logging function
+        media (MediaInfo, optional): probe of video_path, probed here if not given
+        encoders (list[str] | None, optional): AV1 encoders in order of preference, see available_backends
+        quality (QualityTarget | None, optional): target-quality CQ search, None to keep the default CQ
+        pacing (Pacing | None, optional): preset choice and throughput recording of the job
 
     Raises:
         FileNotFoundError: _if the video file does not exist
@@ -318,45 +307,23 @@ def transcode_video(video_path, output_path, log):
     if not os.path.isfile(video_path):
         raise FileNotFoundError(f"Fichier vidéo non trouvé : {video_path}")
 
-    info: TranscodeData = TranscodeData(**get_info(video_path))
+    media = media or probe(video_path)
+    info: TranscodeData = TranscodeData(**get_info(video_path, media))
 
-    pix_fmt_out = "yuv420p10le" if info.is_hdr else "yuv420p"
-    primaries, trc, cspace = (
-        ("bt2020","smpte2084","bt2020nc") if info.is_hdr else
-        ("bt709","bt709","bt709")
-    )
-    gop = str(int(round(2 * info.framerate)))
-    tiles = str(info.tile_columns)
-    cq = str(info.cq)
-    b_v = str(info.b_v)
-    maxrate = str(info.maxrate)
-    bufsize = str(info.bufsize)
+    audios = media.audio
+    subtitles = media.subtitles
 
-    audios = get_audio_data(video_path)
-    subtitles = get_subtitles(video_path, log)
-
-    # Si dispo dans la source alors on rajoute -mastering_display et -content_light
     command = [
-        "ffmpeg",
-        "-hwaccel","cuda",
-        "-i", video_path,
         "-map","0:v:0","-map","0:a?","-map","0:s?",
-        "-pix_fmt", pix_fmt_out,
-        "-c:v","av1_nvenc","-preset","p3",
-        "-rc","vbr","-b:v", b_v, "-maxrate", maxrate, "-bufsize", bufsize,
-        "-cq", cq,
-        "-g", gop,"-rc-lookahead","32","-spatial-aq","1","-temporal-aq","1",
-        "-tile-columns", tiles,"-tile-rows","1",
-        "-color_primaries", primaries,"-color_trc", trc,"-colorspace", cspace,"-color_range","tv",
-        "-c:a","copy",        
+        "-c:a","copy",
     ]
 
     index_out = 0
     for audio in audios:
         command += [
-            f"-metadata:s:a:{index_out}", f"language={audio.get('tags', {}).get('language','und')}",
-            f"-metadata:s:a:{index_out}", f"handler_name={audio.get('tags', {}).get('handler_name','Unknown')}",
-            f"-metadata:s:a:{index_out}", f"title={audio.get('tags', {}).get('handler_name','Unknown')}",
+            f"-metadata:s:a:{index_out}", f"language={audio.tags.language}",
+            f"-metadata:s:a:{index_out}", f"handler_name={audio.tags.title}",
+            f"-metadata:s:a:{index_out}", f"title={audio.tags.title}",
         ]
         index_out += 1
     
@@ -367,41 +334,30 @@ def transcode_video(video_path, output_path, log):
     index_out = 0
     for subtitle in subtitles:
         command += [
-            f"-metadata:s:s:{index_out}", f"language={subtitle.get('tags', {}).get('language','und')}",
-            f"-metadata:s:s:{index_out}", f"handler_name={subtitle.get('tags', {}).get('handler_name','Unknown')}",
-            f"-metadata:s:s:{index_out}", f"title={subtitle.get('tags', {}).get('handler_name','Unknown')}",
+            f"-metadata:s:s:{index_out}", f"language={subtitle.tags.get('language','und')}",
+            f"-metadata:s:s:{index_out}", f"handler_name={subtitle.tags.get('handler_name','Unknown')}",
+            f"-metadata:s:s:{index_out}", f"title={subtitle.tags.get('handler_name','Unknown')}",
         ]
         index_out += 1
 
     command += [
         "-movflags", "+faststart",
-        "-stats","-stats_period","5","-loglevel","info",
+        "-loglevel","info",
         f"{output_path}"
     ]
 
-    process = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        encoding="utf-8",
-        errors="replace",
-        bufsize=1
-    )
-
-    for line in process.stdout:
-        if "frame=" in line or "time=" in line or "Video" in line:
-            sys.stdout.write(line)
-            sys.stdout.flush()
-
-    result = False
-
-    ret = process.wait()
-    if ret == 0:
-        result = True
+    # Si dispo dans la source alors on rajoute -mastering_display et -content_light
+    def build_command(backend: EncoderBackend) -> list[str]:
+        tuned = tune_info(video_path, os.path.dirname(output_path) or ".", log, media, info, backend, quality, pacing)
+        return ["ffmpeg", *backend.input_args(), "-i", video_path, *backend.video_args(tuned), *command]
+
+    run = encode_with_fallback(build_command, os.path.basename(video_path), info.duration, log,
+                               preferred=encoders, output_path=output_path,
+                               on_success=pacing.record if pacing is not None else None)
+    if run is None:
+        return False
+    if run.success:
         log("✅ Transcode vidéo ok", "OK")
     else:
-        result = False
-        log(f"❌ Échec pour le transcode vidéo (code retour {ret})", "ERROR")
-
-    return result
+        report_failure(run, "le transcode vidéo", log)
+    return run.success
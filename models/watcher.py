@@ -0,0 +1,236 @@
+"""Watch ingest folders and hand over video files once they are completely written."""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from models.catalog import VIDEO_EXTENSIONS, walk_videos
+
+STABLE_SECONDS = 30.0
+POLL_INTERVAL = 10.0
+TICK_SECONDS = 1.0
+
+# inotify(7) event bits
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+_EVENT = struct.Struct("iIII")
+
+class InotifyWatcher:
+    """Recursive inotify watch of directories (Linux only), reporting the video files that changed.
+
+    A new directory that cannot be watched (watch limit reached, unreadable) is kept in
+    unwatched, for the caller to poll it instead.
+    """
+
+    def __init__(self, directories: list[str], log):
+        self.log = log
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify n'existe que sous Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self._dirs: dict[int, str] = {}
+        self.unwatched: set[str] = set()
+        try:
+            for directory in directories:
+                self._add_tree(directory)
+        except OSError:
+            # EMFILE, or ENOSPC once the watch limit is reached: the caller falls back to polling
+            os.close(self.fd)
+            raise
+
+    def close(self):
+        """Release the inotify descriptor."""
+        os.close(self.fd)
+
+    def _add_tree(self, root: str):
+        for current, _, _ in os.walk(root):
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(current), _WATCH_MASK)
+            if wd < 0:
+                # ENOSPC: fs.inotify.max_user_watches reached
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch {current}")
+            self._dirs[wd] = current
+
+    def _add_new_tree(self, path: str):
+        """Watch a directory created or moved in, leaving it to polling if inotify refuses it."""
+        try:
+            self._add_tree(path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                # Removed before it could be watched
+                return
+            self.log(f"Surveillance inotify impossible de {path} ({e}), dossier scruté périodiquement", "WARN")
+            self.unwatched.add(path)
+
+    def read(self, timeout: float) -> tuple[set[str], set[str]]:
+        """ Wait for events and collect them.
+
+        Args:
+            timeout (float): maximum seconds to wait
+
+        Returns:
+            tuple[set[str], set[str]]: video files that changed, and directories to rescan
+                (new directories, or every watched root after a queue overflow)
+        """
+        changed: set[str] = set()
+        rescan: set[str] = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changed, rescan
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0"))
+                offset += _EVENT.size + length
+                if mask & _IN_Q_OVERFLOW:
+                    rescan.update(self._dirs.values())
+                    continue
+                directory = self._dirs.get(wd)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, name)
+                if mask & _IN_ISDIR:
+                    if mask & (_IN_CREATE | _IN_MOVED_TO):
+                        self._add_new_tree(path)
+                        rescan.add(path)
+                elif name.lower().endswith(VIDEO_EXTENSIONS):
+                    changed.add(path)
+        return changed, rescan
+
+class WriteTracker:
+    """Follow candidate files until their size and mtime have not changed for stable_seconds."""
+
+    def __init__(self, stable_seconds: float = STABLE_SECONDS):
+        self.stable_seconds = stable_seconds
+        # path -> (size, mtime, monotonic time since which they are unchanged)
+        self._candidates: dict[str, tuple[int, float, float]] = {}
+        # path -> (size, mtime) when it was handed over, to ignore it until it changes again
+        self._handed: dict[str, tuple[int, float]] = {}
+        self._last_prune = time.monotonic()
+
+    def observe(self, path: str, stat: os.stat_result | None = None):
+        """ Register a file that appeared or changed.
+
+        Args:
+            path (str): path of the file
+            stat (os.stat_result | None, optional): stat of the file if already known
+        """
+        try:
+            stat = stat or os.stat(path)
+        except FileNotFoundError:
+            self._candidates.pop(path, None)
+            return
+        signature = (stat.st_size, stat.st_mtime)
+        if self._handed.get(path) == signature:
+            return
+        previous = self._candidates.get(path)
+        if previous is None or previous[:2] != signature:
+            self._candidates[path] = (*signature, time.monotonic())
+
+    def ready(self) -> list[str]:
+        """ Check every candidate and return those whose writing is over.
+
+        Returns:
+            list[str]: files stable for stable_seconds, each returned once per version
+        """
+        now = time.monotonic()
+        done = []
+        for path in list(self._candidates):
+            self.observe(path)
+            candidate = self._candidates.get(path)
+            if candidate is None:
+                continue
+            size, mtime, since = candidate
+            if size > 0 and now - since >= self.stable_seconds:
+                del self._candidates[path]
+                self._handed[path] = (size, mtime)
+                done.append(path)
+        if now - self._last_prune >= self.stable_seconds:
+            self._prune_handed()
+            self._last_prune = now
+        return done
+
+    def _prune_handed(self):
+        """Forget the handed over files that were since deleted or moved away, so the daemon does not grow."""
+        for path in list(self._handed):
+            if not os.path.exists(path):
+                del self._handed[path]
+
+def watch_folders(directories: list[str], on_ready, log, stop: threading.Event,
+                  stable_seconds: float = STABLE_SECONDS, poll_interval: float = POLL_INTERVAL,
+                  exclude: list[str] | None = None):
+    """ Watch folders until stop is set, calling on_ready once for each completely written video file.
+
+    Files already present are picked up too. inotify is used when available, otherwise the
+    folders are rescanned every poll_interval seconds.
+
+    Args:
+        directories (list[str]): ingest folders, watched recursively
+        on_ready (function): called with the path of each file ready to be processed
+        log (function): logging function
+        stop (threading.Event): set to end the watch
+        stable_seconds (float, optional): seconds without size or mtime change. Defaults to STABLE_SECONDS.
+        poll_interval (float, optional): seconds between two rescans without inotify. Defaults to POLL_INTERVAL.
+        exclude (list[str] | None, optional): folders to ignore, e.g. the output and temp folders
+    """
+    directories = [os.path.abspath(d) for d in directories]
+    excluded = tuple(os.path.join(os.path.abspath(d), "") for d in exclude or [] if d)
+    tracker = WriteTracker(stable_seconds)
+
+    def observe(path: str, stat: os.stat_result | None = None):
+        if not path.startswith(excluded):
+            tracker.observe(path, stat)
+
+    def rescan(roots):
+        for root in roots:
+            for path, stat in walk_videos(root):
+                observe(path, stat)
+
+    try:
+        inotify = InotifyWatcher(directories, log)
+        log(f"Surveillance inotify de {', '.join(directories)}", "INFO")
+    except OSError as e:
+        inotify = None
+        log(f"inotify indisponible ({e}), scrutation toutes les {poll_interval:g}s", "WARN")
+
+    rescan(directories)
+    last_scan = time.monotonic()
+    try:
+        while not stop.is_set():
+            if inotify is not None:
+                changed, roots = inotify.read(TICK_SECONDS)
+                for path in changed:
+                    observe(path)
+                rescan(roots)
+                if inotify.unwatched and time.monotonic() - last_scan >= poll_interval:
+                    rescan(list(inotify.unwatched))
+                    last_scan = time.monotonic()
+            else:
+                stop.wait(TICK_SECONDS)
+                if time.monotonic() - last_scan >= poll_interval:
+                    rescan(directories)
+                    last_scan = time.monotonic()
+            for path in tracker.ready():
+                if not stop.is_set():
+                    log(f"Fichier prêt : {path}", "INFO")
+                    on_ready(path)
+    finally:
+        if inotify is not None:
+            inotify.close()
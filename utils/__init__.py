@@ -1,6 +1,11 @@
 """Utility module for media handling."""
 
 from .audio import AudioStream, AudioTag, AudioTrack
+from .media import MediaInfo
+from .subtitle import SubtitleTrack
 from .video import VideoTrack, TranscodeData
 
-__all__ = ["AudioTrack", "AudioStream", "AudioTag", "VideoTrack", "TranscodeData"]
+__all__ = [
+    "AudioTrack", "AudioStream", "AudioTag", "MediaInfo",
+    "SubtitleTrack", "VideoTrack", "TranscodeData",
+]
@@ -2,7 +2,7 @@
 Data classes for representing audio stream and track information.
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 @dataclass
 class AudioTag:
@@ -18,6 +18,8 @@ class AudioTrack:
     tags: AudioTag
     channels: int = 2
     bit_rate: int = 0
+    channel_layout: str = ""
+    disposition: dict = field(default_factory=dict)
 
     @classmethod
     def from_dict(cls, data: dict) -> "AudioTrack":
@@ -32,13 +34,15 @@ class AudioTrack:
         tags_data = data.get("tags", {})
         return cls(
             index=data["index"],
-            codec_name=data["codec_name"],
+            codec_name=data.get("codec_name", "unknown"),
             tags=AudioTag(
                 language=tags_data.get("language", "und"),
-                title=tags_data.get("handler_name", "Unknown"),
+                title=tags_data.get("handler_name") or tags_data.get("title", "Unknown"),
             ),
             channels=data.get("channels", 2),
-            bit_rate=data.get("bit_rate", 0)
+            bit_rate=data.get("bit_rate", 0),
+            channel_layout=data.get("channel_layout", ""),
+            disposition=data.get("disposition", {}),
         )
 
 @dataclass
@@ -0,0 +1,209 @@
+"""Non-blocking logging: records queued to a background thread, console lines and rotating JSON lines."""
+
+import atexit
+import contextlib
+from datetime import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# Custom levels between the standard ones: OK is a success worth showing, PROGRESS is periodic
+OK = 25
+PROGRESS = 15
+LEVELS = {"ERROR": logging.ERROR, "WARN": logging.WARNING, "OK": OK, "INFO": logging.INFO, "PROGRESS": PROGRESS}
+COLORS = {
+    "ERROR": "\033[91m",    # rouge
+    "OK": "\033[92m",       # vert
+    "WARN": "\033[93m",     # jaune
+    "INFO": "\033[94m",     # bleu
+}
+RESET = "\033[0m"
+# Minimum seconds between two progress records of the same key
+PROGRESS_INTERVAL = 5.0
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUPS = 5
+
+_NAMES = {number: name for name, number in LEVELS.items()}
+logging.addLevelName(OK, "OK")
+logging.addLevelName(PROGRESS, "PROGRESS")
+
+_logger = logging.getLogger("transcode")
+_logger.propagate = False
+_logger.setLevel(PROGRESS)
+_context = threading.local()
+_listener: logging.handlers.QueueListener | None = None
+_setup_lock = threading.RLock()
+# Callable (stream, line) printing the console lines, set by a view redrawn on the same terminal
+_console_writer = None
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """ Attach fields (job, file, stage...) to every record logged by the calling thread in this block.
+
+    Args:
+        **fields: values added to the records, None values are ignored
+    """
+    previous = getattr(_context, "fields", {})
+    _context.fields = {**previous, **{key: value for key, value in fields.items() if value is not None}}
+    try:
+        yield
+    finally:
+        _context.fields = previous
+
+class ContextFilter(logging.Filter):
+    """Copy the context of the calling thread into the record, before it leaves the thread."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.fields = {**getattr(_context, "fields", {}), **getattr(record, "fields", {})}
+        return True
+
+class ProgressFilter(logging.Filter):
+    """Let through at most one progress record per key and per interval."""
+
+    def __init__(self, interval: float = PROGRESS_INTERVAL):
+        super().__init__()
+        self.interval = interval
+        self._last: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != PROGRESS:
+            return True
+        key = str(record.fields.get("key") or record.fields.get("job") or "")
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(key, -self.interval) < self.interval:
+                return False
+            self._last[key] = now
+            if len(self._last) > 4096:
+                # Keys of finished jobs never come back
+                oldest = sorted(self._last, key=self._last.get)[:2048]
+                for old in oldest:
+                    del self._last[old]
+        return True
+
+class ConsoleFormatter(logging.Formatter):
+    """The historical `[LEVEL] HH:MM:SS | message` lines, colored only for a terminal."""
+
+    def __init__(self, color: bool):
+        super().__init__()
+        self.color = color
+
+    def format(self, record: logging.LogRecord) -> str:
+        level = _NAMES.get(record.levelno, record.levelname)
+        line = f"[{level}] {datetime.fromtimestamp(record.created).strftime('%H:%M:%S')} | {record.getMessage()}"
+        color = COLORS.get(level, "") if self.color else ""
+        return f"{color}{line}{RESET}" if color else line
+
+class ConsoleHandler(logging.StreamHandler):
+    """Console handler handing its lines to the registered console writer, if any."""
+
+    def emit(self, record: logging.LogRecord):
+        writer = _console_writer
+        if writer is None:
+            super().emit(record)
+            return
+        try:
+            writer(self.stream, self.format(record))
+        except Exception:
+            self.handleError(record)
+
+def set_console_writer(writer):
+    """ Let a view drawn in place on the terminal (the progress board) print the console lines,
+    so that a line never lands in the middle of a redraw.
+
+    Args:
+        writer (function): (stream, line) -> None, None to write to the stream directly
+    """
+    global _console_writer
+    _console_writer = writer
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the context fields of the record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": _NAMES.get(record.levelno, record.levelname),
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+            **getattr(record, "fields", {}),
+        }
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def _console_filter(stream):
+    # On a terminal the progress board is redrawn in place, progress records would duplicate it
+    drop_progress = stream.isatty()
+    return lambda record: not (drop_progress and record.levelno == PROGRESS)
+
+def setup_logging(log_file: str | None = None, progress_interval: float = PROGRESS_INTERVAL,
+                  max_bytes: int = LOG_MAX_BYTES, backups: int = LOG_BACKUPS, stream=None):
+    """ Configure the process-wide log: console, and optionally a rotating JSON-lines file.
+
+    Callers only enqueue the records; a background thread formats and writes them.
+    Calling it again replaces the previous configuration.
+
+    Args:
+        log_file (str | None, optional): JSON-lines file, rotated at max_bytes
+        progress_interval (float, optional): minimum seconds between two progress records of a job
+        max_bytes (int, optional): size of the log file before rotation. Defaults to LOG_MAX_BYTES.
+        backups (int, optional): rotated files kept. Defaults to LOG_BACKUPS.
+        stream (optional): console stream. Defaults to sys.stdout.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+        for handler in list(_logger.handlers):
+            _logger.removeHandler(handler)
+
+        stream = stream or sys.stdout
+        console = ConsoleHandler(stream)
+        console.setFormatter(ConsoleFormatter(color=stream.isatty() and not os.getenv("NO_COLOR")))
+        console.addFilter(_console_filter(stream))
+        handlers = [console]
+        if log_file:
+            os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+            rotating = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backups,
+                                                            encoding="utf-8")
+            rotating.setFormatter(JsonFormatter())
+            handlers.append(rotating)
+
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        enqueue = logging.handlers.QueueHandler(records)
+        enqueue.addFilter(ContextFilter())
+        enqueue.addFilter(ProgressFilter(progress_interval))
+        _logger.addHandler(enqueue)
+        _listener = logging.handlers.QueueListener(records, *handlers)
+        _listener.start()
+
+def shutdown_logging():
+    """Write the records still queued and stop the background thread."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+        for handler in list(_logger.handlers):
+            _logger.removeHandler(handler)
+
+atexit.register(shutdown_logging)
+
+def log(msg: str, level="INFO", **fields):
+    """function to log messages with different severity levels.
+
+    Args:
+        msg (str): message to log
+        level (str, optional): Defaults to "INFO". Possible values: "ERROR", "OK", "WARN", "INFO", "PROGRESS".
+        **fields: structured values added to the JSON record
+    """
+    if _listener is None:
+        with _setup_lock:
+            if _listener is None:
+                setup_logging()
+    _logger.log(LEVELS.get(level, logging.INFO), msg, extra={"fields": fields} if fields else None)
@@ -0,0 +1,73 @@
+"""Data class representing everything a single ffprobe call tells about a file."""
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .audio import AudioTrack
+from .subtitle import SubtitleTrack
+from .video import VideoTrack
+
+@dataclass
+class MediaInfo:
+    """Class representing a probed media file (format, chapters and typed tracks)."""
+    path: str
+    size: int
+    mtime: float
+    duration: float = 0.0
+    start_time: float = 0.0
+    format_name: str = ""
+    bit_rate: int = 0
+    video: list[VideoTrack] = field(default_factory=list)
+    audio: list[AudioTrack] = field(default_factory=list)
+    subtitles: list[SubtitleTrack] = field(default_factory=list)
+    chapters: list[dict] = field(default_factory=list)
+    raw: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_probe(cls, path: str, size: int, mtime: float, data: dict) -> "MediaInfo":
+        """Create a MediaInfo instance from the JSON output of ffprobe.
+
+        Args:
+            path (str): path of the probed file
+            size (int): size of the file in bytes
+            mtime (float): modification time of the file
+            data (dict): parsed output of `ffprobe -show_streams -show_format -show_chapters`
+
+        Returns:
+            MediaInfo: instance of MediaInfo
+        """
+        fmt = data.get("format", {}) or {}
+        info = cls(
+            path=path,
+            size=size,
+            mtime=mtime,
+            duration=float(fmt.get("duration") or 0.0),
+            start_time=float(fmt.get("start_time") or 0.0),
+            format_name=fmt.get("format_name", ""),
+            bit_rate=int(fmt.get("bit_rate") or 0),
+            chapters=data.get("chapters", []) or [],
+            raw=data,
+        )
+        for stream in data.get("streams", []) or []:
+            match stream.get("codec_type"):
+                case "video":
+                    info.video.append(VideoTrack.from_dict(stream))
+                case "audio":
+                    info.audio.append(AudioTrack.from_dict(stream))
+                case "subtitle":
+                    info.subtitles.append(SubtitleTrack.from_dict(stream))
+        return info
+
+    @property
+    def video_track(self) -> Optional[VideoTrack]:
+        """First real video track (cover pictures are skipped), None if there is none."""
+        for track in self.video:
+            if not track.is_attached_pic:
+                return track
+        return None
+
+    @property
+    def is_av1_mp4(self) -> bool:
+        """True if the file already is what the pipeline produces: AV1 video in an MP4 container."""
+        video = self.video_track
+        return video is not None and video.codec_name == "av1" and "mp4" in self.format_name.split(",")
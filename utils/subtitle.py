@@ -0,0 +1,28 @@
+"""Data classes for representing subtitle track information."""
+
+from dataclasses import dataclass, field
+
+@dataclass
+class SubtitleTrack:
+    """Class representing a subtitle track."""
+    index: int
+    codec_name: str
+    tags: dict = field(default_factory=dict)
+    disposition: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SubtitleTrack":
+        """Create a SubtitleTrack instance from a dictionary.
+
+        Args:
+            data (dict): dictionary containing subtitle track information.
+
+        Returns:
+            SubtitleTrack: instance of SubtitleTrack
+        """
+        return cls(
+            index=data["index"],
+            codec_name=data.get("codec_name", "unknown"),
+            tags=data.get("tags", {}) or {},
+            disposition=data.get("disposition", {}) or {},
+        )
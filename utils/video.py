@@ -17,6 +17,9 @@ class VideoTrack:
     content_light_metadata: Optional[str] = None
     side_data_list: Optional[list] = None
     mastering_display_metadata: Optional[str] = None
+    index: int = 0
+    codec_name: str = "unknown"
+    disposition: Optional[dict] = None
 
     @classmethod
     def from_dict(cls, data: dict) -> "VideoTrack":
@@ -30,8 +33,16 @@ class VideoTrack:
         """
         allowed_keys = {f.name for f in fields(cls)}
         filtered = {k: v for k, v in data.items() if k in allowed_keys}
+        for key in ("pix_fmt", "color_primaries", "color_transfer", "width", "height",
+                    "r_frame_rate", "avg_frame_rate", "color_space"):
+            filtered.setdefault(key, None)
         return cls(**filtered)
 
+    @property
+    def is_attached_pic(self) -> bool:
+        """True if the track is a cover picture rather than real video."""
+        return bool((self.disposition or {}).get("attached_pic"))
+
 @dataclass
 class TranscodeData:
     """Class representing transcoding data."""
@@ -49,3 +60,7 @@ class TranscodeData:
     bitrate: int
     duration: float
     mastering_display_metadata: Optional[str]
+    spatial_complexity: Optional[float] = None
+    temporal_complexity: Optional[float] = None
+    crop: Optional[str] = None
+    preset: Optional[str] = None